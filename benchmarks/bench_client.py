@@ -0,0 +1,199 @@
+"""Measure Client's latency and throughput against a local feed server.
+
+Usage: python benchmarks/bench_client.py [-n REQUESTS] [-w WORKERS]
+           [--latency SECONDS] [--padding BYTES] [--error-rate RATE]
+           [--transport {urllib,pooled}] [-o FILE]
+
+This starts test/server.py's FeedServer, which serves the weather, 5-day
+LID and WOEID lookup documents in test/data, and points the module's URL
+constants at it. The server can wait before each response, pad each
+document and answer a share of the requests with 503 errors.
+
+fetch_weather (by WOEID and by LID), fetch_lid and fetch_woeid are each
+measured in three modes: sequential calls, calls from a pool of threads, and
+(for fetch_weather) one fetch_weather_many call. Every call asks for a
+different location, so nothing is cached or coalesced.
+
+The results are written as JSON: the run's configuration and, for each
+operation and mode, the number of requests and errors, the wall-clock time,
+the throughput in requests per second and the latency percentiles in
+seconds. fetch_weather_many doesn't expose each call's latency, so its
+percentiles are null.
+
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import yweather  # noqa: E402
+from test.server import FeedServer  # noqa: E402
+
+URLS = ("WOEID_LOOKUP_URL", "WEATHER_URL", "LID_LOOKUP_URL",
+        "LID_WEATHER_URL")
+
+
+def percentile(values, q):
+    """Return the nearest-rank *q*th percentile of the sorted *values*."""
+    if not values:
+        return None
+    rank = max(int(round(q / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(operation, mode, latencies, errors, seconds, requests):
+    """Return one result of the run as a dict."""
+    latencies = sorted(latencies)
+    result = {
+        "operation": operation,
+        "mode": mode,
+        "requests": requests,
+        "errors": errors,
+        "seconds": seconds,
+        "throughput": requests / seconds if seconds else None,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+    }
+    for q in (50, 90, 99):
+        result["p%d" % q] = percentile(latencies, q)
+    return result
+
+
+def timed(call, arg):
+    """Call *call* with *arg* and return its latency and whether it
+    failed."""
+    started = time.perf_counter()
+    try:
+        call(arg)
+    except Exception:
+        return time.perf_counter() - started, True
+    return time.perf_counter() - started, False
+
+
+def run_sequential(call, args):
+    return [timed(call, arg) for arg in args]
+
+
+def run_threaded(call, args, workers):
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(lambda arg: timed(call, arg), args))
+
+
+def operations(client):
+    """Return the measured operations as (name, call, argument maker)
+    tuples."""
+    return (
+        ("fetch_weather", client.fetch_weather, lambda i: str(i)),
+        ("fetch_weather_lid", client.fetch_weather,
+         lambda i: "USNC%04d" % i),
+        ("fetch_lid", client.fetch_lid, lambda i: str(i)),
+        ("fetch_woeid", client.fetch_woeid, lambda i: "City %d" % i),
+    )
+
+
+def run(client, requests, workers):
+    """Run every operation in every mode and return the results."""
+    results = []
+    offset = 0
+    for name, call, make_arg in operations(client):
+        for mode in ("sequential", "threaded"):
+            args = [make_arg(offset + i) for i in range(requests)]
+            offset += requests
+            started = time.perf_counter()
+            if mode == "sequential":
+                samples = run_sequential(call, args)
+            else:
+                samples = run_threaded(call, args, workers)
+            seconds = time.perf_counter() - started
+            results.append(summarize(
+                name, mode, [latency for latency, failed in samples],
+                sum(failed for latency, failed in samples), seconds,
+                requests))
+
+    for name, make_arg in (("fetch_weather", str),
+                           ("fetch_weather_lid", lambda i: "USNC%04d" % i)):
+        ids = [make_arg(offset + i) for i in range(requests)]
+        offset += requests
+        started = time.perf_counter()
+        errors = sum(result.error is not None for result in
+                     client.fetch_weather_many(ids, max_workers=workers))
+        seconds = time.perf_counter() - started
+        results.append(summarize(name, "bulk", [], errors, seconds,
+                                 requests))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--requests", type=int, default=200,
+                        help="requests per operation and mode "
+                             "(default: 200)")
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="threads in the threaded and bulk modes "
+                             "(default: 8)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds the server waits before each "
+                             "response (default: 0)")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="bytes added to each document (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="share of requests answered with 503 "
+                             "(default: 0)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the injected errors (default: 0)")
+    parser.add_argument("--transport", choices=("urllib", "pooled"),
+                        default="pooled",
+                        help="the client's transport (default: pooled)")
+    parser.add_argument("-o", "--output",
+                        help="write the JSON results to this file instead "
+                             "of stdout")
+    args = parser.parse_args()
+
+    server = FeedServer(latency=args.latency, padding=args.padding,
+                        error_rate=args.error_rate, seed=args.seed).start()
+    saved = dict((name, getattr(yweather, name)) for name in URLS)
+    for name in URLS:
+        setattr(yweather, name, server.url(saved[name]))
+    if args.transport == "pooled":
+        transport = yweather.PooledTransport(pool_size=args.workers)
+    else:
+        transport = yweather.UrllibTransport()
+    try:
+        results = run(yweather.Client(transport=transport), args.requests,
+                      args.workers)
+    finally:
+        if args.transport == "pooled":
+            transport.close()
+        for name, url in saved.items():
+            setattr(yweather, name, url)
+        server.stop()
+
+    report = {
+        "config": {
+            "requests": args.requests,
+            "workers": args.workers,
+            "latency": args.latency,
+            "padding": args.padding,
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+            "transport": args.transport,
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Compare the whole-tree and single-pass weather feed parsers.
+
+Usage: python benchmarks/bench_parse.py [-n NUMBER]
+
+For each weather feed in test/data, this times parsing the document into an
+ElementTree and extracting the weather data with the reference
+test.tree.parse_weather against extracting it while streaming with
+Client._iterparse_weather.
+
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+import xml.etree.ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import yweather  # noqa: E402
+from test.tree import parse_weather  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "test", "data")
+FEEDS = ("data_weather.xml", "data_5day.xml")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=2000,
+                        help="parses per measurement (default: 2000)")
+    args = parser.parse_args()
+
+    client = yweather.Client()
+    for name in FEEDS:
+        with open(os.path.join(DATA_DIR, name), "rb") as f:
+            data = f.read()
+
+        def tree():
+            root = xml.etree.ElementTree.parse(io.BytesIO(data)).getroot()
+            return parse_weather(client, root, "f")
+
+        def stream():
+            return client._iterparse_weather(io.BytesIO(data), "f")
+
+        assert tree() == stream()
+        tree_time = min(timeit.repeat(tree, number=args.number, repeat=5))
+        stream_time = min(timeit.repeat(stream, number=args.number,
+                                        repeat=5))
+        print("%-18s tree %8.1f us  iterparse %8.1f us  (%.2fx)" % (
+            name, tree_time / args.number * 1e6,
+            stream_time / args.number * 1e6, tree_time / stream_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare the parser backends on the documents in test/data.
+
+Usage: python benchmarks/bench_parsers.py [-n NUMBER]
+
+For each weather feed, this times Client._iterparse_weather (reading the
+feed and extracting every field) and the parser's link() (reading a feed's
+LID link), and for the placefinder result it times the parser's results().
+Each is measured with ElementTreeParser, ExpatParser and, if lxml is
+installed, LxmlParser, after checking that every parser returns the same
+result.
+
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import yweather  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "test", "data")
+FEEDS = ("data_weather.xml", "data_5day.xml")
+
+
+def parsers():
+    """Return the available parsers as (name, parser) pairs."""
+    parsers = [("etree", yweather.ElementTreeParser()),
+               ("expat", yweather.ExpatParser())]
+    try:
+        parsers.append(("lxml", yweather.LxmlParser()))
+    except ImportError:
+        print("lxml isn't installed; skipping LxmlParser")
+    return parsers
+
+
+def read(name):
+    with open(os.path.join(DATA_DIR, name), "rb") as f:
+        return f.read()
+
+
+def measure(function, number):
+    """Return the fastest time per call of *function* in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def compare(label, calls, number):
+    """Check that *calls* return the same result and print their times."""
+    results = [call() for (name, call) in calls]
+    assert all(result == results[0] for result in results), label
+    times = [(name, measure(call, number)) for (name, call) in calls]
+    baseline = times[0][1]
+    print("%-26s %s" % (label, "  ".join(
+        "%s %7.1f us (%.2fx)" % (name, seconds, baseline / seconds)
+        for (name, seconds) in times)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=2000,
+                        help="calls per measurement (default: 2000)")
+    args = parser.parse_args()
+
+    backends = parsers()
+    for feed in FEEDS:
+        data = read(feed)
+        clients = [(name, yweather.Client(parser=backend))
+                   for (name, backend) in backends]
+        compare("%s weather" % feed,
+                [(name, lambda client=client: client._iterparse_weather(
+                    io.BytesIO(data), "f")) for (name, client) in clients],
+                args.number)
+        compare("%s link" % feed,
+                [(name, lambda backend=backend: backend.link(
+                    io.BytesIO(data))) for (name, backend) in backends],
+                args.number * 5)
+
+    data = read("data_woeid.xml")
+    compare("data_woeid.xml results",
+            [(name, lambda backend=backend: backend.results(io.BytesIO(data)))
+             for (name, backend) in backends], args.number * 5)
+
+
+if __name__ == "__main__":
+    main()
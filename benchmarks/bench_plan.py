@@ -0,0 +1,79 @@
+"""Measure the per-call cost of fetch_weather's extraction plan.
+
+Usage: python benchmarks/bench_plan.py [-n NUMBER]
+
+This times the parts of a fetch_weather call that don't touch the network:
+choosing the feed URL for an id, reading the LID from a feed's link, and
+extracting the weather data from each weather feed in test/data with a
+client that returns every field and with one that only returns condition
+and wind. The URL and LID lookups are compared with the uncompiled
+re.match and re.search calls that they replace.
+
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import yweather  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "test", "data")
+FEEDS = ("data_weather.xml", "data_5day.xml")
+LINK = ("http://us.rd.yahoo.com/dailynews/rss/weather/Raleigh__NC/"
+        "*http://weather.yahoo.com/forecast/USNC0558_f.html")
+
+
+def measure(function, number):
+    """Return the fastest time per call of *function* in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def report(name, before, after):
+    print("%-34s %8.2f us -> %8.2f us  (%.2fx)" % (
+        name, before, after, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=2000,
+                        help="calls per measurement (default: 2000)")
+    args = parser.parse_args()
+    number = args.number
+
+    client = yweather.Client()
+    subset = yweather.Client(fields=("condition", "wind"))
+
+    for id in ("2478307", "USNC0558"):
+        report("weather url (%s)" % id,
+               measure(lambda: re.match("^[A-Za-z]", id), number * 10),
+               measure(lambda: yweather._LID_START_PATTERN.match(id),
+                       number * 10))
+    report("lid from link",
+           measure(lambda: re.search("[A-Za-z]{4}[0-9]{4}", LINK),
+                   number * 10),
+           measure(lambda: yweather._LID_PATTERN.search(LINK), number * 10))
+
+    for name in FEEDS:
+        with open(os.path.join(DATA_DIR, name), "rb") as f:
+            data = f.read()
+        report("%s condition+wind only" % name,
+               measure(lambda: client._iterparse_weather(io.BytesIO(data),
+                                                         "f"), number),
+               measure(lambda: subset._iterparse_weather(io.BytesIO(data),
+                                                         "f"), number))
+        items = client._iterparse_items(io.BytesIO(data), "f")
+        subset_items = subset._iterparse_items(io.BytesIO(data), "f")
+        report("%s post-processing" % name,
+               measure(lambda: client._finish_weather(dict(items), "f"),
+                       number * 10),
+               measure(lambda: subset._finish_weather(dict(subset_items),
+                                                      "f"), number * 10))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,14 +20,18 @@ setup(
         'Operating System :: OS Independent',
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         ],
+    python_requires='>=3.7',
     keywords=['weather', 'yahoo', 'interface', 'wrapper', 'api'],
     py_modules=['yweather'],
+    entry_points={
+        'console_scripts': ['yweather-sweep = yweather:sweep_main'],
+    },
     test_suite='test',
 )
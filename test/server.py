@@ -0,0 +1,155 @@
+"""A local stand-in for the Yahoo! Weather servers.
+
+FeedServer serves the XML documents in test/data over HTTP/1.1 with
+keep-alive, so the network code can be exercised without going out to
+Yahoo!. Each document has an ETag, and conditional requests for an unchanged
+document are answered with 304 Not Modified.
+
+The server can also be made to behave more like a distant, busy one: it can
+wait before each response, pad each document to a larger size and answer a
+share of the requests with 503 Service Unavailable. The benchmarks use this.
+
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import os
+import random
+import threading
+import time
+import zlib
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+LAST_MODIFIED = "Tue, 25 Dec 2012 03:50:00 GMT"
+
+
+def read_data(name, padding=0):
+    """Return the contents of the data file *name* as bytes, padded with a
+    comment of *padding* bytes before the closing root tag."""
+    with open(os.path.join(DATA_DIR, name), "rb") as f:
+        data = f.read()
+    if padding:
+        end = data.rindex(b"</")
+        comment = b"<!--" + b"x" * max(padding - 7, 0) + b"-->"
+        data = data[:end] + comment + data[end:]
+    return data
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # The headers and body are written separately, so with Nagle's
+    # algorithm each keep-alive response would wait for a delayed ACK.
+
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            failed = self.server.random.random() < self.server.error_rate
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.server.documents.get(self._document_name())
+        if body is None or failed:
+            self.send_response(404 if body is None else 503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = '"%08x"' % zlib.crc32(body)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _document_name(self):
+        """Return the name of the document requested by the path."""
+        if self.path.startswith("/v1/public/yql"):
+            return "woeid"
+        if self.path.startswith("/forecastrss/"):
+            return "5day"
+        if self.path.startswith("/forecastrss"):
+            return "weather"
+        return None
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FeedServer(object):
+
+    """Serve the test/data documents from a background thread.
+
+    Args:
+        latency: (float) seconds to wait before each response; defaults to
+            0.
+        padding: (int) bytes added to each document; defaults to 0.
+        error_rate: (float) the share of requests answered with 503
+            Service Unavailable; defaults to 0.
+        seed: the seed of the random choice of failed requests.
+
+    Attributes:
+        base: the server's base URL, e.g. http://127.0.0.1:8000.
+        connections: the number of connections accepted so far.
+        requests: the paths requested so far.
+
+    """
+
+    def __init__(self, handler=FeedHandler, latency=0, padding=0,
+                 error_rate=0, seed=None):
+        self._server = _Server(("127.0.0.1", 0), handler)
+        self._server.lock = threading.Lock()
+        self._server.connections = 0
+        self._server.requests = []
+        self._server.latency = latency
+        self._server.error_rate = error_rate
+        self._server.random = random.Random(seed)
+        self._server.documents = {
+            "weather": read_data("data_weather.xml", padding),
+            "5day": read_data("data_5day.xml", padding),
+            "woeid": read_data("data_woeid.xml", padding),
+        }
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self.base = "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    @property
+    def connections(self):
+        return self._server.connections
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def url(self, template):
+        """Return *template* with its Yahoo! host replaced by this server."""
+        rest = template.split("://", 1)[1]
+        return self.base + "/" + rest.split("/", 1)[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -1,59 +1,274 @@
-try:
-    from urllib.parse import quote
-except ImportError:
-    from urllib import quote
+from urllib.parse import quote, unquote
+import urllib.error
+import urllib.parse
+import asyncio
+import concurrent.futures
+import functools
+import gc
+import io
+import json
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import warnings
 import xml.etree.ElementTree
 
 import yweather
 
+from . import tree
+from .server import FeedServer
+
+
+class CountingFile(object):
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+        self.f.close()
+
+
+class FileTransport(object):
+
+    """A transport that answers the Yahoo! URLs with the test/data files."""
+
+    def open(self, url, headers=None):
+        if url.startswith(yweather.WOEID_LOOKUP_URL.split("?")[0]):
+            name = "data_woeid.xml"
+        elif url.startswith(yweather.LID_WEATHER_URL.split("{")[0]):
+            name = "data_5day.xml"
+        elif url.startswith(yweather.WEATHER_URL.split("?")[0]):
+            name = "data_weather.xml"
+        else:
+            raise yweather.HTTPError(url, 404, "Not Found", {},
+                                     io.BytesIO(b"not found"))
+        with open(os.path.join(os.path.dirname(__file__), "data", name),
+                  "rb") as f:
+            return yweather._BufferedResponse(200, "OK", {}, f.read())
+
 
 class testFetchXml(unittest.TestCase):
 
     def setUp(self):
-        self.client = yweather.Client()
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "feeds.seg")
+        self.url = yweather.WOEID_LOOKUP_URL.format(quote("Raleigh, NC"))
+        recorder = yweather.RecordingTransport(path, FileTransport())
+        recorder.open(self.url).close()
+        recorder.close()
+        self.transport = yweather.ReplayTransport(path)
+        self.client = yweather.Client(transport=self.transport)
         data_file_name = os.path.join(os.path.dirname(__file__),
                                       "data", "data_woeid.xml")
         with open(data_file_name) as f:
             root = xml.etree.ElementTree.parse(f).getroot()
         self.woeid = root.find("results/Result/woeid").text
 
-    def test_fetch_xml(self):
-        url = yweather.WOEID_LOOKUP_URL.format(quote("Raleigh, NC"))
-        root = self.client._fetch_xml(url)
-        self.assertEqual(root.find("results/Result/woeid").text, self.woeid)
+    def tearDown(self):
+        self.transport.close()
+        shutil.rmtree(self.directory)
+
+    def test_fetch_results(self):
+        self.assertEqual(self.client._fetch_results(self.url),
+                         [{"woeid": self.woeid}])
 
 
 class testFetchWoeid(unittest.TestCase):
 
-    def return_root(self, extra=None):
-        return self.root
+    def open_results(self, url, headers=None):
+        return open(os.path.join(os.path.dirname(__file__), "data",
+                                 "data_woeid.xml"), "rb")
 
     def setUp(self):
         self.client = yweather.Client()
-        data_file_name = os.path.join(os.path.dirname(__file__),
-                                      "data", "data_woeid.xml")
-        with open(data_file_name) as f:
-            self.root = xml.etree.ElementTree.parse(f).getroot()
-        self.client._fetch_xml = self.return_root
+        self.client._open = self.open_results
 
     def test_fetch_woeid(self):
         self.assertEqual(self.client.fetch_woeid("Raleigh, NC"), "2478307")
 
 
+class testFetchWoeids(unittest.TestCase):
+
+    # Springfield is ambiguous and Nowhere isn't found, so their batches
+    # return more or fewer results than locations. Batch queries return
+    # each result's text, as they select it.
+
+    places = {"Raleigh, NC": ["2478307"], "Berlin": ["638242"],
+              "O'Hare, IL": ["12522"], "Springfield": ["2497646", "2497647"],
+              "Nowhere": []}
+
+    def fetch_results(self, url):
+        self.urls.append(url)
+        if "%20in%20(" in url:
+            locations = [unquote(item[1:-1]).replace("\\'", "'")
+                         for item in url.split("%20in%20(")[1][:-1].split(",")]
+            return [{"woeid": woeid, "text": location}
+                    for location in locations
+                    for woeid in self.places[location]]
+        location = unquote(url.split("text='")[1][:-1])
+        return [{"woeid": woeid} for woeid in self.places[location]]
+
+    def setUp(self):
+        self.urls = []
+        self.client = yweather.Client()
+        self.client._fetch_results = self.fetch_results
+
+    def test_batches(self):
+        woeids = self.client.fetch_woeids(
+            ["Raleigh, NC", "Berlin", "Raleigh, NC", "O'Hare, IL"],
+            batch_size=2)
+        self.assertEqual(woeids, {"Raleigh, NC": "2478307",
+                                  "Berlin": "638242", "O'Hare, IL": "12522"})
+        self.assertEqual(len(self.urls), 2)
+
+    def test_fallback(self):
+        woeids = self.client.fetch_woeids(
+            ["Raleigh, NC", "Springfield", "Berlin", "Nowhere"],
+            batch_size=2)
+        self.assertEqual(woeids, {"Raleigh, NC": "2478307",
+                                  "Springfield": "2497646",
+                                  "Berlin": "638242", "Nowhere": None})
+        self.assertEqual(len(self.urls), 4)
+
+    def test_ambiguous_and_unknown(self):
+        directory = tempfile.mkdtemp()
+        store = yweather.ResolutionStore(os.path.join(directory, "store.db"))
+        try:
+            self.client.resolution_store = store
+            woeids = self.client.fetch_woeids(["Springfield", "Nowhere"])
+            self.assertEqual(woeids, {"Springfield": "2497646",
+                                      "Nowhere": None})
+            self.assertEqual(len(self.urls), 3)
+            self.assertEqual(store.get("woeid", "Nowhere", "-"), None)
+            self.assertEqual(store.get("woeid", "Springfield"), "2497646")
+        finally:
+            store.close()
+            shutil.rmtree(directory)
+
+    def test_results_without_text(self):
+        self.client._fetch_results = lambda url: [{"woeid": "2478307"},
+                                                  {"woeid": "638242"}]
+        woeids = self.client.fetch_woeids(["Raleigh, NC", "Berlin"])
+        self.assertEqual(woeids, {"Raleigh, NC": "2478307",
+                                  "Berlin": "2478307"})
+
+    def test_resolution_store(self):
+        directory = tempfile.mkdtemp()
+        store = yweather.ResolutionStore(os.path.join(directory, "store.db"))
+        try:
+            store.set("woeid", "Berlin", "638242")
+            self.client.resolution_store = store
+            woeids = self.client.fetch_woeids(["Berlin", "Raleigh, NC"])
+            self.assertEqual(woeids["Berlin"], "638242")
+            self.assertEqual(len(self.urls), 1)
+            self.assertNotIn("Berlin", self.urls[0])
+            self.assertEqual(store.get("woeid", "Raleigh, NC"), "2478307")
+        finally:
+            store.close()
+            shutil.rmtree(directory)
+
+
+class testResolutionStore(unittest.TestCase):
+
+    def clock(self):
+        return self.now
+
+    def setUp(self):
+        self.now = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "store.db")
+        self.store = yweather.ResolutionStore(self.path, negative_ttl=60,
+                                              clock=self.clock)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_get_set(self):
+        self.assertEqual(self.store.get("woeid", "Raleigh, NC", "-"), "-")
+        self.store.set("woeid", "Raleigh, NC", "2478307")
+        self.store.set("woeid", "Nowhere", None)
+        self.assertEqual(self.store.get("woeid", "Raleigh, NC"), "2478307")
+        self.assertEqual(self.store.get("woeid", "Nowhere", "-"), None)
+        self.assertEqual(self.store.get("lid", "Raleigh, NC", "-"), "-")
+        self.now = 60
+        self.assertEqual(self.store.get("woeid", "Nowhere", "-"), "-")
+        self.assertEqual(self.store.get("woeid", "Raleigh, NC"), "2478307")
+
+    def test_preload_export(self):
+        self.store.preload("lid", {"2478307": "USNC0558", "1": None})
+        other = yweather.ResolutionStore(self.path, clock=self.clock)
+        try:
+            self.assertEqual(other.export("lid"),
+                             {"2478307": "USNC0558", "1": None})
+        finally:
+            other.close()
+        self.assertRaises(ValueError, self.store.preload, "city", {})
+
+
+class testClientResolutionStore(unittest.TestCase):
+
+    def return_results(self, url):
+        self.fetches += 1
+        return [{"woeid": "2478307"}]
+
+    def setUp(self):
+        self.fetches = 0
+        self.directory = tempfile.mkdtemp()
+        self.store = yweather.ResolutionStore(
+            os.path.join(self.directory, "store.db"))
+        self.client = yweather.Client(resolution_store=self.store)
+        self.client._fetch_results = self.return_results
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_fetch_woeid_stored(self):
+        self.assertEqual(self.client.fetch_woeid("Raleigh, NC"), "2478307")
+        self.assertEqual(self.client.fetch_woeid("Raleigh, NC"), "2478307")
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.store.stats["hits"], 1)
+
+    def test_fetch_lid_stored(self):
+        self.store.set("lid", "2478307", "USNC0558")
+        self.assertEqual(self.client.fetch_lid("2478307"), "USNC0558")
+
+    def test_connections_reused(self):
+        for i in range(20):
+            locations = ["%d-%d" % (i, j) for j in range(8)]
+            self.assertEqual(self.client.fetch_woeids(
+                locations, batch_size=2, max_workers=4),
+                dict.fromkeys(locations, "2478307"))
+            self.assertLessEqual(len(self.store._connections),
+                                 self.store.pool_size)
+        self.store.close()
+        self.assertEqual(self.store._connections, [])
+
+
 class testFetchWeather(unittest.TestCase):
 
-    def return_root(self, extra=None):
-        return self.root
+    def open_feed(self, url, headers=None):
+        return open(self.data_file_name, "rb")
 
     def setUp(self):
         self.client = yweather.Client()
-        data_file_name = os.path.join(os.path.dirname(__file__),
-                                      "data", "data_weather.xml")
-        with open(data_file_name) as f:
-            self.root = xml.etree.ElementTree.parse(f).getroot()
-        self.client._fetch_xml = self.return_root
+        self.data_file_name = os.path.join(os.path.dirname(__file__),
+                                           "data", "data_weather.xml")
+        self.client._open = self.open_feed
 
     def test_fetch_weather(self):
         weather = self.client.fetch_weather("2478307")
@@ -65,16 +280,14 @@ class testFetchWeather(unittest.TestCase):
 
 class testFetchWeatherLidMode(unittest.TestCase):
 
-    def return_root(self, extra=None):
-        return self.root
+    def open_feed(self, url, headers=None):
+        return open(self.data_file_name, "rb")
 
     def setUp(self):
         self.client = yweather.Client()
-        data_file_name = os.path.join(os.path.dirname(__file__),
-                                      "data", "data_5day.xml")
-        with open(data_file_name) as f:
-            self.root = xml.etree.ElementTree.parse(f).getroot()
-        self.client._fetch_xml = self.return_root
+        self.data_file_name = os.path.join(os.path.dirname(__file__),
+                                           "data", "data_5day.xml")
+        self.client._open = self.open_feed
 
     def test_fetch_weather_lid_mode(self):
         weather = self.client.fetch_weather("USNC0558")
@@ -82,18 +295,1643 @@ class testFetchWeatherLidMode(unittest.TestCase):
         self.assertEqual(len(weather["forecast"]), 5)
 
 
+class testIterparseWeather(unittest.TestCase):
+
+    def setUp(self):
+        self.client = yweather.Client()
+
+    def test_same_as_tree(self):
+        for name in ("data_weather.xml", "data_5day.xml"):
+            data_file_name = os.path.join(os.path.dirname(__file__),
+                                          "data", name)
+            with open(data_file_name, "rb") as f:
+                root = xml.etree.ElementTree.parse(f).getroot()
+            with open(data_file_name, "rb") as f:
+                weather = self.client._iterparse_weather(f, "f")
+            self.assertEqual(weather,
+                             tree.parse_weather(self.client, root, "f"))
+
+    def test_city_not_found(self):
+        feed = (b"<rss><channel><item><title>City not found</title>"
+                b"</item></channel></rss>")
+        self.assertEqual(
+            self.client._iterparse_weather(io.BytesIO(feed), "f"), None)
+
+
+class testWeatherFields(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        return open(os.path.join(os.path.dirname(__file__), "data",
+                                 "data_weather.xml"), "rb")
+
+    def setUp(self):
+        self.client = yweather.Client(fields=("condition", "wind"))
+        self.client._open = self.open_feed
+
+    def test_subset(self):
+        full = yweather.Client()
+        full._open = self.open_feed
+        expected = full.fetch_weather("2478307")
+        weather = self.client.fetch_weather("2478307")
+        self.assertEqual(sorted(weather),
+                         ["condition", "ttl", "units", "wind"])
+        for key in weather:
+            self.assertEqual(weather[key], expected[key])
+        self.assertEqual(weather["wind"]["compass"], "WSW")
+        self.assertIn("image", weather["condition"])
+        self.assertEqual(full.fields, frozenset(yweather.WEATHER_FIELDS))
+
+    def test_records(self):
+        self.client.records = True
+        weather = self.client.fetch_weather("2478307")
+        self.assertEqual(weather.wind.direction, 240)
+        self.assertEqual(weather.ttl, 60)
+        self.assertEqual(weather.forecast, None)
+
+    def test_city_not_found(self):
+        feed = (b"<rss><channel><item><title>City not found</title>"
+                b"</item></channel></rss>")
+        self.assertEqual(
+            self.client._iterparse_weather(io.BytesIO(feed), "f"), None)
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, yweather.Client, fields=("winds",))
+
+    def test_shared_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            shared = yweather.SharedCache(os.path.join(directory, "cache"),
+                                          slots=64)
+            try:
+                for cache in (yweather.TTLCache(), shared):
+                    self.client.cache = cache
+                    full = yweather.Client(cache=cache)
+                    full._open = self.open_feed
+                    self.client.fetch_weather("2478307")
+                    self.assertIn("forecast", full.fetch_weather("2478307"))
+                    self.assertEqual(
+                        sorted(self.client.fetch_weather("2478307")),
+                        ["condition", "ttl", "units", "wind"])
+            finally:
+                shared.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+class testFetchWeatherBoth(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        self.urls.append(url)
+        return open(os.path.join(os.path.dirname(__file__), "data",
+                                 "data_weather.xml"), "rb")
+
+    def setUp(self):
+        self.urls = []
+        self.client = yweather.Client()
+        self.client._open = self.open_feed
+
+    def test_imperial(self):
+        both = self.client.fetch_weather_both("2478307")
+        self.assertEqual(len(self.urls), 1)
+        self.assertIn("u=f", self.urls[0])
+        self.assertEqual(both["f"], self.client.fetch_weather("2478307"))
+        metric = both["c"]
+        self.assertIs(metric["units"], yweather.UNITS["c"])
+        self.assertEqual(metric["condition"]["temp"], "10")
+        self.assertEqual(metric["wind"]["chill"], "8")
+        self.assertEqual(metric["wind"]["speed"], "11")
+        self.assertEqual(metric["wind"]["direction"], "240")
+        self.assertEqual(metric["atmosphere"]["visibility"], "16")
+        self.assertEqual(metric["atmosphere"]["pressure"], "1013.55")
+        self.assertEqual(metric["forecast"][0]["low"], "6")
+        self.assertEqual(metric["forecast"][0]["high"], "11")
+        self.assertEqual(metric["location"], both["f"]["location"])
+        self.assertEqual(both["f"]["condition"]["temp"], "50")
+
+    def test_metric(self):
+        both = self.client.fetch_weather_both("2478307", metric=True)
+        self.assertIn("u=c", self.urls[0])
+        self.assertEqual(both["f"]["condition"]["temp"], "122")
+        self.assertEqual(both["f"]["atmosphere"]["pressure"], "0.88")
+
+    def test_records(self):
+        self.client.records = True
+        both = self.client.fetch_weather_both("2478307")
+        self.assertEqual(both["c"].units, "c")
+        self.assertEqual(both["c"].condition.temp, 10)
+        self.assertEqual(both["c"].atmosphere.pressure, 1013.55)
+        self.assertEqual(both["f"].condition.temp, 50)
+
+    def test_convert_value(self):
+        self.assertEqual(yweather._convert_value("31", lambda f: f - 32),
+                         "-1")
+        self.assertEqual(yweather._convert_value("32.2", lambda f: -0.01),
+                         "0.0")
+        self.assertEqual(yweather._convert_value("", float), "")
+        self.assertEqual(yweather._convert_value(None, float), None)
+
+
+class testDegreesToCompass(unittest.TestCase):
+
+    cases = [
+        (0, "N"), (11.25, "N"), (11.26, "NNE"), (33.75, "NNE"),
+        (240, "WSW"), ("240", "WSW"), (326.26, "NNW"), (348.75, "NNW"),
+        (348.755, None), (348.76, "N"), (360, "N"), (-1, None),
+        (360.01, None), ("north", None), (float("nan"), None),
+    ]
+
+    def test_scalar(self):
+        for (degrees, point) in self.cases:
+            self.assertEqual(yweather.degrees_to_compass(degrees), point,
+                             degrees)
+        self.assertRaises(TypeError, yweather.degrees_to_compass, None)
+
+    def test_many(self):
+        self.assertEqual(
+            yweather.degrees_to_compass_many(d for (d, p) in self.cases),
+            [p for (d, p) in self.cases])
+        columns = yweather.WeatherColumns()
+        columns.append("1", {"wind": {"direction": "90"}})
+        columns.append("2", {"wind": None})
+        self.assertEqual(yweather.degrees_to_compass_many(
+            columns.column("wind_direction")), ["E", None])
+
+
+class testWeatherRecords(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        if "/forecastrss/" in url:
+            name = "data_5day.xml"
+        else:
+            name = "data_weather.xml"
+        return open(os.path.join(os.path.dirname(__file__), "data", name),
+                    "rb")
+
+    def setUp(self):
+        self.client = yweather.Client(records=True)
+        self.client._open = self.open_feed
+
+    def test_numbers(self):
+        weather = self.client.fetch_weather("2478307")
+        self.assertEqual(weather.ttl, 60)
+        self.assertEqual(weather.wind.direction, 240)
+        self.assertEqual(weather.wind.compass, "WSW")
+        self.assertEqual(weather.atmosphere.pressure, 29.93)
+        self.assertEqual(weather.forecast[0].high, 52)
+        self.assertEqual(weather.geo.lat, 35.79)
+        self.assertEqual(weather.location.city, "Raleigh")
+        self.assertFalse(hasattr(weather, "__dict__"))
+        self.assertFalse(hasattr(weather.wind, "__dict__"))
+
+    def test_to_dict(self):
+        client = yweather.Client()
+        client._open = self.open_feed
+        for id in ("2478307", "USNC0558"):
+            for metric in (False, True):
+                self.assertEqual(
+                    self.client.fetch_weather(id, metric).to_dict(),
+                    client.fetch_weather(id, metric))
+
+    def test_to_dict_normalizes_numbers(self):
+        with self.open_feed(yweather.WEATHER_URL) as f:
+            feed = f.read().replace(b'pressure="29.93"', b'pressure="30.10"')
+        self.client._open = lambda url, headers=None: io.BytesIO(feed)
+        weather = self.client.fetch_weather("2478307")
+        self.assertEqual(weather.atmosphere.pressure, 30.1)
+        self.assertEqual(weather.to_dict()["atmosphere"]["pressure"], "30.1")
+        self.assertEqual(weather.atmosphere.to_dict()["pressure"], "30.1")
+
+
+class testWeatherColumns(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        if "bad" in url:
+            raise ValueError(url)
+        if "/forecastrss/" in url:
+            name = "data_5day.xml"
+        else:
+            name = "data_weather.xml"
+        return open(os.path.join(os.path.dirname(__file__), "data", name),
+                    "rb")
+
+    def setUp(self):
+        self.client = yweather.Client()
+        self.client._open = self.open_feed
+
+    def test_fetch_weather_columns(self):
+        table = self.client.fetch_weather_columns(
+            ["2478307", "USHI0032", "bad"], max_workers=1)
+        self.assertEqual(sorted(table.ids), ["2478307", "USHI0032"])
+        self.assertEqual(list(table.errors), ["bad"])
+        row = table.ids.index("2478307")
+        self.assertEqual(table.column("wind_direction")[row], 240.0)
+        self.assertEqual(table.column("pressure")[row], 29.93)
+        forecast_rows = table.column("forecast_row").tolist()
+        self.assertEqual(forecast_rows.count(row), 2)
+        self.assertEqual(len(table.column("forecast_high")), 7)
+
+    def test_columns_only(self):
+        self.client.fetch_weather = None
+        plan = yweather._WeatherPlan(yweather.WeatherColumns.fields)
+        weather = self.client._fetch_columns_row("2478307", "f", plan, True)
+        self.assertEqual(sorted(weather), ["atmosphere", "condition",
+                                           "forecast", "ttl", "units",
+                                           "wind"])
+        self.assertNotIn("compass", weather["wind"])
+
+        client = yweather.Client(fields=("condition", "location"),
+                                 cache=yweather.TTLCache())
+        client._open = self.open_feed
+        cached = client.fetch_weather("USHI0032")
+        table = client.fetch_weather_columns(["2478307", "USHI0032"])
+        row = table.ids.index("2478307")
+        self.assertEqual(table.column("condition_temp")[row], 50.0)
+        speed = table.column("wind_speed")[row]
+        self.assertNotEqual(speed, speed)
+        self.assertIs(client.cache.get(client._cache_key("USHI0032", "f")),
+                      cached)
+        self.assertEqual(client.cache.get(client._cache_key("2478307", "f")),
+                         None)
+
+    def test_records(self):
+        client = yweather.Client(records=True)
+        client._open = self.open_feed
+        weather = client.fetch_weather("2478307")
+        table = yweather.WeatherColumns()
+        table.append("2478307", weather)
+        table.append("2478307", weather.to_dict())
+        self.assertEqual(table.column("condition_temp").tolist(),
+                         [50.0, 50.0])
+
+    def test_to_csv(self):
+        table = yweather.WeatherColumns()
+        table.append("1", {"wind": {"speed": "7", "direction": ""},
+                           "atmosphere": {"pressure": "29.93"},
+                           "forecast": [{"date": "24 Dec 2012",
+                                         "high": "52"}]})
+        f = io.StringIO()
+        table.to_csv(f)
+        self.assertEqual(f.getvalue().splitlines()[1], "1,,,,,7,,,29.93")
+        f = io.StringIO()
+        table.to_csv(f, forecast=True)
+        self.assertEqual(f.getvalue().splitlines()[1], "1,24 Dec 2012,,52,")
+
+
 class testFetchLid(unittest.TestCase):
 
-    def return_root(self, extra=None):
-        return self.root
+    def open_feed(self, url, headers=None):
+        self.feed = CountingFile(open(self.data_file_name, "rb"))
+        return self.feed
 
     def setUp(self):
         self.client = yweather.Client()
-        data_file_name = os.path.join(os.path.dirname(__file__),
-                                      "data", "data_weather.xml")
-        with open(data_file_name) as f:
-            self.root = xml.etree.ElementTree.parse(f).getroot()
-        self.client._fetch_xml = self.return_root
+        self.data_file_name = os.path.join(os.path.dirname(__file__),
+                                           "data", "data_weather.xml")
+        self.client._open = self.open_feed
 
     def test_fetch_lid(self):
         self.assertEqual(self.client.fetch_lid("2478307"), "USNC0558")
+
+    def test_early_exit(self):
+        self.client.fetch_lid("2478307")
+        self.assertTrue(self.feed.closed)
+        self.assertEqual(self.feed.bytes_read, yweather._LID_CHUNK_SIZE)
+
+    def test_no_link(self):
+        feed = b"<rss><channel><title>Yahoo! Weather</title></channel></rss>"
+        self.assertEqual(self.client._iterparse_lid(io.BytesIO(feed)), None)
+
+
+class testParsers(unittest.TestCase):
+
+    # Each parser must return exactly what ElementTreeParser returns.
+
+    feeds = ("data_weather.xml", "data_5day.xml")
+    documents = (
+        b"<query><results><Result><woeid>1</woeid></Result><Result/>"
+        b"<Result><woeid>2<x/>3</woeid><woeid>4</woeid></Result>"
+        b"<Result><woeid/></Result></results></query>",
+        b"<rss xmlns:a='urn:a'><channel><a:link>x</a:link><link>USNC0558"
+        b"<b/></link></channel></rss>",
+        b"<rss><channel><item><title>City not found</title></item>"
+        b"</channel></rss>",
+    )
+
+    def parsers(self):
+        parsers = [yweather.ExpatParser()]
+        try:
+            parsers.append(yweather.LxmlParser())
+        except ImportError:
+            pass
+        return parsers
+
+    def read(self, name):
+        with open(os.path.join(os.path.dirname(__file__), "data", name),
+                  "rb") as f:
+            return f.read()
+
+    def setUp(self):
+        self.expected = yweather.ElementTreeParser()
+
+    def test_weather(self):
+        items = yweather._STREAM_ITEMS
+        for parser in self.parsers():
+            for name in self.feeds:
+                data = self.read(name)
+                self.assertEqual(parser.weather(io.BytesIO(data), items),
+                                 self.expected.weather(io.BytesIO(data),
+                                                       items))
+
+    def test_clients(self):
+        for parser in self.parsers():
+            for fields in (None, ("condition", "wind", "geo")):
+                for records in (False, True):
+                    for name in self.feeds:
+                        clients = [yweather.Client(fields=fields,
+                                                   records=records,
+                                                   parser=p)
+                                   for p in (self.expected, parser)]
+                        results = [
+                            client._iterparse_weather(
+                                io.BytesIO(self.read(name)), "c")
+                            for client in clients]
+                        self.assertEqual(results[0], results[1])
+
+    def test_link_and_results(self):
+        for parser in self.parsers():
+            for data in [self.read(name) for name in self.feeds] + list(
+                    self.documents):
+                self.assertEqual(parser.link(io.BytesIO(data)),
+                                 self.expected.link(io.BytesIO(data)))
+            for data in (self.read("data_woeid.xml"), self.documents[0]):
+                self.assertEqual(parser.results(io.BytesIO(data)),
+                                 self.expected.results(io.BytesIO(data)))
+            feed = CountingFile(io.BytesIO(self.read("data_weather.xml")))
+            parser.link(feed)
+            self.assertEqual(feed.bytes_read, yweather._LID_CHUNK_SIZE)
+        self.assertEqual(
+            self.expected.results(io.BytesIO(self.documents[0])),
+            [{"woeid": "1"}, {}, {"woeid": "2"}, {"woeid": None}])
+
+    def test_namespaced_attributes(self):
+        data = (b"<rss xmlns:a='urn:a'><channel><wind a:chill='1' "
+                b"speed='2'/></channel></rss>")
+        items = {"channel/wind": ["attrib", "wind"]}
+        for parser in self.parsers():
+            self.assertEqual(parser.weather(io.BytesIO(data), items),
+                             self.expected.weather(io.BytesIO(data), items))
+
+    def test_parse_error(self):
+        data = b"<rss><channel><link>x</channel></rss>"
+        for parser in [self.expected] + self.parsers():
+            self.assertRaises(xml.etree.ElementTree.ParseError,
+                              parser.weather, io.BytesIO(data), {})
+            self.assertRaises(xml.etree.ElementTree.ParseError,
+                              parser.results, io.BytesIO(data))
+            for data in (b"", b"<rss><channel><title>x</title>"):
+                self.assertRaises(xml.etree.ElementTree.ParseError,
+                                  parser.link, io.BytesIO(data))
+
+    def test_fetch(self):
+        for parser in self.parsers():
+            client = yweather.Client(transport=FileTransport(),
+                                     parser=parser)
+            self.assertEqual(client.fetch_woeid("Raleigh, NC"), "2478307")
+            self.assertEqual(client.fetch_lid("2478307"), "USNC0558")
+            self.assertEqual(client.fetch_weather("USNC0558"),
+                             yweather.Client(transport=FileTransport())
+                             .fetch_weather("USNC0558"))
+
+
+class testTTLCache(unittest.TestCase):
+
+    def clock(self):
+        return self.now
+
+    def setUp(self):
+        self.now = 0
+        self.cache = yweather.TTLCache(maxsize=2, clock=self.clock)
+
+    def test_expiry(self):
+        self.cache.set("a", 1, 60)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 60
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 1)
+
+    def test_lru_eviction(self):
+        self.cache.set("a", 1, 60)
+        self.cache.set("b", 2, 60)
+        self.cache.get("a")
+        self.cache.set("c", 3, 60)
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.stats["evictions"], 1)
+
+    def test_maxsize(self):
+        self.assertRaises(ValueError, yweather.TTLCache, maxsize=0)
+        cache = yweather.TTLCache(maxsize=1)
+        cache.set("a", 1, 60)
+        cache.set("b", 2, 60)
+        self.assertEqual((cache.get("a"), cache.get("b")), (None, 2))
+
+
+def shared_cache_worker(path, worker):
+    """Cache a few values in the SharedCache at *path* from another
+    process."""
+    cache = yweather.SharedCache(path)
+    try:
+        for i in range(20):
+            cache.set((worker, i), {"worker": worker, "i": str(i)}, 60)
+    finally:
+        cache.close()
+
+
+class testSharedCache(unittest.TestCase):
+
+    def clock(self):
+        return self.now
+
+    def setUp(self):
+        self.now = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache")
+        self.cache = yweather.SharedCache(self.path, slots=64,
+                                          slot_size=4096, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_expiry(self):
+        self.cache.set(("2478307", "f"), {"ttl": "60"}, 60)
+        self.assertEqual(self.cache.get(("2478307", "f")), {"ttl": "60"})
+        self.assertEqual(self.cache.get(("2478307", "c")), None)
+        self.now = 60
+        self.assertEqual(self.cache.get(("2478307", "f")), None)
+        self.assertEqual(self.cache.stats["hits"], 1)
+        self.assertEqual(self.cache.stats["misses"], 2)
+
+    def test_shared_file(self):
+        self.cache.set("a", [1, 2], 60)
+        other = yweather.SharedCache(self.path, slots=8, clock=self.clock)
+        try:
+            self.assertEqual(other.slots, 64)
+            self.assertEqual(other.get("a"), [1, 2])
+            other.set("a", [3], 60)
+            self.assertEqual(self.cache.get("a"), [3])
+            other.clear()
+            self.assertEqual(self.cache.get("a"), None)
+        finally:
+            other.close()
+
+    def test_eviction_and_oversize(self):
+        for i in range(200):
+            self.cache.set(i, i, 60 + i)
+        self.assertGreater(self.cache.stats["evictions"], 0)
+        self.assertEqual(self.cache.get(199), 199)
+        self.cache.set("big", "x" * 4096, 60)
+        self.assertEqual(self.cache.get("big"), None)
+        self.assertEqual(self.cache.stats["oversize"], 1)
+
+    def test_not_a_cache_file(self):
+        path = os.path.join(self.directory, "other")
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        self.assertRaises(ValueError, yweather.SharedCache, path)
+
+    def test_slot_size(self):
+        self.assertRaises(ValueError, yweather.SharedCache,
+                          os.path.join(self.directory, "small"), slot_size=8)
+        cache = yweather.SharedCache(self.path, slots=1, slot_size=8)
+        try:
+            self.assertEqual((cache.slots, cache.slot_size), (64, 4096))
+        finally:
+            cache.close()
+
+    def test_processes(self):
+        path = os.path.join(self.directory, "large")
+        cache = yweather.SharedCache(path, slots=4096, slot_size=256)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(2) as executor:
+                list(executor.map(shared_cache_worker, [path] * 2, [0, 1]))
+            for worker in (0, 1):
+                for i in range(20):
+                    self.assertEqual(cache.get((worker, i)),
+                                     {"worker": worker, "i": str(i)})
+            self.assertEqual(cache.stats["hits"], 40)
+        finally:
+            cache.close()
+
+    def test_client(self):
+        data_file_name = os.path.join(os.path.dirname(__file__), "data",
+                                      "data_weather.xml")
+        fetches = []
+
+        def open_feed(url, headers=None):
+            fetches.append(url)
+            return open(data_file_name, "rb")
+
+        for records in (False, True):
+            client = yweather.Client(cache=self.cache, records=records)
+            client._open = open_feed
+            weather = client.fetch_weather("2478307")
+            self.assertEqual(client.fetch_weather("2478307"), weather)
+            self.cache.clear()
+        self.assertEqual(len(fetches), 2)
+
+    def test_resolution_store(self):
+        store = self.cache.resolution_store(negative_ttl=60)
+        self.assertEqual(store.get("woeid", "Raleigh, NC", "-"), "-")
+        store.set("woeid", "Raleigh, NC", "2478307")
+        store.set("woeid", "Nowhere", None)
+        self.assertEqual(store.get("woeid", "Raleigh, NC"), "2478307")
+        self.assertEqual(store.get("woeid", "Nowhere", "-"), None)
+        self.now = 60
+        self.assertEqual(store.get("woeid", "Nowhere", "-"), "-")
+        self.assertEqual(store.get("woeid", "Raleigh, NC"), "2478307")
+
+
+class testFetchWeatherCache(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        self.fetches += 1
+        return open(self.data_file_name, "rb")
+
+    def setUp(self):
+        self.fetches = 0
+        self.client = yweather.Client(cache=yweather.TTLCache())
+        self.data_file_name = os.path.join(os.path.dirname(__file__),
+                                           "data", "data_weather.xml")
+        self.client._open = self.open_feed
+
+    def test_fetch_weather_cached(self):
+        weather = self.client.fetch_weather("2478307")
+        self.assertIs(self.client.fetch_weather("2478307"), weather)
+        self.assertEqual(self.fetches, 1)
+        self.client.fetch_weather("2478307", metric=True)
+        self.assertEqual(self.fetches, 2)
+
+    def test_fetch_weather_use_cache(self):
+        self.client.fetch_weather("2478307")
+        self.client.fetch_weather("2478307", use_cache=False)
+        self.assertEqual(self.fetches, 2)
+
+
+class testPooledTransport(unittest.TestCase):
+
+    def clock(self):
+        return self.now
+
+    def setUp(self):
+        self.now = 0
+        self.server = FeedServer().start()
+        self.transport = yweather.PooledTransport(pool_size=1,
+                                                  idle_timeout=30,
+                                                  clock=self.clock)
+        self.url = self.server.url(yweather.WEATHER_URL).format("2478307",
+                                                                "f")
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def fetch(self):
+        with self.transport.open(self.url) as response:
+            self.assertEqual(response.status, 200)
+            return response.read()
+
+    def test_reuse(self):
+        self.assertEqual(self.fetch(), self.fetch())
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.transport.stats["connections"], 1)
+        self.assertEqual(self.transport.stats["reused"], 1)
+
+    def test_idle_timeout(self):
+        self.fetch()
+        self.now = 31
+        self.fetch()
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.transport.stats["discarded"], 1)
+
+    def test_partial_read(self):
+        response = self.transport.open(self.url)
+        response.read(10)
+        response.close()
+        self.fetch()
+        self.assertEqual(self.server.connections, 2)
+
+    def test_not_found(self):
+        self.assertRaises(yweather.HTTPError, self.transport.open,
+                          self.server.base + "/missing")
+        self.fetch()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_failed_retry(self):
+
+        class Broken(object):
+            closed = False
+
+            def request(self, method, path, headers):
+                raise ConnectionResetError()
+
+            def close(self):
+                self.closed = True
+
+        self.fetch()
+        (pool,) = self.transport._pools.values()
+        (connection, idle_since) = pool[0]
+        connection.close()
+        stale = Broken()
+        fresh = Broken()
+        pool[0] = (stale, idle_since)
+        self.transport._connect = lambda key: fresh
+        self.assertRaises(ConnectionResetError, self.transport.open,
+                          self.url)
+        self.assertTrue(stale.closed)
+        self.assertTrue(fresh.closed)
+        self.assertEqual(self.transport.stats["discarded"], 2)
+
+
+class testClientTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FeedServer().start()
+        self.urls = (yweather.WEATHER_URL, yweather.LID_LOOKUP_URL,
+                     yweather.WOEID_LOOKUP_URL)
+        yweather.WEATHER_URL = self.server.url(yweather.WEATHER_URL)
+        yweather.LID_LOOKUP_URL = self.server.url(yweather.LID_LOOKUP_URL)
+        yweather.WOEID_LOOKUP_URL = self.server.url(
+            yweather.WOEID_LOOKUP_URL)
+        self.client = yweather.Client(transport=yweather.PooledTransport())
+
+    def tearDown(self):
+        (yweather.WEATHER_URL, yweather.LID_LOOKUP_URL,
+         yweather.WOEID_LOOKUP_URL) = self.urls
+        self.client.transport.close()
+        self.server.stop()
+
+    def test_pooled_client(self):
+        self.assertEqual(self.client.fetch_woeid("Raleigh, NC"), "2478307")
+        weather = self.client.fetch_weather("2478307")
+        self.assertEqual(weather["wind"]["direction"], "240")
+        self.assertEqual(self.server.connections, 1)
+
+        # fetch_lid stops reading early, so its connection can't be reused.
+
+        self.assertEqual(self.client.fetch_lid("2478307"), "USNC0558")
+        self.assertEqual(self.client.transport.stats["discarded"], 1)
+
+
+class testFetchWeatherMany(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.active, self.max_active)
+        try:
+            if "bad" in url:
+                raise ValueError(url)
+            if "slow" in url:
+                self.release.wait(5)
+            if "/forecastrss/" in url:
+                return io.BytesIO(self.feeds["5day"])
+            return io.BytesIO(self.feeds["weather"])
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.active = self.max_active = 0
+        self.release = threading.Event()
+        self.client = yweather.Client()
+        self.feeds = {}
+        for name in ("weather", "5day"):
+            data_file_name = os.path.join(os.path.dirname(__file__),
+                                          "data", "data_%s.xml" % name)
+            with open(data_file_name, "rb") as f:
+                self.feeds[name] = f.read()
+        self.client._open = self.open_feed
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_fetch_weather_many(self):
+        results = dict((r.id, r) for r in self.client.fetch_weather_many(
+            ["2478307", "USNC0558", "bad"], max_workers=2))
+        self.assertEqual(len(results["2478307"].weather["forecast"]), 2)
+        self.assertEqual(len(results["USNC0558"].weather["forecast"]), 5)
+        self.assertEqual(results["bad"].weather, None)
+        self.assertTrue(isinstance(results["bad"].error, ValueError))
+
+    def test_deadline(self):
+        results = list(self.client.fetch_weather_many(
+            ["2478307", "slow", "2478307"], max_workers=3, deadline=0.2))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1].id, "slow")
+        self.assertTrue(isinstance(results[-1].error,
+                                   yweather.concurrent.futures.TimeoutError))
+
+    def test_max_in_flight(self):
+        ids = (id for id in ["2478307", "USNC0558"] * 4)
+        results = list(self.client.fetch_weather_many(ids, max_workers=4,
+                                                      max_in_flight=1))
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.max_active, 1)
+
+
+class testSingleFlight(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        with self.lock:
+            self.opens += 1
+        self.release.wait(5)
+        return open(os.path.join(os.path.dirname(__file__), "data",
+                                 "data_weather.xml"), "rb")
+
+    def return_results(self, url):
+        with self.lock:
+            self.opens += 1
+        self.release.wait(5)
+        return [{"woeid": "2478307"}]
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.opens = 0
+        self.release = threading.Event()
+        self.client = yweather.Client()
+        self.client._open = self.open_feed
+        self.client._fetch_results = self.return_results
+
+    def tearDown(self):
+        self.release.set()
+
+    def run_threads(self, function, *args):
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(function(*args)))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for i in range(500):
+            if self.client.stats["coalesced"] == 4:
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_fetch_weather(self):
+        results = self.run_threads(self.client.fetch_weather, "2478307")
+        self.assertEqual(self.opens, 1)
+        self.assertEqual(self.client.stats["coalesced"], 4)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_fetch_woeid(self):
+        results = self.run_threads(self.client.fetch_woeid, "Raleigh, NC")
+        self.assertEqual(self.opens, 1)
+        self.assertEqual(results, ["2478307"] * 5)
+
+    def test_errors_shared(self):
+        def fail(url, headers=None):
+            self.release.wait(5)
+            raise ValueError(url)
+        self.client._open = fail
+        errors = []
+
+        def fetch():
+            try:
+                self.client.fetch_weather("2478307")
+            except ValueError as e:
+                errors.append(e)
+        self.run_threads(fetch)
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(self.client.stats["coalesced"], 4)
+
+    def test_async(self):
+        class Transport(object):
+            requests = 0
+
+            async def request(self, url, headers=None):
+                Transport.requests += 1
+                await asyncio.sleep(0.05)
+                return yweather._BufferedResponse(200, "OK", {}, feed)
+
+        with open(os.path.join(os.path.dirname(__file__), "data",
+                               "data_weather.xml"), "rb") as f:
+            feed = f.read()
+        client = yweather.AsyncClient(transport=Transport())
+
+        async def fetch():
+            return await asyncio.gather(
+                *[client.fetch_weather("2478307") for i in range(5)])
+
+        results = asyncio.run(fetch())
+        self.assertEqual(Transport.requests, 1)
+        self.assertEqual(client.stats["coalesced"], 4)
+        self.assertEqual(results[0]["wind"]["direction"], "240")
+
+
+class testConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FeedServer().start()
+        self.url = yweather.WEATHER_URL
+        yweather.WEATHER_URL = self.server.url(yweather.WEATHER_URL)
+
+    def tearDown(self):
+        yweather.WEATHER_URL = self.url
+        self.server.stop()
+
+    def check_client(self, client):
+        weather = client.fetch_weather("2478307")
+        self.assertIs(client.fetch_weather("2478307"), weather)
+        self.assertEqual(client.stats["not_modified"], 1)
+        self.assertNotEqual(client.fetch_weather("2478307", metric=True),
+                            None)
+        self.assertEqual(client.stats["not_modified"], 1)
+
+    def test_urllib(self):
+        self.check_client(yweather.Client(conditional_get=True))
+
+    def test_pooled(self):
+        transport = yweather.PooledTransport()
+        self.check_client(yweather.Client(transport=transport,
+                                          conditional_get=True))
+        self.assertEqual(self.server.connections, 1)
+        transport.close()
+
+    def test_disabled(self):
+        client = yweather.Client()
+        self.assertIsNot(client.fetch_weather("2478307"),
+                         client.fetch_weather("2478307"))
+        self.assertEqual(client.stats["not_modified"], 0)
+
+    def test_max_validators(self):
+        client = yweather.Client(conditional_get=True, max_validators=2)
+        for id in ("1", "2", "1", "3"):
+            client.fetch_weather(id)
+        self.assertEqual(list(client._validators),
+                         [client._weather_url(id, "f") for id in ("1", "3")])
+        client.fetch_weather("1")
+        self.assertEqual(client.stats["not_modified"], 2)
+
+    def test_unexpected_not_modified(self):
+        def open_not_modified(url, headers=None):
+            return yweather._BufferedResponse(304, "Not Modified", {}, b"")
+
+        for conditional_get in (False, True):
+            client = yweather.Client(conditional_get=conditional_get)
+            client._open = open_not_modified
+            with self.assertRaises(yweather.HTTPError) as context:
+                client.fetch_weather("2478307")
+            self.assertEqual(context.exception.code, 304)
+
+
+class testAsyncClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FeedServer().start()
+        self.urls = (yweather.WEATHER_URL, yweather.LID_WEATHER_URL,
+                     yweather.LID_LOOKUP_URL, yweather.WOEID_LOOKUP_URL)
+        yweather.WEATHER_URL = self.server.url(yweather.WEATHER_URL)
+        yweather.LID_WEATHER_URL = self.server.url(yweather.LID_WEATHER_URL)
+        yweather.LID_LOOKUP_URL = self.server.url(yweather.LID_LOOKUP_URL)
+        yweather.WOEID_LOOKUP_URL = self.server.url(
+            yweather.WOEID_LOOKUP_URL)
+
+    def tearDown(self):
+        (yweather.WEATHER_URL, yweather.LID_WEATHER_URL,
+         yweather.LID_LOOKUP_URL, yweather.WOEID_LOOKUP_URL) = self.urls
+        self.server.stop()
+
+    def test_same_results(self):
+        client = yweather.Client()
+
+        async def fetch(client):
+            try:
+                return (await client.fetch_woeid("Raleigh, NC"),
+                        await client.fetch_lid("2478307"),
+                        await client.fetch_weather("2478307"),
+                        await client.fetch_weather("USNC0558", metric=True))
+            finally:
+                await client.transport.aclose()
+
+        self.assertEqual(asyncio.run(fetch(yweather.AsyncClient())),
+                         (client.fetch_woeid("Raleigh, NC"),
+                          client.fetch_lid("2478307"),
+                          client.fetch_weather("2478307"),
+                          client.fetch_weather("USNC0558", metric=True)))
+
+    def test_max_concurrency(self):
+        client = yweather.AsyncClient(max_concurrency=3)
+
+        async def fetch():
+            results = await asyncio.gather(
+                *[client.fetch_weather(str(i)) for i in range(20)])
+            await client.transport.aclose()
+            return results
+
+        results = asyncio.run(fetch())
+        self.assertEqual(len(results), 20)
+        self.assertEqual(results[0]["wind"]["direction"], "240")
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(client.transport.stats["reused"], 17)
+
+    def test_two_event_loops(self):
+        client = yweather.AsyncClient()
+
+        async def fetch(metric):
+            try:
+                return await client.fetch_weather("2478307", metric)
+            finally:
+                await client.transport.aclose()
+
+        first = asyncio.run(fetch(False))
+        second = asyncio.run(fetch(True))
+        self.assertEqual(first["wind"]["direction"], "240")
+        self.assertIs(second["units"], yweather.UNITS["c"])
+        self.assertEqual(client.transport.stats["reused"], 0)
+        self.assertEqual(client.transport.stats["connections"], 2)
+
+    def test_closed_loop_connection(self):
+        client = yweather.AsyncClient()
+        asyncio.run(client.fetch_weather("2478307"))
+        (pool,) = client.transport._pools.values()
+        sock = pool[0][0][2]
+        del pool
+
+        # The connection's transport belongs to the closed loop, which can
+        # no longer finish closing it, so asyncio warns when it is
+        # collected. The transport closes the socket itself.
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", ResourceWarning)
+            client.transport.close()
+            gc.collect()
+        self.assertEqual(sock.fileno(), -1)
+        self.assertEqual(client.transport._pools, {})
+
+    def test_cancel_one_caller(self):
+        client = yweather.AsyncClient()
+        started = []
+
+        async def fetch(url):
+            started.append(url)
+            await asyncio.sleep(0.05)
+            return b"feed"
+
+        client._fetch = fetch
+        client._iterparse_weather = lambda source, units: source.read()
+
+        async def run():
+            first = asyncio.ensure_future(client.fetch_weather("2478307"))
+            second = asyncio.ensure_future(client.fetch_weather("2478307"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            result = await second
+            self.assertTrue(first.cancelled())
+            return result
+
+        self.assertEqual(asyncio.run(run()), b"feed")
+        self.assertEqual(len(started), 1)
+        self.assertEqual(client.stats["coalesced"], 1)
+
+    def test_cancel_every_caller(self):
+        client = yweather.AsyncClient()
+        cancelled = []
+
+        async def fetch(url):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+
+        client._fetch = fetch
+
+        async def run():
+            task = asyncio.ensure_future(client.fetch_weather("2478307"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        self.assertEqual(len(cancelled), 1)
+
+
+class testRefresher(unittest.TestCase):
+
+    class Client(yweather.Client):
+
+        def __init__(self):
+            yweather.Client.__init__(self)
+            self.fetches = []
+            self.fail = False
+
+        def fetch_weather(self, id, metric=False, use_cache=True):
+            self.fetches.append(id)
+            if self.fail == "missing":
+                return None
+            if self.fail:
+                raise ValueError(id)
+            return {"ttl": "30", "id": id}
+
+    def clock(self):
+        return self.now
+
+    def setUp(self):
+        self.now = 1000
+        self.client = self.Client()
+        self.refresher = yweather.Refresher(
+            self.client, ["1", "2"], jitter=0.1, min_interval=60,
+            max_backoff=600, clock=self.clock, random=lambda: 1.0)
+
+    def test_schedule(self):
+        self.assertEqual(self.refresher.get("1"), None)
+        self.assertEqual(self.refresher.refresh_due(), 2)
+        self.assertEqual(self.refresher.get("1")["id"], "1")
+        self.assertEqual(self.refresher.age("1"), 0)
+        self.now += 30 * 60 * 1.1 - 1
+        self.assertEqual(self.refresher.refresh_due(), 0)
+        self.assertEqual(self.refresher.lag(), 0)
+        self.now += 11
+        self.assertEqual(self.refresher.lag(), 10)
+        self.assertAlmostEqual(self.refresher.age("1"), 30 * 60 * 1.1 + 10)
+        self.assertEqual(self.refresher.refresh_due(), 2)
+        self.assertEqual(self.refresher.age("1"), 0)
+
+    def test_backoff(self):
+        self.refresher.refresh_due()
+        weather = self.refresher.get("1")
+        self.client.fail = True
+        self.now += 2000
+        self.refresher.refresh_due()
+        self.assertIs(self.refresher.get("1"), weather)
+        self.assertTrue(isinstance(self.refresher.error("1"), ValueError))
+        for delay in (60, 120, 240, 480, 600, 600):
+            self.now += delay * 1.1 - 1
+            self.assertEqual(self.refresher.refresh_due(), 0)
+            self.now += 1
+            self.assertEqual(self.refresher.refresh_due(), 2)
+        self.client.fail = False
+        self.now += 660
+        self.refresher.refresh_due()
+        self.assertEqual(self.refresher.error("1"), None)
+        self.assertEqual(self.refresher.age("1"), 0)
+
+    def test_no_weather(self):
+        self.refresher.refresh_due()
+        weather = self.refresher.get("1")
+        self.client.fail = "missing"
+        self.now += 2000
+        self.refresher.refresh_due()
+        self.assertIs(self.refresher.get("1"), weather)
+        self.assertEqual(self.refresher.age("1"), 2000)
+        self.assertTrue(isinstance(self.refresher.error("1"), LookupError))
+        self.now += 60 * 1.1 - 1
+        self.assertEqual(self.refresher.refresh_due(), 0)
+        self.now += 1
+        self.assertEqual(self.refresher.refresh_due(), 2)
+
+    def test_unwatch(self):
+        self.refresher.unwatch(["2"])
+        self.assertEqual(self.refresher.refresh_due(), 1)
+        self.assertRaises(KeyError, self.refresher.get, "2")
+
+    def test_background(self):
+        refresher = yweather.Refresher(self.client, ["1", "2", "3"])
+        refresher.start()
+        try:
+            for i in range(500):
+                if all(refresher.get(id) is not None
+                       for id in ("1", "2", "3")):
+                    break
+                time.sleep(0.01)
+        finally:
+            refresher.stop()
+        self.assertEqual(sorted(self.client.fetches), ["1", "2", "3"])
+
+
+class testHostLimit(unittest.TestCase):
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def setUp(self):
+        self.now = 0
+        self.sleeps = []
+
+    def test_rate(self):
+        limit = yweather.HostLimit(rate=10, burst=2, clock=self.clock,
+                                   sleep=self.sleep)
+        for i in range(4):
+            limit.release(limit.acquire())
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertAlmostEqual(self.sleeps[0], 0.1)
+        self.assertEqual(limit.stats["throttled"], 2)
+
+    def test_aimd(self):
+        limit = yweather.HostLimit(concurrency=4, latency_target=1,
+                                   clock=self.clock, sleep=self.sleep)
+        started = [limit.acquire() for i in range(4)]
+        self.now = 2
+        for s in started:
+            limit.release(s)
+        self.assertEqual(limit.concurrency, 2)
+        self.assertEqual(limit.stats["congested"], 4)
+        limit.release(limit.acquire(), error=True)
+        self.assertEqual(limit.concurrency, 1)
+        limit.release(limit.acquire(), error=True)
+        self.assertEqual(limit.concurrency, 1)
+        limit.release(limit.acquire())
+        self.assertEqual(limit.concurrency, 2)
+        limit.release(limit.acquire())
+        self.assertEqual(limit.concurrency, 2.5)
+
+    def test_concurrency(self):
+        limit = yweather.HostLimit(concurrency=2, latency_target=60)
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def request():
+            started = limit.acquire()
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            limit.release(started, error=True)
+
+        threads = [threading.Thread(target=request) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(active[1], 2)
+        self.assertEqual(limit.concurrency, 1)
+
+
+class testThrottle(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        self.opened.append(url)
+        if "bad" in url:
+            raise yweather.HTTPError(url, 503, "Unavailable", {}, None)
+        with open(os.path.join(os.path.dirname(__file__), "data",
+                               "data_weather.xml"), "rb") as f:
+            return yweather._BufferedResponse(200, "OK", {}, f.read())
+
+    def setUp(self):
+        self.opened = []
+        self.weather_limit = yweather.HostLimit(concurrency=4)
+        self.woeid_limit = yweather.HostLimit(concurrency=1)
+        self.throttle = yweather.Throttle({
+            yweather.WEATHER_URL: self.weather_limit,
+            yweather.LID_WEATHER_URL: self.weather_limit,
+            yweather.WOEID_LOOKUP_URL: self.woeid_limit,
+        })
+        self.client = yweather.Client(throttle=self.throttle)
+        self.client.transport.open = self.open_feed
+
+    def test_limit_for(self):
+        self.assertIs(self.throttle.limit_for(
+            yweather.LID_WEATHER_URL.format("USNC0558", "f")),
+            self.weather_limit)
+        self.assertIs(self.throttle.limit_for(
+            yweather.WOEID_LOOKUP_URL.format("Raleigh")), self.woeid_limit)
+        self.assertIs(self.throttle.limit_for(
+            yweather.WOEID_BATCH_LOOKUP_URL.format("'Raleigh'")),
+            self.woeid_limit)
+        batch_limit = yweather.HostLimit()
+        throttle = yweather.Throttle({
+            yweather.WOEID_LOOKUP_URL: self.woeid_limit,
+            yweather.WOEID_BATCH_LOOKUP_URL: batch_limit,
+        })
+        self.assertIs(throttle.limit_for(
+            yweather.WOEID_BATCH_LOOKUP_URL.format("'Raleigh'")), batch_limit)
+        self.assertEqual(self.throttle.limit_for("http://example.com/"),
+                         None)
+
+    def test_client(self):
+        self.client.fetch_weather("2478307")
+        self.client.fetch_weather("USNC0558")
+        self.assertEqual(self.weather_limit.stats["requests"], 2)
+        self.assertEqual(self.weather_limit._in_flight, 0)
+        self.assertRaises(yweather.HTTPError, self.client.fetch_weather,
+                          "bad")
+        self.assertEqual(self.weather_limit.stats["congested"], 1)
+        self.assertLess(self.weather_limit.concurrency, 4)
+        self.assertEqual(self.woeid_limit.stats["requests"], 0)
+
+
+class Recorder(object):
+
+    """A client metrics object that keeps every Timing it observes."""
+
+    def __init__(self):
+        self.timings = []
+
+    def observe(self, timing):
+        self.timings.append(timing)
+
+
+class testMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FeedServer().start()
+        self.url = yweather.WEATHER_URL
+        yweather.WEATHER_URL = self.server.url(yweather.WEATHER_URL)
+        self.size = len(self.server._server.documents["weather"])
+
+    def tearDown(self):
+        yweather.WEATHER_URL = self.url
+        self.server.stop()
+
+    def test_phases(self):
+        transport = yweather.PooledTransport()
+        recorder = Recorder()
+        client = yweather.Client(transport=transport, metrics=recorder)
+        untimed = yweather.Client(transport=transport)
+        self.assertEqual(client.fetch_weather("2478307"),
+                         untimed.fetch_weather("2478307"))
+        client.fetch_weather("2478307")
+        transport.close()
+        first, second = recorder.timings
+        self.assertEqual(first.url,
+                         yweather.WEATHER_URL.format("2478307", "f"))
+        self.assertFalse(first.cache_hit)
+        self.assertFalse(first.not_modified)
+        self.assertEqual(first.bytes, self.size)
+        self.assertEqual(second.connect, 0.0)
+        for phase in ("connect", "first_byte", "body", "parse", "extract"):
+            self.assertGreaterEqual(getattr(first, phase), 0)
+        self.assertGreaterEqual(first.first_byte, first.connect)
+
+    def test_cache_and_not_modified(self):
+        recorder = Recorder()
+        client = yweather.Client(cache=yweather.TTLCache(),
+                                 conditional_get=True, metrics=recorder)
+        client.fetch_weather("2478307")
+        client.fetch_weather("2478307")
+        client.fetch_weather("2478307", use_cache=False)
+        miss, hit, not_modified = recorder.timings
+        self.assertEqual(miss.connect, None)
+        self.assertTrue(hit.cache_hit)
+        self.assertEqual(hit.first_byte, None)
+        self.assertEqual(hit.url, miss.url)
+        self.assertTrue(not_modified.not_modified)
+        self.assertEqual(not_modified.bytes, 0)
+        self.assertEqual(not_modified.parse, None)
+
+    def test_histogram(self):
+        histogram = yweather.TimingHistogram(bounds=(0.001, 1))
+        histogram.observe(yweather.Timing("u", False, False, 0.0, 0.5, 0.002,
+                                          0.0005, 2, 100))
+        histogram.observe(yweather.Timing("u", True, False, None, None, None,
+                                          None, None, None))
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["stats"], {"fetches": 2, "cache_hits": 1,
+                                             "not_modified": 0, "bytes": 100})
+        self.assertEqual(snapshot["first_byte"]["buckets"],
+                         [(0.001, 0), (1, 1), (float("inf"), 1)])
+        self.assertEqual(snapshot["extract"]["buckets"][-1],
+                         (float("inf"), 1))
+        self.assertEqual(snapshot["extract"]["buckets"][1], (1, 0))
+        self.assertEqual(snapshot["connect"]["count"], 1)
+        self.assertEqual(snapshot["parse"]["sum"], 0.0005)
+
+    def test_client_histogram(self):
+        histogram = yweather.TimingHistogram()
+        client = yweather.Client(metrics=histogram)
+        client.fetch_weather("2478307")
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["stats"]["bytes"], self.size)
+        self.assertEqual(snapshot["parse"]["count"], 1)
+        self.assertEqual(snapshot["connect"]["count"], 0)
+
+
+class testFeedServer(unittest.TestCase):
+
+    def setUp(self):
+        self.url = yweather.WEATHER_URL
+
+    def tearDown(self):
+        yweather.WEATHER_URL = self.url
+
+    def test_padding(self):
+        server = FeedServer(padding=4096).start()
+        try:
+            yweather.WEATHER_URL = server.url(self.url)
+            weather = yweather.Client().fetch_weather("2478307")
+        finally:
+            server.stop()
+        self.assertEqual(weather["wind"]["direction"], "240")
+
+    def test_errors(self):
+        server = FeedServer(error_rate=1).start()
+        try:
+            yweather.WEATHER_URL = server.url(self.url)
+            with self.assertRaises(yweather.HTTPError) as context:
+                yweather.Client().fetch_weather("2478307")
+        finally:
+            server.stop()
+        self.assertEqual(context.exception.code, 503)
+
+
+class testReplay(unittest.TestCase):
+
+    def clock(self):
+        self.now += 1
+        return self.now
+
+    def setUp(self):
+        self.now = 0
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "feeds.seg")
+        self.recorder = yweather.RecordingTransport(
+            self.path, FileTransport(), clock=self.clock)
+        self.transports = [self.recorder]
+
+    def tearDown(self):
+        for transport in self.transports:
+            transport.close()
+        shutil.rmtree(self.directory)
+
+    def replay(self):
+        transport = yweather.ReplayTransport(self.path)
+        self.transports.append(transport)
+        return transport
+
+    def test_record_replay(self):
+        recording = yweather.Client(transport=self.recorder)
+        expected = (recording.fetch_weather("2478307"),
+                    recording.fetch_weather("USNC0558"),
+                    recording.fetch_lid("2478307"))
+        self.assertRaises(yweather.HTTPError, self.recorder.open,
+                          "http://example.com/missing")
+        self.assertEqual(self.recorder.stats["records"], 4)
+        self.assertLess(self.recorder.stats["compressed"],
+                        self.recorder.stats["bytes"])
+
+        transport = self.replay()
+        replaying = yweather.Client(transport=transport)
+        self.assertEqual((replaying.fetch_weather("2478307"),
+                          replaying.fetch_weather("USNC0558"),
+                          replaying.fetch_lid("2478307")), expected)
+        with self.assertRaises(yweather.HTTPError) as context:
+            transport.open("http://example.com/missing")
+        self.assertEqual(context.exception.code, 404)
+        self.assertEqual(context.exception.read(), b"not found")
+        self.assertRaises(yweather.URLError, replaying.fetch_weather, "1")
+        self.assertEqual(transport.stats["misses"], 1)
+        records = list(transport.records())
+        self.assertEqual([record[1] for record in records], [1, 2, 3, 4])
+        self.assertEqual(records[3][2], 404)
+        self.assertEqual(len(transport.urls()), 3)
+
+    def test_not_modified(self):
+        recording = yweather.Client(transport=self.recorder,
+                                    conditional_get=True)
+        opened = self.recorder.transport.open
+
+        def not_modified(url, headers=None):
+            if headers:
+                return yweather._BufferedResponse(304, "Not Modified", {},
+                                                  b"")
+            response = opened(url, headers)
+            body = response.read()
+            response.close()
+            return yweather._BufferedResponse(200, "OK", {"ETag": "1"}, body)
+        self.recorder.transport.open = not_modified
+        expected = recording.fetch_weather("2478307")
+        self.assertEqual(recording.fetch_weather("2478307"), expected)
+        self.assertEqual(recording.stats["not_modified"], 1)
+        self.assertEqual(self.recorder.stats["records"], 1)
+        replaying = yweather.Client(transport=self.replay())
+        self.assertEqual(replaying.fetch_weather("2478307"), expected)
+
+    def test_append_and_truncate(self):
+        url = yweather.WEATHER_URL.format("2478307", "f")
+        self.recorder.open(url).close()
+        self.recorder.close()
+        self.recorder = yweather.RecordingTransport(self.path,
+                                                    FileTransport())
+        self.transports[0] = self.recorder
+        self.recorder.open(url).close()
+        self.assertEqual(len(list(self.replay().records())), 2)
+        with open(self.path, "ab") as f:
+            f.write(b"\0" * 10)
+        self.assertEqual(len(list(self.replay().records())), 2)
+
+    def test_not_a_segment(self):
+        path = os.path.join(self.directory, "empty")
+        open(path, "wb").close()
+        self.assertRaises(ValueError, yweather.ReplayTransport, path)
+        self.assertRaises(ValueError, yweather.ReplayTransport,
+                          os.path.join(os.path.dirname(__file__), "data",
+                                       "data_weather.xml"))
+
+
+def sweep_client(base):
+    """Return a client for a sweep worker that fetches weather from the
+    FeedServer at *base*."""
+    for name in ("WEATHER_URL", "LID_WEATHER_URL"):
+        template = getattr(yweather, name)
+        path = template.split("://", 1)[1].split("/", 1)[1]
+        setattr(yweather, name, base + "/" + path)
+    return yweather.Client(transport=yweather.PooledTransport())
+
+
+class testSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_sweep(self, server, ids, **kwargs):
+        server.start()
+        try:
+            return sorted(yweather.sweep(
+                ids, self.directory, processes=2, threads=2,
+                client_factory=functools.partial(sweep_client, server.base),
+                **kwargs))
+        finally:
+            server.stop()
+
+    def test_ndjson(self):
+        ids = ["2478307", "USNC0558", "1", "2", "3"]
+        results = self.run_sweep(FeedServer(), ids, shards=3)
+        self.assertEqual([result.count for result in results], [2, 2, 1])
+        self.assertEqual(sum(result.errors for result in results), 0)
+        lines = []
+        for result in results:
+            self.assertGreater(result.throughput, 0)
+            with open(result.path, encoding="utf-8") as f:
+                lines.extend(json.loads(line) for line in f)
+        self.assertEqual(sorted(line["id"] for line in lines), sorted(ids))
+        for line in lines:
+            self.assertEqual(line["weather"]["ttl"], "60")
+            self.assertEqual(len(line["weather"]["forecast"]),
+                             5 if line["id"] == "USNC0558" else 2)
+
+    def test_csv_errors(self):
+        results = self.run_sweep(FeedServer(error_rate=1), ["1", "2"],
+                                 format="csv")
+        self.assertEqual([(result.count, result.errors)
+                          for result in results], [(1, 1), (1, 1)])
+        with open(results[0].path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_format(self):
+        self.assertRaises(ValueError, yweather.sweep, [], self.directory,
+                          "xml")
+
+    def test_setup(self):
+        directory = os.path.join(self.directory, "shards")
+        ids = iter(["2478307", "USNC0558"])
+        results = yweather.sweep(ids, directory)
+        self.assertTrue(os.path.isdir(directory))
+        self.assertEqual(list(ids), [])
+        results.close()
+
+
+class testChangeTracker(unittest.TestCase):
+
+    def open_feed(self, url, headers=None):
+        return io.BytesIO(self.feed)
+
+    def edit(self, old, new):
+        self.assertIn(old, self.feed)
+        self.feed = self.feed.replace(old, new)
+
+    def setUp(self):
+        with open(os.path.join(os.path.dirname(__file__), "data",
+                               "data_weather.xml"), "rb") as f:
+            self.feed = f.read()
+        self.client = yweather.Client()
+        self.client._open = self.open_feed
+        self.tracker = yweather.ChangeTracker(self.client)
+
+    def test_first_result(self):
+        delta = self.tracker.update("2478307")
+        self.assertEqual(delta["id"], "2478307")
+        self.assertEqual(delta["lastBuildDate"],
+                         "Mon, 24 Dec 2012 10:50 pm EST")
+        self.assertEqual(delta["wind"]["direction"], "240")
+        self.assertEqual(delta["condition"]["temp"], "50")
+        self.assertEqual(len(delta["forecast"]), 2)
+
+    def test_fast_path(self):
+        self.tracker.update("2478307")
+        self.edit(b'temp="50"', b'temp="51"')
+        self.assertEqual(self.tracker.update("2478307"), None)
+        self.assertEqual(self.tracker.stats["unchanged_fast"], 1)
+        self.assertEqual(self.tracker.last("2478307")["condition"]["temp"],
+                         "51")
+
+    def test_changes(self):
+        self.tracker.update("2478307")
+        self.edit(b"<lastBuildDate>Mon, 24 Dec 2012 10:50",
+                  b"<lastBuildDate>Mon, 24 Dec 2012 11:50")
+        self.assertEqual(self.tracker.update("2478307"), None)
+        self.assertEqual(self.tracker.stats["unchanged"], 1)
+        self.edit(b"2012 11:50", b"2012 11:55")
+        self.edit(b'temp="50"', b'temp="51"')
+        self.edit(b'high="58"', b'high="59"')
+        delta = self.tracker.update("2478307")
+        self.assertEqual(delta["lastBuildDate"],
+                         "Mon, 24 Dec 2012 11:55 pm EST")
+        self.assertEqual(delta["condition"], {"temp": "51"})
+        self.assertNotIn("wind", delta)
+        self.assertEqual([day["high"] for day in delta["forecast"]], ["59"])
+        self.assertEqual(self.tracker.stats["changed"], 2)
+        self.tracker.forget("2478307")
+        self.assertEqual(len(self.tracker.update("2478307")["forecast"]), 2)
+
+    def test_update_many(self):
+        results = list(self.tracker.update_many(["1", "2"]))
+        self.assertEqual(sorted(result.id for result in results),
+                         ["1", "2"])
+        self.assertEqual(list(self.tracker.update_many(["1", "2"])), [])
+
+
+class testImportTime(unittest.TestCase):
+
+    # Modules that importing yweather must leave for first use, and the
+    # budget in microseconds of its cumulative import time with cached
+    # bytecode. Importing them eagerly took about 150 ms; the lazy import
+    # takes about 20 ms. Some Python versions import a lazy module for the
+    # standard library modules yweather imports eagerly (3.7's threading
+    # imports re through traceback, for example), so only the modules that
+    # those don't import are checked.
+    lazy_modules = ("argparse", "asyncio", "concurrent.futures", "csv",
+                    "http.client", "json", "re", "sqlite3", "ssl",
+                    "urllib.request", "urllib.parse", "urllib.error",
+                    "xml.etree.ElementTree")
+    eager_modules = ("array", "bisect", "collections", "contextlib", "heapq",
+                     "importlib", "io", "marshal", "mmap", "os", "random",
+                     "struct", "sys", "threading", "time", "zlib")
+    budget = 100000
+
+    def import_times(self, modules=("yweather",)):
+        """Import *modules* in a new interpreter and return a dict that maps
+        each imported module to its cumulative import time."""
+
+        # PYTHONPYCACHEPREFIX keeps the bytecode out of the source tree on
+        # Python 3.8 and later; 3.7 ignores it and writes it to
+        # __pycache__ as usual.
+
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=self.directory)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import " + ", ".join(modules)],
+            cwd=os.path.dirname(os.path.abspath(yweather.__file__)),
+            env=env, stderr=subprocess.PIPE, check=True,
+            universal_newlines=True).stderr
+        times = {}
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            (self_time, cumulative, name) = line[12:].split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+        return times
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lazy_modules(self):
+        times = self.import_times()
+        self.assertIn("yweather", times)
+        eager = self.import_times(self.eager_modules)
+        for name in self.lazy_modules:
+            if name not in eager:
+                self.assertNotIn(name, times)
+
+    def test_budget(self):
+        self.import_times()
+        cumulative = min(self.import_times()["yweather"] for i in range(3))
+        self.assertLess(cumulative, self.budget)
+
+    def test_first_use(self):
+        self.assertIs(yweather.HTTPError, urllib.error.HTTPError)
+        self.assertIs(yweather.quote, urllib.parse.quote)
+        self.assertRaises(AttributeError, getattr, yweather, "missing")
+        client = yweather.Client()
+        self.assertEqual(client._weather_url("USNC0558", "f"),
+                         yweather.LID_WEATHER_URL.format("USNC0558", "f"))
@@ -0,0 +1,51 @@
+"""The whole-tree weather feed parser that Client's single-pass parsing
+replaced.
+
+parse_weather extracts the weather data from a feed that has already been
+parsed into an ElementTree, the way Client.fetch_weather once did. It is
+kept as a reference: the tests check that the single-pass parsers return
+the same data, and benchmarks/bench_parse.py times one against the other.
+
+"""
+
+import yweather
+
+
+def parse_weather(client, rss, units):
+    """Return the weather data in a parsed weather feed, finished by
+    *client*, or None if the feed has none."""
+    if rss.find("channel/item/title").text == "City not found":
+        return None
+
+    weather = {}
+    weather["units"] = yweather.UNITS[units]
+
+    for (tag, meta) in yweather._WEATHER_ITEMS.items():
+        if meta[0] == "text":
+            try:
+                weather[meta[1]] = rss.find(tag).text
+            except AttributeError:
+                weather[meta[1]] = None
+        elif meta[0] == "attrib":
+            try:
+                weather[meta[1]] = rss.find(tag).attrib
+            except AttributeError:
+                weather[meta[1]] = None
+        else:
+            weather[meta[1]] = None
+
+    weather["forecast"] = []
+    try:
+        for item in rss.findall(yweather._FORECAST_PATH):
+            weather["forecast"].append(item.attrib)
+    except AttributeError:
+        weather["forecast"] = None
+
+    weather["geo"] = {}
+    try:
+        for (tag, key) in yweather._GEO_ITEMS.items():
+            weather["geo"][key] = rss.find(tag).text
+    except AttributeError:
+        weather["geo"] = None
+
+    return client._finish_weather(weather, units)
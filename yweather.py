@@ -24,39 +24,165 @@
 
 Classes:
     Client: interface with the Yahoo! Weather RSS Feed.
+    TTLCache: an in-memory LRU cache for weather data.
+    SharedCache: a cache shared between processes through a mapped file.
+    ResolutionStore: a persistent store of WOEID and LID lookups.
+    UrllibTransport: open URLs with urllib (the default transport).
+    PooledTransport: open URLs over pooled keep-alive connections.
+    ElementTreeParser: read feeds with xml.etree.ElementTree (the default).
+    ExpatParser: read feeds with expat callbacks, without building elements.
+    LxmlParser: read feeds with lxml.etree.
+    BulkResult: a result yielded by Client.fetch_weather_many.
+    AsyncClient: interface with the Yahoo! Weather RSS Feed from asyncio.
+    AsyncTransport: open URLs with asyncio over pooled connections.
+    Weather: a location's weather data as a compact record.
+    Location, Wind, Atmosphere, Astronomy, Condition, Forecast, Geo: the
+        records that make up a Weather record.
+    WeatherColumns: weather data for many locations as typed columns.
+    Refresher: keep the weather of watched locations fresh in memory.
+    ChangeTracker: report only what changed in many locations' weather.
+    HostLimit: a rate limit and adaptive concurrency limit for one host.
+    Throttle: apply HostLimits to a client's requests.
+    RecordingTransport: record another transport's responses in a segment.
+    ReplayTransport: answer requests with the responses in a segment.
+    ShardResult: a shard completed by sweep.
+    Timing: the time spent in each phase of one weather fetch.
+    TimingHistogram: aggregate Timings into histograms.
+
+Functions:
+    degrees_to_compass: convert a wind direction to a compass point.
+    degrees_to_compass_many: convert many wind directions to compass points.
+    sweep: fetch many locations' weather on a pool of processes.
+    sweep_main: the yweather-sweep command.
 
 Constants:
     WOEID_LOOKUP_URL: the URL used to fetch a location’s corresponding WOEID.
+    WOEID_BATCH_LOOKUP_URL: the URL used to fetch many locations' WOEIDs.
     WEATHER_URL: the URL used to fetch a WOEID's weather.
     LID_LOOKUP_URL: the URL used to fetch a location's corresponding LID.
     LID_WEATHER_URL: the URL used to fetch a LID's weather.
     WEATHER_NS: the XML namespace used in the weather RSS feed.
     GEO_NS: the XML namespace used for the coordinates in the RSS feed.
     CONDITION_IMAGE_URL: the URL of an image depicting the current conditions.
+    DEFAULT_TTL: seconds to cache weather data whose feed has no ttl.
+    WEATHER_FIELDS: the names of the weather data's fields.
     UNITS: a dict that maps data names to units.
 
 """
 
-try:
-    from urllib.request import urlopen
-    from urllib.parse import quote
-except ImportError:
-    from urllib2 import urlopen
-    from urllib import quote
+import array
+import bisect
+import collections
 import contextlib
-import re
-import xml.etree.ElementTree
+import heapq
+import importlib
+import io
+import marshal
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+class _Lazy(object):
+
+    """A stand-in for a global that is loaded when it is first used.
+
+    The first attribute lookup calls *load* and rebinds the global named
+    *binding* to its result, so later lookups go straight to the loaded
+    object.
+
+    """
+
+    def __init__(self, binding, load):
+        self._binding = binding
+        self._load = load
+
+    def __getattr__(self, attr):
+        value = self._load()
+        globals()[self._binding] = value
+        return getattr(value, attr)
+
+
+def _lazy_import(binding, *names):
+    """Return a stand-in for the global *binding* that imports the modules
+    *names* (by default, *binding*) when it is first used.
+
+    If *binding* is the top-level package of the first name, the stand-in
+    becomes that package, as with "import xml.etree.ElementTree";
+    otherwise it becomes the first module, as with "import http.client as
+    httplib".
+
+    """
+    names = names or (binding,)
+
+    def load():
+        for name in names:
+            importlib.import_module(name)
+        if binding == names[0].partition(".")[0]:
+            return sys.modules[binding]
+        return sys.modules[names[0]]
+    return _Lazy(binding, load)
+
+
+# Modules that only fetching, parsing, the asyncio client, the stores or the
+# command line need are imported on first use, so that importing yweather
+# stays cheap for programs that never fetch.
+argparse = _lazy_import("argparse")
+asyncio = _lazy_import("asyncio")
+concurrent = _lazy_import("concurrent", "concurrent.futures")
+csv = _lazy_import("csv")
+httplib = _lazy_import("httplib", "http.client")
+json = _lazy_import("json")
+re = _lazy_import("re")
+socket = _lazy_import("socket")
+sqlite3 = _lazy_import("sqlite3")
+urllib = _lazy_import("urllib", "urllib.request", "urllib.parse",
+                      "urllib.error")
+xml = _lazy_import("xml", "xml.etree.ElementTree", "xml.parsers.expat")
+
+# The urllib names that yweather used to import directly, which
+# __getattr__ still provides.
+_URLLIB_NAMES = {
+    "urlopen": "request",
+    "Request": "request",
+    "quote": "parse",
+    "urljoin": "parse",
+    "urlsplit": "parse",
+    "HTTPError": "error",
+    "URLError": "error",
+}
+
+
+def __getattr__(name):
+    """Return one of the urllib names in _URLLIB_NAMES."""
+    if name in _URLLIB_NAMES:
+        return getattr(getattr(urllib, _URLLIB_NAMES[name]), name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 WOEID_LOOKUP_URL = ("http://locdrop.query.yahoo.com/v1/public/yql?"
                     "q=select%20woeid%20from%20locdrop.placefinder%20"
                     "where%20text='{0}'")
+WOEID_BATCH_LOOKUP_URL = ("http://locdrop.query.yahoo.com/v1/public/yql?"
+                          "q=select%20woeid,%20text%20from%20"
+                          "locdrop.placefinder%20where%20text%20in%20({0})")
 WEATHER_URL = "http://xml.weather.yahoo.com/forecastrss?w={0}&u={1}"
 LID_LOOKUP_URL = WEATHER_URL
 LID_WEATHER_URL = "http://xml.weather.yahoo.com/forecastrss/{0}_{1}.xml"
 WEATHER_NS = "http://xml.weather.yahoo.com/ns/rss/1.0"
 GEO_NS = "http://www.w3.org/2003/01/geo/wgs84_pos#"
 CONDITION_IMAGE_URL = "http://l.yimg.com/a/i/us/we/52/{0}.gif"
+DEFAULT_TTL = 60 * 60
+WEATHER_FIELDS = ("title", "link", "language", "description", "lastBuildDate",
+                  "ttl", "logo", "guid", "units", "location", "wind",
+                  "atmosphere", "astronomy", "condition", "forecast", "geo")
+_MISSING = object()
+_NAN = float("nan")
 UNITS = {
     "c": {
         "wind": {
@@ -91,255 +217,4294 @@ UNITS = {
 }
 
 
-class Client(object):
+def _number(value):
+    """Convert a number from the feed to an int or float.
 
-    """Interface with the Yahoo! Weather RSS feed.
+    Returns None if *value* is None or isn't a number.
 
-    Provides methods to search for location data and fetch weather data.
+    """
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
 
-    Methods:
-        fetch_lid: fetch a location's LID.
-        fetch_woeid: fetch a location's WOEID.
-        fetch_weather: fetch a location's weather.
+
+# _COMPASS_BOUNDS holds the upper bound in degrees of each of the compass
+# points in _COMPASS_POINTS. A direction above the last bound is N from
+# _COMPASS_NORTH degrees and has no compass point below that.
+
+_COMPASS_BOUNDS = (11.25, 33.75, 56.25, 78.75, 101.25, 123.75, 146.25, 168.75,
+                   191.25, 213.75, 236.25, 258.75, 281.25, 303.75, 326.25,
+                   348.75)
+_COMPASS_POINTS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S",
+                   "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+_COMPASS_NORTH = 348.76
+
+
+def degrees_to_compass(degrees):
+    """Convert a wind direction from degrees to a compass point.
+
+    Args:
+        degrees: (float or string) the direction, from 0 to 360.
+
+    Returns:
+        a string containing one of the 16 compass points (e.g. "WSW"), or
+            None if *degrees* isn't a number (including NaN) or is out of
+            range.
+
+    Raises:
+        TypeError: *degrees* isn't a number or a string.
 
     """
+    try:
+        degrees = float(degrees)
+    except ValueError:
+        return None
+    if not 0 <= degrees <= 360:
+        return None
+    if degrees > _COMPASS_BOUNDS[-1]:
+        if degrees >= _COMPASS_NORTH:
+            return "N"
+        return None
+    return _COMPASS_POINTS[bisect.bisect_left(_COMPASS_BOUNDS, degrees)]
 
-    def fetch_lid(self, woeid):
-        """Fetch a location's corresponding LID.
 
-        Args:
-            woeid: (string) the location's WOEID.
+def degrees_to_compass_many(directions):
+    """Convert many wind directions from degrees to compass points.
 
-        Returns:
-            a string containing the requested LID or None if the LID could
-            not be found.
+    Each direction is converted as by degrees_to_compass, but without a
+    function call per direction. A WeatherColumns column, such as
+    wind_direction, can be passed directly; its NaNs become None.
 
-        Raises:
-            urllib.error.URLError: urllib.request could not open the URL
-                (Python 3).
-            urllib2.URLError: urllib2 could not open the URL (Python 2).
-            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
-                parse the XML document.
+    Args:
+        directions: (iterable) the directions, e.g. a list, an array.array
+            or a memoryview of floats.
 
-        """
-        rss = self._fetch_xml(LID_LOOKUP_URL.format(woeid, "f"))
+    Returns:
+        a list of compass points, with None for each direction that has
+            none.
 
-        # We are pulling the LID from the permalink tag in the XML file
-        # returned by Yahoo.
+    Raises:
+        TypeError: a direction isn't a number or a string.
 
+    """
+    points = _COMPASS_POINTS
+    bounds = _COMPASS_BOUNDS
+    last = bounds[-1]
+    index = bisect.bisect_left
+    compass = []
+    append = compass.append
+    for degrees in directions:
         try:
-            link = rss.find("channel/link").text
-        except AttributeError:
-            return None
+            degrees = float(degrees)
+        except ValueError:
+            append(None)
+            continue
+        if not 0 <= degrees <= 360:
+            append(None)
+        elif degrees <= last:
+            append(points[index(bounds, degrees)])
+        elif degrees >= _COMPASS_NORTH:
+            append("N")
+        else:
+            append(None)
+    return compass
 
-        # use regex or string.split
-        # regex assumes the format XXXXNNNN for the LID.
-        # string.split works more general of the context.
 
-        lid = re.search("[A-Za-z]{4}[0-9]{4}", link).group()
-        # lid = link.split("/forecast/")[1].split("_")[0]
+class _Record(object):
 
-        return lid
+    """Base class of the weather data records.
 
-    def fetch_weather(self, id, metric=False):
-        """Fetch a location's weather.
+    A record stores the fields named in its __slots__. The fields named in
+    _numbers are converted to numbers when the record is created from the
+    feed's data.
 
-        *id* can be either a WOEID or LID. The weather data returned for each
-        is identical except that the WOEID returns a 2-day forecast and the LID
-        returns a 5-day forecast. The LID uses an undocumented API, so use it
-        at your own risk.
+    """
+
+    __slots__ = ()
+    _numbers = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self.__slots__))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a record from a dict of the feed's string values."""
+        fields = {}
+        for name in cls.__slots__:
+            value = data.get(name)
+            if name in cls._numbers:
+                value = _number(value)
+            fields[name] = value
+        return cls(**fields)
+
+    def to_dict(self):
+        """Return the record as a dict of strings, as in fetch_weather's
+        default result.
+
+        Numbers are formatted by str(), so they may be written differently
+        than in the feed: "30.10" becomes "30.1" and "05" becomes "5".
+
+        """
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if name in self._numbers and value is not None:
+                value = str(value)
+            data[name] = value
+        return data
+
+
+class Location(_Record):
+
+    """A location's city, region and country."""
+
+    __slots__ = ("city", "region", "country")
+
+
+class Wind(_Record):
+
+    """Wind chill, direction (in degrees and as a compass point) and speed."""
+
+    __slots__ = ("chill", "direction", "speed", "compass")
+    _numbers = ("chill", "direction", "speed")
+
+
+class Atmosphere(_Record):
+
+    """Humidity, visibility, and barometric pressure and its state."""
+
+    __slots__ = ("humidity", "visibility", "pressure", "rising", "state")
+    _numbers = ("humidity", "visibility", "pressure", "rising")
+
+
+class Astronomy(_Record):
+
+    """Today's sunrise and sunset times."""
+
+    __slots__ = ("sunrise", "sunset")
+
+
+class Condition(_Record):
+
+    """The current conditions."""
+
+    __slots__ = ("text", "code", "temp", "date", "image")
+    _numbers = ("code", "temp")
+
+
+class Forecast(_Record):
+
+    """The weather forecast for one day."""
+
+    __slots__ = ("day", "date", "low", "high", "text", "code")
+    _numbers = ("low", "high", "code")
+
+
+class Geo(_Record):
+
+    """A location's latitude and longitude."""
+
+    __slots__ = ("lat", "long")
+    _numbers = ("lat", "long")
+
+
+class Weather(_Record):
+
+    """A location's weather data.
+
+    This is the record returned by fetch_weather when the client was created
+    with records=True. Its fields match the keys of fetch_weather's default
+    dict, except that units is "f" or "c" instead of a dict from UNITS,
+    forecast is a tuple, numbers are ints or floats, and the nested dicts are
+    Location, Wind, Atmosphere, Astronomy, Condition, Forecast and Geo
+    records.
+
+    """
+
+    __slots__ = ("title", "link", "language", "description", "lastBuildDate",
+                 "ttl", "logo", "guid", "units", "location", "wind",
+                 "atmosphere", "astronomy", "condition", "forecast", "geo")
+    _numbers = ("ttl",)
+    _records = {"location": Location, "wind": Wind, "atmosphere": Atmosphere,
+                "astronomy": Astronomy, "condition": Condition, "geo": Geo}
+
+    @classmethod
+    def from_dict(cls, data, units):
+        """Create a record from fetch_weather's default dict in *units*."""
+        fields = {"units": units}
+        for name in cls.__slots__:
+            value = data.get(name)
+            if name in cls._records:
+                if value is not None:
+                    value = cls._records[name].from_dict(value)
+            elif name == "forecast":
+                if value is not None:
+                    value = tuple(Forecast.from_dict(day) for day in value)
+            elif name in cls._numbers:
+                value = _number(value)
+            elif name == "units":
+                continue
+            fields[name] = value
+        return cls(**fields)
+
+    def to_dict(self):
+        """Return the weather data in fetch_weather's default dict shape.
+
+        Numbers are formatted as by _Record.to_dict, which doesn't keep
+        the feed's trailing zeros.
+
+        """
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if name == "units":
+                value = UNITS[value]
+            elif name == "forecast":
+                if value is not None:
+                    value = [day.to_dict() for day in value]
+            elif isinstance(value, _Record):
+                value = value.to_dict()
+            elif name in self._numbers and value is not None:
+                value = str(value)
+            data[name] = value
+        return data
+
+
+class WeatherColumns(object):
+
+    """Weather data for many locations, stored as typed columns.
+
+    Each location is a row. Its numeric data is stored in array.array
+    columns of doubles, with NaN where the feed had no value. Forecasts are
+    stored in columns of their own with one row per forecast day; the
+    forecast_row column holds the index of each day's location row.
+
+    column() returns a zero-copy memoryview of a column and to_numpy()
+    returns zero-copy NumPy arrays (NumPy is optional). A column can't grow
+    while a view of it exists, so release views before appending more rows.
+
+    Attributes:
+        ids: a list of each row's WOEID or LID.
+        forecast_dates: a list of each forecast row's date.
+        errors: a dict that maps each id that couldn't be fetched to the
+            exception raised.
+
+    Methods:
+        append: add a location's weather data as a row.
+        column: return a view of a column.
+        to_numpy: return the columns as NumPy arrays.
+        to_csv: write the rows as CSV.
+
+    """
+
+    # {column name: (weather data key, field)}
+
+    columns = collections.OrderedDict([
+        ("condition_temp", ("condition", "temp")),
+        ("condition_code", ("condition", "code")),
+        ("wind_chill", ("wind", "chill")),
+        ("wind_direction", ("wind", "direction")),
+        ("wind_speed", ("wind", "speed")),
+        ("humidity", ("atmosphere", "humidity")),
+        ("visibility", ("atmosphere", "visibility")),
+        ("pressure", ("atmosphere", "pressure")),
+    ])
+    forecast_columns = collections.OrderedDict([
+        ("forecast_low", "low"),
+        ("forecast_high", "high"),
+        ("forecast_code", "code"),
+    ])
+
+    # The WEATHER_FIELDS that the columns are read from.
+
+    fields = frozenset(["condition", "wind", "atmosphere", "forecast"])
+
+    def __init__(self):
+        self.ids = []
+        self.forecast_dates = []
+        self.errors = {}
+        self._columns = {"forecast_row": array.array("l")}
+        for name in list(self.columns) + list(self.forecast_columns):
+            self._columns[name] = array.array("d")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, id, weather):
+        """Add a location's weather data as a row.
 
         Args:
             id: (string) the location's WOEID or LID.
-            metric: (bool) return metric data; defaults to False.
+            weather: the location's weather data as returned by
+                fetch_weather: a dict or a Weather record.
 
-        Returns:
-            a dict containing the location's weather data or None if
-                the weather data couldn't be fetched.
+        """
+        if isinstance(weather, Weather):
+            get = getattr
+            forecast = weather.forecast
+        else:
+            get = dict.get
+            forecast = weather.get("forecast")
+        row = len(self.ids)
+        self.ids.append(id)
+        for (name, (key, field)) in self.columns.items():
+            data = get(weather, key)
+            self._columns[name].append(
+                _float(None if data is None else get(data, field)))
+        for day in forecast or ():
+            self._columns["forecast_row"].append(row)
+            self.forecast_dates.append(get(day, "date"))
+            for (name, field) in self.forecast_columns.items():
+                self._columns[name].append(_float(get(day, field)))
+
+    def column(self, name):
+        """Return a memoryview of the column *name*."""
+        return memoryview(self._columns[name])
+
+    def to_numpy(self):
+        """Return a dict that maps each column name to a NumPy array that
+        shares the column's memory.
 
         Raises:
-            urllib.error.URLError: urllib.request could not open the URL
-                (Python 3).
-            urllib2.URLError: urllib2 could not open the URL (Python 2).
-            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
-                parse the XML document.
+            ImportError: NumPy isn't installed.
 
         """
+        import numpy
+        arrays = {}
+        for (name, column) in self._columns.items():
+            arrays[name] = numpy.frombuffer(column, dtype=column.typecode)
+        return arrays
 
-        units = "c" if metric else "f"
+    def to_csv(self, f, forecast=False):
+        """Write the rows as CSV, with a header row.
 
-        # WOEID is a 32-bit integer, while LID is XXXXNNNN, where X is a letter
-        # and N is a number. So, we pick the URL to use based on whether or not
-        # the *id* begins with a letter.
+        Missing values are written as empty fields.
+
+        Args:
+            f: a file opened for writing text (with newline="").
+            forecast: (bool) write the forecast rows, identified by id and
+                date, instead of the location rows; defaults to False.
 
-        if re.match("^[A-Za-z]", id):
-            url = LID_WEATHER_URL.format(id, units)
+        """
+        writer = csv.writer(f)
+        if forecast:
+            names = list(self.forecast_columns)
+            writer.writerow(["id", "date"] + names)
+            rows = self._columns["forecast_row"]
+            for i in range(len(rows)):
+                writer.writerow(
+                    [self.ids[rows[i]], self.forecast_dates[i]] +
+                    [_csv_value(self._columns[name][i]) for name in names])
         else:
-            url = WEATHER_URL.format(id, units)
+            names = list(self.columns)
+            writer.writerow(["id"] + names)
+            for i in range(len(self.ids)):
+                writer.writerow(
+                    [self.ids[i]] +
+                    [_csv_value(self._columns[name][i]) for name in names])
 
-        rss = self._fetch_xml(url)
 
-        if rss.find("channel/item/title").text == "City not found":
-            return None
+def _float(value):
+    """Convert a number from the feed to a float, or NaN if it isn't one."""
+    if value is None:
+        return _NAN
+    try:
+        return float(value)
+    except ValueError:
+        return _NAN
 
-        # xml_items details which tags should be read and what their
-        # destination dict key should be. These tags don't appear
-        # multiple times.
-        # {XML tag: [ElementTree access method, dict key]}
-
-        xml_items = {
-            "channel/title": ["text", "title"],
-            "channel/link": ["text", "link"],
-            "channel/language": ["text", "language"],
-            "channel/description": ["text", "description"],
-            "channel/lastBuildDate": ["text", "lastBuildDate"],
-            "channel/ttl": ["text", "ttl"],
-            "channel/image/url": ["text", "logo"],
-            "channel/item/guid": ["text", "guid"],
-            "channel/{%s}location" % WEATHER_NS:
-                ["attrib", "location"],
-            # "channel/{%s}units" % WEATHER_NS:
-            #     ["attrib", "units"],
-            "channel/{%s}wind" % WEATHER_NS:
-                ["attrib", "wind"],
-            "channel/{%s}atmosphere" % WEATHER_NS:
-                ["attrib", "atmosphere"],
-            "channel/{%s}astronomy" % WEATHER_NS:
-                ["attrib", "astronomy"],
-            "channel/item/{%s}condition" % WEATHER_NS:
-                ["attrib", "condition"],
-        }
-        weather = {}
-        weather["units"] = UNITS[units]
 
-        for (tag, meta) in xml_items.items():
-            if meta[0] == "text":
-                try:
-                    weather[meta[1]] = rss.find(tag).text
-                except AttributeError:
-                    weather[meta[1]] = None
-            elif meta[0] == "attrib":
-                try:
-                    weather[meta[1]] = rss.find(tag).attrib
-                except AttributeError:
-                    weather[meta[1]] = None
-            else:
-                weather[meta[1]] = None
+def _csv_value(value):
+    """Format a column value for CSV, writing NaN as an empty field."""
+    if value != value:
+        return ""
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
 
-        try:
-            image_url = CONDITION_IMAGE_URL.format(weather["condition"]["code"])
-            weather["condition"]["image"] = image_url
-        except (AttributeError, TypeError):
-            pass
 
-        try:
-            state = weather["atmosphere"]["rising"]
-            if state == "0":
-                weather["atmosphere"]["state"] = "steady"
-            elif state == "1":
-                weather["atmosphere"]["state"] = "rising"
-            elif state == "2":
-                weather["atmosphere"]["state"] = "falling"
-            else:
-                weather["atmosphere"]["state"] = None
-        except (AttributeError, TypeError):
-            pass
+BulkResult = collections.namedtuple("BulkResult", "id weather error")
+BulkResult.__doc__ = """A location's result from Client.fetch_weather_many.
 
-        weather["forecast"] = []
-        try:
-            for item in rss.findall(
-                    "channel/item/{%s}forecast" % WEATHER_NS):
-                weather["forecast"].append(item.attrib)
-        except AttributeError:
-            weather["forecast"] = None
+Attributes:
+    id: the location's WOEID or LID.
+    weather: the location's weather data as returned by Client.fetch_weather
+        or None if an error occurred.
+    error: the exception raised while fetching the weather data or None.
 
-        weather["geo"] = {}
-        try:
-            weather["geo"]["lat"] = rss.find(
-                "channel/item/{%s}lat" % GEO_NS).text
-            weather["geo"]["long"] = rss.find(
-                "channel/item/{%s}long" % GEO_NS).text
-        except AttributeError:
-            weather["geo"] = None
+"""
 
-        try:
-            weather["wind"]["compass"] = self._degrees_to_direction(
-                weather["wind"]["direction"])
-        except TypeError:
-            pass
 
-        return weather
+Timing = collections.namedtuple(
+    "Timing", "url cache_hit not_modified connect first_byte body parse "
+              "extract bytes")
+Timing.__doc__ = """The time each phase of one Client.fetch_weather call took.
 
-    def fetch_woeid(self, location):
-        """Fetch a location's corresponding WOEID.
+Times are in seconds. A phase that didn't happen, or that the transport
+doesn't report, is None.
+
+Attributes:
+    url: the weather feed's URL.
+    cache_hit: whether the weather data came from the client's cache.
+    not_modified: whether the server answered 304 Not Modified.
+    connect: time spent connecting to the server. Only PooledTransport
+        reports it; it is 0.0 if a pooled connection was reused.
+    first_byte: time from the request until the response's headers
+        arrived, including connecting and any wait for the throttle.
+    body: time spent reading the response's body.
+    parse: time spent parsing the feed, excluding reading it.
+    extract: time spent converting the parsed items into weather data.
+    bytes: the size of the response's body.
+
+"""
+
+
+class TTLCache(object):
+
+    """An in-memory LRU cache whose entries expire after a time to live.
+
+    The cache holds at most *maxsize* entries. When it is full, the least
+    recently used entry is evicted to make room for a new one. It is safe to
+    share a cache between threads.
+
+    Any object that provides the same get() and set() methods can be passed
+    to Client in place of a TTLCache.
+
+    Attributes:
+        stats: a dict that counts cache hits, misses, and evictions.
+
+    Methods:
+        get: return a cached value.
+        set: cache a value.
+        clear: remove all cached values.
+
+    """
+
+    def __init__(self, maxsize=1024, clock=time.time):
+        """Create a cache.
 
         Args:
-            location: (string) a location (e.g. 23454 or Berlin, Germany).
+            maxsize: (int) the maximum number of entries; defaults to 1024.
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time.
 
-        Returns:
-            a string containing the location's corresponding WOEID or None if
-                the WOEID could not be found.
+        Raises:
+            ValueError: *maxsize* is less than 1.
+
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._clock = clock
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the value cached for *key* or None if it is missing or
+        has expired."""
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.stats["misses"] += 1
+                return None
+            if expires <= self._clock():
+                del self._data[key]
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl):
+        """Cache *value* under *key* for *ttl* seconds."""
+        with self._lock:
+            self._data.pop(key, None)
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._data[key] = (self._clock() + ttl, value)
+
+    def clear(self):
+        """Remove all cached values."""
+        with self._lock:
+            self._data.clear()
+
+
+# A shared cache file starts with a _SHARED_HEADER (_SHARED_MAGIC, the
+# number of slots and the slot size), padded to _SHARED_HEADER_SIZE bytes,
+# followed by the slots. Each slot starts with a _SHARED_SLOT header (the
+# sequence number, the key's hash, the checksum of the key and payload, the
+# expiry time, the key's length and the payload's length), followed by the
+# marshalled key and the payload: b"v" and a marshalled value, or b"w" and a
+# marshalled Weather record's units and dict.
+
+_SHARED_MAGIC = b"YWSHM\x01\r\n"
+_SHARED_HEADER = struct.Struct(">8sII")
+_SHARED_HEADER_SIZE = 64
+_SHARED_SLOT = struct.Struct(">IIIdHI")
+_SHARED_SEQUENCE = struct.Struct(">I")
+
+
+class SharedCache(object):
+
+    """A cache shared between processes through a memory-mapped file.
+
+    The file holds a fixed table of *slots* slots of *slot_size* bytes
+    each, so every process that opens the same file (e.g. one in /dev/shm)
+    shares its entries, and one fetch serves them all. Keys and values are
+    encoded with marshal, so they must be built from basic types such as
+    strings, tuples, lists and dicts; Weather records are stored as dicts.
+    A value that doesn't fit in a slot isn't cached.
+
+    Each key can live in one of two slots. When both hold other live
+    entries, the one that expires first is evicted. Reads lock no slots:
+    each slot has a sequence number that writers make odd while they write
+    it, and a checksum, so a reader retries or misses instead of seeing a
+    torn entry. Writers lock one of a fixed number of stripes of slots,
+    with a thread lock and, where fcntl is available, a lock on the file.
+
+    Like TTLCache, it can be passed to Client as its cache. Its
+    resolution_store() method returns an object that can be passed as a
+    Client's resolution_store, so that WOEID and LID lookups are shared
+    too.
+
+    Attributes:
+        path: the file's path.
+        slots: the number of slots.
+        slot_size: the size of each slot in bytes.
+        stats: a dict that counts this process's hits, misses, evictions
+            and values too large for a slot ("oversize").
+
+    Methods:
+        get: return a cached value.
+        set: cache a value.
+        clear: remove all cached values.
+        resolution_store: return a resolution store backed by the cache.
+        close: unmap the file.
+
+    """
+
+    _stripes = 64
+
+    def __init__(self, path, slots=4096, slot_size=8192, clock=time.time):
+        """Open or create a shared cache file.
+
+        If the file already exists, its own slot table is used and *slots*
+        and *slot_size* are ignored.
+
+        Args:
+            path: (string) the file's path.
+            slots: (int) the number of slots; defaults to 4096.
+            slot_size: (int) the size of each slot in bytes; defaults to
+                8192.
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time. Processes sharing a file must use the same
+                clock.
 
         Raises:
-            urllib.error.URLError: urllib.request could not open the URL
-                (Python 3).
-            urllib2.URLError: urllib2 could not open the URL (Python 2).
-            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
-                parse the XML document.
+            ValueError: the file isn't a shared cache file, or it is
+                created and *slot_size* is too small.
 
         """
-        rss = self._fetch_xml(
-            WOEID_LOOKUP_URL.format(quote(location)))
         try:
-            woeid = rss.find("results/Result/woeid").text
-        except AttributeError:
-            return None
-        return woeid
-
-    def _degrees_to_direction(self, degrees):
-        """Convert wind direction from degrees to compass direction."""
+            import fcntl
+        except ImportError:
+            fcntl = None
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "oversize": 0}
+        self._clock = clock
+        self._fcntl = fcntl
+        self._stats_lock = threading.Lock()
+        self._locks = [threading.Lock() for i in range(self._stripes)]
+        self._file = open(path, "a+b")
         try:
-            degrees = float(degrees)
-        except ValueError:
-            return None
-        if degrees < 0 or degrees > 360:
-            return None
-        if degrees <= 11.25 or degrees >= 348.76:
-            return "N"
-        elif degrees <= 33.75:
-            return "NNE"
-        elif degrees <= 56.25:
-            return "NE"
-        elif degrees <= 78.75:
-            return "ENE"
-        elif degrees <= 101.25:
-            return "E"
-        elif degrees <= 123.75:
-            return "ESE"
-        elif degrees <= 146.25:
-            return "SE"
-        elif degrees <= 168.75:
-            return "SSE"
-        elif degrees <= 191.25:
-            return "S"
-        elif degrees <= 213.75:
-            return "SSW"
-        elif degrees <= 236.25:
-            return "SW"
-        elif degrees <= 258.75:
-            return "WSW"
-        elif degrees <= 281.25:
-            return "W"
-        elif degrees <= 303.75:
-            return "WNW"
-        elif degrees <= 326.25:
-            return "NW"
-        elif degrees <= 348.75:
-            return "NNW"
+            self._lock_file(0, _SHARED_HEADER_SIZE)
+            try:
+                self._file.seek(0, os.SEEK_END)
+                if self._file.tell() == 0:
+                    if slot_size <= _SHARED_SLOT.size:
+                        raise ValueError(
+                            "slot_size must be more than %d bytes"
+                            % _SHARED_SLOT.size)
+                    self._file.write(_SHARED_HEADER.pack(
+                        _SHARED_MAGIC, slots, slot_size))
+                    self._file.truncate(_SHARED_HEADER_SIZE +
+                                        slots * slot_size)
+                    self._file.flush()
+            finally:
+                self._unlock_file(0, _SHARED_HEADER_SIZE)
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+        except Exception:
+            self._file.close()
+            raise
+        (magic, self.slots,
+         self.slot_size) = _SHARED_HEADER.unpack_from(self._mmap, 0)
+        if (magic != _SHARED_MAGIC or len(self._mmap) !=
+                _SHARED_HEADER_SIZE + self.slots * self.slot_size):
+            self.close()
+            raise ValueError("%s is not a shared cache file" % path)
+
+    def get(self, key):
+        """Return the value cached for *key* or None if it is missing or
+        has expired."""
+        return self._get(key, None)
+
+    def set(self, key, value, ttl):
+        """Cache *value* under *key* for *ttl* seconds."""
+        key_bytes = marshal.dumps(key)
+        if isinstance(value, Weather):
+            payload = b"w" + marshal.dumps((value.units, value.to_dict()))
         else:
-            return None
+            payload = b"v" + marshal.dumps(value)
+        if (_SHARED_SLOT.size + len(key_bytes) + len(payload) >
+                self.slot_size):
+            with self._stats_lock:
+                self.stats["oversize"] += 1
+            return
+        key_hash = zlib.crc32(key_bytes)
+        now = self._clock()
+        candidates = self._slots(key_bytes, key_hash)
+        offset = None
+        for candidate in candidates:
+            entry = self._read(candidate)
+            if entry is not None and entry[0] == key_bytes:
+                offset = candidate
+                break
+        if offset is None:
+            entries = [(candidate, self._read(candidate))
+                       for candidate in candidates]
+            for (candidate, entry) in entries:
+                if entry is None or entry[1] <= now:
+                    offset = candidate
+                    break
+            else:
+                offset = min(entries, key=lambda item: item[1][1])[0]
+                with self._stats_lock:
+                    self.stats["evictions"] += 1
+        self._write(offset, key_hash, now + ttl, key_bytes, payload)
+
+    def clear(self):
+        """Remove all cached values."""
+        for slot in range(self.slots):
+            self._write(_SHARED_HEADER_SIZE + slot * self.slot_size, 0, 0.0,
+                        b"", b"")
+
+    def resolution_store(self, ttl=30 * 24 * 60 * 60, negative_ttl=86400):
+        """Return an object that can be passed as a Client's
+        resolution_store to share WOEID and LID lookups through the cache.
+
+        Args:
+            ttl: (float) seconds a lookup is kept; defaults to 30 days.
+            negative_ttl: (float) seconds a lookup that found nothing is
+                kept; defaults to one day.
+
+        """
+        return _SharedResolutions(self, ttl, negative_ttl)
+
+    def close(self):
+        """Unmap and close the file."""
+        self._mmap.close()
+        self._file.close()
+
+    def _get(self, key, default):
+        """Return the value cached for *key* or *default*."""
+        key_bytes = marshal.dumps(key)
+        key_hash = zlib.crc32(key_bytes)
+        for offset in self._slots(key_bytes, key_hash):
+            entry = self._read(offset, key_hash)
+            if entry is None or entry[0] != key_bytes:
+                continue
+            if entry[1] <= self._clock():
+                break
+            with self._stats_lock:
+                self.stats["hits"] += 1
+            payload = entry[2]
+            if payload[:1] == b"w":
+                (units, data) = marshal.loads(payload[1:])
+                return Weather.from_dict(data, units)
+            return marshal.loads(payload[1:])
+        with self._stats_lock:
+            self.stats["misses"] += 1
+        return default
+
+    def _slots(self, key_bytes, key_hash):
+        """Return the offsets of the two slots a key can live in."""
+        first = key_hash % self.slots
+        second = zlib.adler32(key_bytes) % self.slots
+        if second == first:
+            second = (first + 1) % self.slots
+        return (_SHARED_HEADER_SIZE + first * self.slot_size,
+                _SHARED_HEADER_SIZE + second * self.slot_size)
+
+    def _read(self, offset, key_hash=None):
+        """Return the (key bytes, expiry time, payload) of the slot at
+        *offset*, or None if it is empty, holds another hash than
+        *key_hash*, or is being written."""
+        mm = self._mmap
+        for attempt in range(8):
+            (sequence, slot_hash, checksum, expires, key_length,
+             length) = _SHARED_SLOT.unpack_from(mm, offset)
+            if sequence & 1:
+                continue
+            if key_length == 0 or (key_hash is not None and
+                                   slot_hash != key_hash):
+                return None
+            start = offset + _SHARED_SLOT.size
+            data = mm[start:start + key_length + length]
+            if _SHARED_SEQUENCE.unpack_from(mm, offset)[0] != sequence:
+                continue
+            if zlib.crc32(data) != checksum:
+                return None
+            return (data[:key_length], expires, data[key_length:])
+        return None
+
+    def _write(self, offset, key_hash, expires, key_bytes, payload):
+        """Write an entry to the slot at *offset*."""
+        slot = (offset - _SHARED_HEADER_SIZE) // self.slot_size
+        stripe = slot % self._stripes
+        data = key_bytes + payload
+        mm = self._mmap
+        with self._locks[stripe]:
+            self._lock_file(stripe, 1)
+            try:
+                sequence = _SHARED_SEQUENCE.unpack_from(mm, offset)[0]
+                _SHARED_SEQUENCE.pack_into(mm, offset,
+                                           (sequence + 1) & 0xFFFFFFFF)
+                start = offset + _SHARED_SLOT.size
+                mm[start:start + len(data)] = data
+                _SHARED_SLOT.pack_into(
+                    mm, offset, (sequence + 1) & 0xFFFFFFFF, key_hash,
+                    zlib.crc32(data), expires, len(key_bytes), len(payload))
+                _SHARED_SEQUENCE.pack_into(mm, offset,
+                                           (sequence + 2) & 0xFFFFFFFF)
+            finally:
+                self._unlock_file(stripe, 1)
+
+    def _lock_file(self, start, length):
+        """Lock a byte range of the file against other processes."""
+        if self._fcntl is not None:
+            self._fcntl.lockf(self._file.fileno(), self._fcntl.LOCK_EX,
+                              length, start)
+
+    def _unlock_file(self, start, length):
+        """Unlock a byte range locked by _lock_file."""
+        if self._fcntl is not None:
+            self._fcntl.lockf(self._file.fileno(), self._fcntl.LOCK_UN,
+                              length, start)
+
+
+class _SharedResolutions(object):
+
+    """The resolution store interface of a SharedCache."""
+
+    def __init__(self, cache, ttl, negative_ttl):
+        self._cache = cache
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+
+    def get(self, kind, key, default=None):
+        return self._cache._get(("resolution", kind, key), default)
+
+    def set(self, kind, key, value):
+        ttl = self._negative_ttl if value is None else self._ttl
+        self._cache.set(("resolution", kind, key), value, ttl)
+
+
+class ResolutionStore(object):
+
+    """A persistent, on-disk store of WOEID and LID lookups.
+
+    The store maps locations to WOEIDs ("woeid") and WOEIDs to LIDs
+    ("lid"). Lookups that found nothing are stored as None and expire after
+    *negative_ttl* seconds, so that they are retried eventually.
+
+    The store is an SQLite database, so it can be shared between threads
+    and between processes on the same host. Threads borrow connections from
+    a pool that keeps at most *pool_size* idle ones open.
+
+    Attributes:
+        path: the path of the database file.
+        ttl: seconds a found WOEID or LID is kept or None to keep it forever.
+        negative_ttl: seconds a lookup that found nothing is kept.
+        stats: a dict that counts store hits and misses.
+
+    Methods:
+        get: return a stored lookup.
+        set: store a lookup.
+        preload: store many lookups at once.
+        export: return all of the stored lookups of a kind.
+        close: close the database connections.
+
+    """
+
+    kinds = ("woeid", "lid")
+
+    def __init__(self, path, ttl=None, negative_ttl=24 * 60 * 60,
+                 clock=time.time, pool_size=4):
+        """Open or create a store.
+
+        Args:
+            path: (string) the path of the database file.
+            ttl: (float) seconds a found WOEID or LID is kept; defaults to
+                None (forever).
+            negative_ttl: (float) seconds a lookup that found nothing is
+                kept; defaults to one day.
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time.
+            pool_size: (int) the maximum number of idle database
+                connections kept open; defaults to 4.
+
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.pool_size = pool_size
+        self.stats = {"hits": 0, "misses": 0}
+        self._clock = clock
+
+        # _connections holds every open connection, whether idle or lent
+        # to a thread, so that close() can close them all. _idle holds the
+        # ones that can be lent.
+
+        self._connections = []
+        self._idle = []
+        self._lock = threading.Lock()
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS resolutions ("
+                       "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+                       "expires REAL, PRIMARY KEY (kind, key))")
+
+    def get(self, kind, key, default=None):
+        """Return the stored lookup of *key* or *default* if there is none.
+
+        Args:
+            kind: (string) "woeid" or "lid".
+            key: (string) the location or WOEID that was looked up.
+            default: the value returned if *key* isn't stored.
+
+        Returns:
+            the stored WOEID or LID, None if the lookup found nothing, or
+            *default*.
+
+        """
+        with self._db() as db:
+            row = db.execute(
+                "SELECT value, expires FROM resolutions "
+                "WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= self._clock()):
+            with self._lock:
+                self.stats["misses"] += 1
+            return default
+        with self._lock:
+            self.stats["hits"] += 1
+        return row[0]
+
+    def set(self, kind, key, value):
+        """Store that looking up *key* returned *value*."""
+        self.preload(kind, {key: value})
+
+    def preload(self, kind, lookups):
+        """Store many lookups of *kind* at once.
+
+        Args:
+            kind: (string) "woeid" or "lid".
+            lookups: (dict) maps each location or WOEID to its WOEID or LID,
+                or to None if the lookup found nothing.
+
+        """
+        if kind not in self.kinds:
+            raise ValueError("unknown kind: %r" % (kind,))
+        now = self._clock()
+        rows = []
+        for (key, value) in lookups.items():
+            ttl = self.ttl if value is not None else self.negative_ttl
+            expires = None if ttl is None else now + ttl
+            rows.append((kind, key, value, expires))
+        with self._db() as db, db:
+            db.executemany("INSERT OR REPLACE INTO resolutions "
+                           "(kind, key, value, expires) VALUES (?, ?, ?, ?)",
+                           rows)
+
+    def export(self, kind):
+        """Return a dict of the unexpired lookups of *kind*."""
+        with self._db() as db:
+            return dict(db.execute(
+                "SELECT key, value FROM resolutions WHERE kind = ? AND "
+                "(expires IS NULL OR expires > ?)", (kind, self._clock())))
+
+    def close(self):
+        """Close the database connections."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._idle = []
+        for db in connections:
+            db.close()
+
+    @contextlib.contextmanager
+    def _db(self):
+        """Lend a database connection from the pool to the calling thread,
+        opening one if none is idle."""
+        with self._lock:
+            db = self._idle.pop() if self._idle else None
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30,
+                                 check_same_thread=False)
+            with self._lock:
+                self._connections.append(db)
+        try:
+            yield db
+        finally:
+            with self._lock:
+                pooled = db in self._connections
+                if pooled and len(self._idle) < self.pool_size:
+                    self._idle.append(db)
+                    db = None
+                elif pooled:
+                    self._connections.remove(db)
+            if db is not None:
+                db.close()
+
+
+class TimingHistogram(object):
+
+    """Aggregate the Timings of a client's fetches into histograms.
+
+    Pass a TimingHistogram as a Client's metrics to collect its timings.
+    Each phase has its own histogram with the same bucket bounds. It is safe
+    to share between threads.
+
+    Attributes:
+        bounds: the upper bounds of the buckets in seconds. A last bucket
+            holds the times beyond the highest bound.
+        stats: a dict that counts fetches ("fetches"), cache hits
+            ("cache_hits"), responses that were 304 Not Modified
+            ("not_modified") and response body bytes ("bytes").
+
+    Methods:
+        observe: add a Timing to the histograms.
+        snapshot: return the histograms' current counts.
+
+    """
+
+    phases = ("connect", "first_byte", "body", "parse", "extract")
+    default_bounds = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                      0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, bounds=default_bounds):
+        """Create empty histograms.
+
+        Args:
+            bounds: (sequence) the ascending upper bounds of the buckets in
+                seconds; defaults to TimingHistogram.default_bounds.
+
+        """
+        self.bounds = tuple(bounds)
+        self.stats = {"fetches": 0, "cache_hits": 0, "not_modified": 0,
+                      "bytes": 0}
+        self._lock = threading.Lock()
+
+        # _counts maps each phase to [count, sum, bucket counts].
+
+        self._counts = dict((phase, [0, 0.0, [0] * (len(self.bounds) + 1)])
+                            for phase in self.phases)
+
+    def observe(self, timing):
+        """Add the phases of *timing* to the histograms."""
+        with self._lock:
+            self.stats["fetches"] += 1
+            if timing.cache_hit:
+                self.stats["cache_hits"] += 1
+            if timing.not_modified:
+                self.stats["not_modified"] += 1
+            if timing.bytes is not None:
+                self.stats["bytes"] += timing.bytes
+            for phase in self.phases:
+                seconds = getattr(timing, phase)
+                if seconds is None:
+                    continue
+                counts = self._counts[phase]
+                counts[0] += 1
+                counts[1] += seconds
+                counts[2][bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def snapshot(self):
+        """Return the histograms' current counts.
+
+        Returns:
+            a dict that maps each phase to a dict with its number of times
+                ("count"), their total ("sum") and the cumulative number of
+                times at or below each bound ("buckets"), as a list of
+                (bound, count) pairs that ends with (float("inf"), count).
+                The dict's "stats" item is a copy of stats.
+
+        """
+        with self._lock:
+            snapshot = {"stats": dict(self.stats)}
+            for phase, (count, total, buckets) in self._counts.items():
+                cumulative = []
+                running = 0
+                for bound, n in zip(self.bounds + (float("inf"),), buckets):
+                    running += n
+                    cumulative.append((bound, running))
+                snapshot[phase] = {"count": count, "sum": total,
+                                   "buckets": cumulative}
+        return snapshot
+
+
+class _TimedResponse(object):
+
+    """Count the bytes read from a response and the time spent reading."""
+
+    def __init__(self, response):
+        self._response = response
+        self.read_time = 0.0
+        self.bytes = 0
+
+    @property
+    def status(self):
+        return self._response.status
+
+    @property
+    def headers(self):
+        return self._response.headers
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        if size is None or size < 0:
+            data = self._response.read()
+        else:
+            data = self._response.read(size)
+        self.read_time += time.perf_counter() - started
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        self._response.close()
+
+
+class HostLimit(object):
+
+    """A request rate limit and adaptive concurrency limit for one host.
+
+    The rate is limited by a token bucket that holds up to *burst* tokens
+    and gains *rate* tokens per second. Each request takes a token, waiting
+    for one if the bucket is empty.
+
+    The number of concurrent requests is limited by an additive-increase,
+    multiplicative-decrease (AIMD) controller. Each request that succeeds
+    within *latency_target* seconds raises the limit by 1/limit, so the limit
+    grows by about one per round of requests. A request that fails or takes
+    longer multiplies the limit by *backoff*, at most once per round. Requests
+    beyond the limit wait for a slot.
+
+    A limit is safe to share between threads. Share one HostLimit between
+    the URL templates of the same host to limit them together.
+
+    Attributes:
+        concurrency: the current concurrency limit.
+        stats: a dict that counts requests, requests that waited for a
+            token ("throttled"), and requests that failed or were slow
+            ("congested").
+
+    Methods:
+        acquire: wait until a request may be sent.
+        release: report that a request finished.
+
+    """
+
+    def __init__(self, rate=None, burst=1, concurrency=8, min_concurrency=1,
+                 max_concurrency=64, latency_target=2.0, backoff=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        """Create a limit.
+
+        Args:
+            rate: (float) requests per second; defaults to None (no rate
+                limit).
+            burst: (int) requests that may be sent at once after a pause;
+                defaults to 1.
+            concurrency: (int) the initial concurrency limit; defaults to 8.
+            min_concurrency: (int) the lowest concurrency limit; defaults to
+                1.
+            max_concurrency: (int) the highest concurrency limit; defaults to
+                64.
+            latency_target: (float) seconds a request may take before it
+                counts as congested; defaults to 2.
+            backoff: (float) the factor by which congestion multiplies the
+                concurrency limit; defaults to 0.5.
+            clock: (callable) returns the current time in seconds; defaults
+                to time.monotonic.
+            sleep: (callable) sleeps for a number of seconds; defaults to
+                time.sleep.
+
+        """
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.stats = {"requests": 0, "throttled": 0, "congested": 0}
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._decreased = None
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request may be sent.
+
+        Returns:
+            the time the request was allowed, to be passed to release().
+
+        """
+        wait = 0
+        with self._condition:
+            self.stats["requests"] += 1
+            if self.rate is not None:
+
+                # Tokens are reserved even if the bucket is empty, so each
+                # waiting request sleeps until its own token has been added.
+
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = -self._tokens / self.rate
+                    self.stats["throttled"] += 1
+        if wait:
+            self._sleep(wait)
+        with self._condition:
+            while self._in_flight >= int(self.concurrency):
+                self._condition.wait()
+            self._in_flight += 1
+            return self._clock()
+
+    def release(self, started, error=False):
+        """Report that a request finished.
+
+        Args:
+            started: the time returned by acquire().
+            error: (bool) whether the request failed; defaults to False.
+
+        """
+        now = self._clock()
+        with self._condition:
+            self._in_flight -= 1
+            if error or now - started > self.latency_target:
+                self.stats["congested"] += 1
+
+                # Requests that started before the last decrease were sent
+                # under the old limit, so they don't decrease it again.
+
+                if self._decreased is None or started >= self._decreased:
+                    self.concurrency = max(self.min_concurrency,
+                                           self.concurrency * self.backoff)
+                    self._decreased = now
+            else:
+                self.concurrency = min(self.max_concurrency,
+                                       self.concurrency +
+                                       1 / self.concurrency)
+            self._condition.notify_all()
+
+
+class Throttle(object):
+
+    """Apply HostLimits to a client's requests.
+
+    Limits are configured per URL template, such as WEATHER_URL,
+    LID_WEATHER_URL or WOEID_LOOKUP_URL. A URL is limited by the limit of
+    the template whose fixed part (before its first placeholder) it starts
+    with. The limit of WOEID_LOOKUP_URL also applies to
+    WOEID_BATCH_LOOKUP_URL, which Client.fetch_woeids uses, unless that
+    template has a limit of its own.
+
+    Methods:
+        limit_for: return the limit for a URL.
+
+    """
+
+    def __init__(self, limits):
+        """Create a throttle.
+
+        Args:
+            limits: (dict) maps URL templates to HostLimits, e.g.
+                {WEATHER_URL: HostLimit(rate=10)}. Templates may share a
+                HostLimit.
+
+        """
+        self.limits = dict(limits)
+        if WOEID_LOOKUP_URL in self.limits:
+            self.limits.setdefault(WOEID_BATCH_LOOKUP_URL,
+                                   self.limits[WOEID_LOOKUP_URL])
+
+        # _prefixes holds (fixed part of the template, limit), longest
+        # first, so that the most specific template matches.
+
+        self._prefixes = sorted(
+            ((template.split("{", 1)[0], limit)
+             for (template, limit) in self.limits.items()),
+            key=lambda item: -len(item[0]))
+
+    def limit_for(self, url):
+        """Return the HostLimit for *url* or None if it isn't limited."""
+        for (prefix, limit) in self._prefixes:
+            if url.startswith(prefix):
+                return limit
+        return None
+
+
+class _ThrottledResponse(object):
+
+    """A response that releases its HostLimit when it is closed."""
+
+    def __init__(self, response, limit, started):
+        self._response = response
+        self._limit = limit
+        self._started = started
+        self.status = response.status
+        self.headers = getattr(response, "headers", None)
+        self.connect_time = getattr(response, "connect_time", None)
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=-1):
+        try:
+            if size is None or size < 0:
+                return self._response.read()
+            return self._response.read(size)
+        except Exception:
+            self._release(error=True)
+            raise
+
+    def close(self):
+        self._response.close()
+        self._release()
+
+    def _release(self, error=False):
+        started, self._started = self._started, None
+        if started is not None:
+            self._limit.release(started, error)
+
+
+class UrllibTransport(object):
+
+    """Open URLs with urllib, using a new connection for each request.
+
+    A transport's open() method returns a file-like response object that
+    has read() and close() methods, a status attribute, and a getheader()
+    method. This is the interface that Client expects of its transport.
+
+    Methods:
+        open: open a URL.
+
+    """
+
+    def __init__(self, timeout=None):
+        """Create a transport.
+
+        Args:
+            timeout: (float) the socket timeout in seconds; defaults to None
+                (the global default timeout).
+
+        """
+        self.timeout = timeout
+
+    def open(self, url, headers=None):
+        """Open *url*, sending the extra request *headers*."""
+        request = urllib.request.Request(url, headers=headers or {})
+        try:
+            if self.timeout is None:
+                return urllib.request.urlopen(request)
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+
+            # urllib treats 304 Not Modified as an error, but it's the
+            # expected answer to a conditional request.
+
+            if e.code != 304:
+                raise
+            e.close()
+            return _BufferedResponse(e.code, e.reason, e.headers, b"")
+
+
+class _BufferedResponse(object):
+
+    """A response whose body has already been read completely."""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self._stream = io.BytesIO(body)
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def close(self):
+        pass
+
+
+class PooledTransport(object):
+
+    """Open URLs over persistent HTTP connections that are pooled per host.
+
+    Once a response has been read completely, its connection returns to its
+    host's pool and is reused by the next request to that host. A response
+    that is closed before it has been read completely closes its connection
+    instead. It is safe to share a transport between threads.
+
+    Attributes:
+        stats: a dict that counts requests, connections created, connections
+            reused, and connections discarded.
+
+    Methods:
+        open: open a URL.
+        close: close all idle connections.
+
+    """
+
+    max_redirects = 5
+
+    def __init__(self, pool_size=4, idle_timeout=30, timeout=None,
+                 clock=time.time):
+        """Create a transport.
+
+        Args:
+            pool_size: (int) the maximum number of idle connections kept per
+                host; defaults to 4.
+            idle_timeout: (float) seconds an idle connection is kept before
+                it is closed; defaults to 30.
+            timeout: (float) the socket timeout in seconds; defaults to None
+                (the global default timeout).
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time.
+
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = {"requests": 0, "connections": 0, "reused": 0,
+                      "discarded": 0}
+        self._clock = clock
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def open(self, url, headers=None):
+        """Open *url*, sending the extra request *headers*.
+
+        Raises:
+            urllib.error.HTTPError: the server returned an error status.
+            http.client.HTTPException: the server's response was invalid.
+            OSError: the connection failed.
+
+        """
+        for i in range(self.max_redirects + 1):
+            response = self._request(url, headers)
+            if (response.status in (301, 302, 303, 307, 308) and
+                    response.getheader("Location")):
+                response.read()
+                response.close()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status >= 400:
+                response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status,
+                                             response.reason,
+                                             response.headers, None)
+            return response
+        raise urllib.error.HTTPError(url, response.status,
+                                     "too many redirects", response.headers,
+                                     None)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for connection, idle_since in pool:
+                connection.close()
+
+    def _request(self, url, headers):
+        """Send a GET request for *url* and return the response."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        with self._lock:
+            self.stats["requests"] += 1
+        connection = self._acquire(key)
+        reused = connection is not None
+        connect_time = 0.0
+        if not reused:
+            started = time.perf_counter()
+            connection = self._connect(key)
+            connect_time = time.perf_counter() - started
+        while True:
+            try:
+                connection.request("GET", path, headers=headers or {})
+                response = connection.getresponse()
+            except (httplib.HTTPException, OSError):
+                connection.close()
+                with self._lock:
+                    self.stats["discarded"] += 1
+                if not reused:
+                    raise
+
+                # The server may close an idle keep-alive connection at any
+                # time, so a request on a reused connection is retried once
+                # on a new one.
+
+                started = time.perf_counter()
+                connection = self._connect(key)
+                connect_time = time.perf_counter() - started
+                reused = False
+            else:
+                return _PooledResponse(self, key, connection, response,
+                                       connect_time)
+
+    def _connect(self, key):
+        """Create a new connection to the host identified by *key* and
+        connect it."""
+        scheme, netloc = key
+        if scheme == "https":
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        with self._lock:
+            self.stats["connections"] += 1
+        if self.timeout is None:
+            connection = connection_class(netloc)
+        else:
+            connection = connection_class(netloc, timeout=self.timeout)
+        try:
+            connection.connect()
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def _acquire(self, key):
+        """Return an idle connection for *key* or None if there isn't one."""
+        expired = []
+        connection = None
+        now = self._clock()
+        with self._lock:
+            pool = self._pools.get(key)
+            while pool:
+                candidate, idle_since = pool.pop()
+                if now - idle_since > self.idle_timeout:
+                    expired.append(candidate)
+                    self.stats["discarded"] += 1
+                else:
+                    connection = candidate
+                    self.stats["reused"] += 1
+                    break
+        for candidate in expired:
+            candidate.close()
+        return connection
+
+    def _release(self, key, connection):
+        """Return *connection* to its pool."""
+        with self._lock:
+            pool = self._pools.setdefault(key, collections.deque())
+            if len(pool) < self.pool_size:
+                pool.append((connection, self._clock()))
+                return
+            self.stats["discarded"] += 1
+        connection.close()
+
+    def _discard(self, connection):
+        """Close *connection* instead of returning it to its pool."""
+        with self._lock:
+            self.stats["discarded"] += 1
+        connection.close()
+
+
+class _PooledResponse(object):
+
+    """A response whose connection is returned to a PooledTransport.
+
+    Its connect_time attribute holds the seconds spent connecting to the
+    host for this request, which is 0.0 if a pooled connection was reused.
+
+    """
+
+    def __init__(self, transport, key, connection, response,
+                 connect_time=0.0):
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.connect_time = connect_time
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._response.read()
+        else:
+            data = self._response.read(size)
+        if self._response.isclosed():
+            self._finish()
+        return data
+
+    def close(self):
+        self._finish()
+
+    def _finish(self):
+        """Release or discard the connection once the response is done."""
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        if not self._response.isclosed() and self._response.length == 0:
+
+            # A response without a body, such as 304 Not Modified, is only
+            # marked done once it has been read.
+
+            self._response.read()
+        if self._response.isclosed() and not self._response.will_close:
+            self._transport._release(self._key, connection)
+        else:
+            self._response.close()
+            self._transport._discard(connection)
+
+
+# A segment file starts with _SEGMENT_MAGIC and holds one record per
+# response. Each record is a _SEGMENT_RECORD header (the time it was
+# recorded, the HTTP status, the URL's length and the compressed body's
+# length) followed by the URL in UTF-8 and the body compressed with zlib.
+
+_SEGMENT_MAGIC = b"YWSEG\x01\r\n"
+_SEGMENT_RECORD = struct.Struct(">dHHI")
+
+
+class RecordingTransport(object):
+
+    """Record the responses of another transport in a segment file.
+
+    Each response is read completely and appended to the segment with its
+    URL, status and the time it was received, then returned from a buffer.
+    Error responses are recorded before their HTTPError is raised again.
+    304 Not Modified responses have no body to replay and are not recorded.
+    The segment is only ever appended to, so a segment can be recorded over
+    many runs and read by a ReplayTransport while it grows.
+
+    Attributes:
+        transport: the transport whose responses are recorded.
+        path: the segment file's path.
+        stats: a dict that counts the responses recorded ("records") and
+            the bytes of their bodies before ("bytes") and after
+            ("compressed") compression.
+
+    Methods:
+        open: open a URL with the transport and record the response.
+        close: close the segment file.
+
+    """
+
+    def __init__(self, path, transport=None, compresslevel=6,
+                 clock=time.time):
+        """Open or create a segment for appending.
+
+        Args:
+            path: (string) the segment file's path.
+            transport: (PooledTransport) the transport whose responses are
+                recorded; defaults to a new UrllibTransport.
+            compresslevel: (int) the zlib compression level, from 0 to 9;
+                defaults to 6.
+            clock: (function) returns the current time; defaults to
+                time.time.
+
+        """
+        if transport is None:
+            transport = UrllibTransport()
+        self.transport = transport
+        self.path = path
+        self.stats = {"records": 0, "bytes": 0, "compressed": 0}
+        self._compresslevel = compresslevel
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_SEGMENT_MAGIC)
+            self._file.flush()
+
+    def open(self, url, headers=None):
+        """Open *url* with the transport, sending the extra request
+        *headers*, and record the response.
+
+        Raises:
+            urllib.error.HTTPError: the server returned an error status.
+
+        """
+        try:
+            response = self.transport.open(url, headers)
+        except urllib.error.HTTPError as e:
+            body = e.fp.read() if e.fp is not None else b""
+            self._append(url, e.code, body)
+            raise
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        if response.status != 304:
+            self._append(url, response.status, body)
+        return _BufferedResponse(response.status,
+                                 getattr(response, "reason", ""),
+                                 getattr(response, "headers", {}), body)
+
+    def close(self):
+        """Close the segment file."""
+        with self._lock:
+            self._file.close()
+
+    def _append(self, url, status, body):
+        """Append a record of a response to the segment."""
+        url = url.encode("utf-8")
+        compressed = zlib.compress(body, self._compresslevel)
+        record = (_SEGMENT_RECORD.pack(self._clock(), status, len(url),
+                                       len(compressed)) + url + compressed)
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            self.stats["records"] += 1
+            self.stats["bytes"] += len(body)
+            self.stats["compressed"] += len(compressed)
+
+
+class ReplayTransport(object):
+
+    """Answer requests with the responses recorded in a segment file.
+
+    The segment is memory-mapped and indexed by URL when the transport is
+    created. A request for a URL is answered with the last response
+    recorded for it, decompressed straight from the mapping, so replaying
+    costs little more than parsing. Request headers are ignored, and a
+    truncated last record, as left by an interrupted recording, is skipped.
+
+    Attributes:
+        path: the segment file's path.
+        stats: a dict that counts requests and requests for URLs that
+            weren't recorded ("misses").
+
+    Methods:
+        open: return the recorded response for a URL.
+        urls: return the recorded URLs.
+        records: iterate over every recorded response.
+        close: unmap the segment.
+
+    """
+
+    def __init__(self, path):
+        """Map and index a segment.
+
+        Args:
+            path: (string) the segment file's path.
+
+        Raises:
+            ValueError: the file isn't a segment.
+
+        """
+        self.path = path
+        self.stats = {"requests": 0, "misses": 0}
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("%s is not a segment file" % path)
+        if self._mmap[:len(_SEGMENT_MAGIC)] != _SEGMENT_MAGIC:
+            self._mmap.close()
+            raise ValueError("%s is not a segment file" % path)
+
+        # _offsets holds the offset of each complete record, and _index maps
+        # each URL to the offset of its last record.
+
+        self._offsets = []
+        self._index = {}
+        self._lock = threading.Lock()
+        offset = len(_SEGMENT_MAGIC)
+        size = len(self._mmap)
+        while offset + _SEGMENT_RECORD.size <= size:
+            (timestamp, status, url_length,
+             length) = _SEGMENT_RECORD.unpack_from(self._mmap, offset)
+            start = offset + _SEGMENT_RECORD.size
+            end = start + url_length + length
+            if end > size:
+                break
+            url = self._mmap[start:start + url_length].decode("utf-8")
+            self._offsets.append(offset)
+            self._index[url] = offset
+            offset = end
+
+    def open(self, url, headers=None):
+        """Return the response recorded for *url*.
+
+        Raises:
+            urllib.error.HTTPError: the recorded response is an error.
+            urllib.error.URLError: no response was recorded for *url*.
+
+        """
+        offset = self._index.get(url)
+        with self._lock:
+            self.stats["requests"] += 1
+            if offset is None:
+                self.stats["misses"] += 1
+        if offset is None:
+            raise urllib.error.URLError("no response recorded for %s" % url)
+        (url, timestamp, status, body) = self._read(offset)
+        reason = httplib.responses.get(status, "")
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, reason, {},
+                                         io.BytesIO(body))
+        return _BufferedResponse(status, reason, {}, body)
+
+    def urls(self):
+        """Return a list of the recorded URLs."""
+        return list(self._index)
+
+    def records(self):
+        """Iterate over the recorded responses in the order they were
+        recorded, as (url, timestamp, status, body) tuples."""
+        for offset in self._offsets:
+            yield self._read(offset)
+
+    def close(self):
+        """Unmap the segment."""
+        self._mmap.close()
+
+    def _read(self, offset):
+        """Return the record at *offset* as a (url, timestamp, status,
+        body) tuple."""
+        (timestamp, status, url_length,
+         length) = _SEGMENT_RECORD.unpack_from(self._mmap, offset)
+        start = offset + _SEGMENT_RECORD.size
+        url = self._mmap[start:start + url_length].decode("utf-8")
+        start += url_length
+        with memoryview(self._mmap) as view:
+            body = zlib.decompress(view[start:start + length])
+        return (url, timestamp, status, body)
+
+
+class _SingleFlight(object):
+
+    """Share one call among the threads that make it concurrently.
+
+    While a call for a key is in progress, other calls for the same key wait
+    for it and return its result (or raise its exception) instead of calling
+    the function again. Each such call is counted in stats["coalesced"].
+
+    """
+
+    def __init__(self, stats):
+        self._stats = stats
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """Return function(*args), sharing the call with concurrent callers
+        of the same *key*."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = [threading.Event(), None, None]
+                leader = True
+            else:
+                self._stats["coalesced"] += 1
+                leader = False
+
+        # call is [done event, result, exception].
+
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = function(*args)
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1]
+
+
+class _AsyncSingleFlight(object):
+
+    """Share one coroutine call among the tasks that make it concurrently.
+
+    This is the asyncio counterpart of _SingleFlight. The call runs in a
+    task of its own that every caller awaits through asyncio.shield, so
+    cancelling one caller doesn't cancel the others. The task is only
+    cancelled once every caller waiting for it has been cancelled.
+
+    """
+
+    def __init__(self, stats):
+        self._stats = stats
+        self._calls = {}
+
+    async def do(self, key, function, *args):
+        """Return await function(*args), sharing the call with concurrent
+        callers of the same *key*."""
+        call = self._calls.get(key)
+        if call is None:
+
+            # call is [task, number of waiting callers].
+
+            call = self._calls[key] = [asyncio.ensure_future(
+                function(*args)), 0]
+            call[0].add_done_callback(
+                lambda task: self._finish(key, call))
+        else:
+            self._stats["coalesced"] += 1
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                self._forget(key, call)
+                call[0].cancel()
+
+    def _finish(self, key, call):
+        """Forget a finished call."""
+        self._forget(key, call)
+
+        # Mark the exception as retrieved, in case no caller is waiting
+        # for it.
+
+        if not call[0].cancelled():
+            call[0].exception()
+
+    def _forget(self, key, call):
+        """Remove *call* from the calls in progress, so that later callers
+        start a new one."""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+# _WEATHER_ITEMS details which tags should be read and what their
+# destination dict key should be. These tags don't appear multiple times.
+# {XML tag: [ElementTree access method, dict key]}
+
+_WEATHER_ITEMS = {
+    "channel/title": ["text", "title"],
+    "channel/link": ["text", "link"],
+    "channel/language": ["text", "language"],
+    "channel/description": ["text", "description"],
+    "channel/lastBuildDate": ["text", "lastBuildDate"],
+    "channel/ttl": ["text", "ttl"],
+    "channel/image/url": ["text", "logo"],
+    "channel/item/guid": ["text", "guid"],
+    "channel/{%s}location" % WEATHER_NS:
+        ["attrib", "location"],
+    # "channel/{%s}units" % WEATHER_NS:
+    #     ["attrib", "units"],
+    "channel/{%s}wind" % WEATHER_NS:
+        ["attrib", "wind"],
+    "channel/{%s}atmosphere" % WEATHER_NS:
+        ["attrib", "atmosphere"],
+    "channel/{%s}astronomy" % WEATHER_NS:
+        ["attrib", "astronomy"],
+    "channel/item/{%s}condition" % WEATHER_NS:
+        ["attrib", "condition"],
+}
+_FORECAST_PATH = "channel/item/{%s}forecast" % WEATHER_NS
+_GEO_ITEMS = {
+    "channel/item/{%s}lat" % GEO_NS: "lat",
+    "channel/item/{%s}long" % GEO_NS: "long",
+}
+_ITEM_TITLE_PATH = "channel/item/title"
+_LID_CHUNK_SIZE = 512
+
+# _STREAM_ITEMS combines the tables above for Client._iterparse_weather, so
+# that each element needs a single lookup.
+# {XML tag: [kind, dict key]}
+
+_STREAM_ITEMS = dict(_WEATHER_ITEMS)
+_STREAM_ITEMS[_FORECAST_PATH] = ["forecast", None]
+for (_tag, _key) in _GEO_ITEMS.items():
+    _STREAM_ITEMS[_tag] = ["geo", _key]
+_STREAM_ITEMS[_ITEM_TITLE_PATH] = ["title", None]
+del _tag, _key
+
+# A WOEID is a number, while a LID is XXXXNNNN, where X is a letter and N is
+# a number.
+
+_LID_START_PATTERN = _Lazy("_LID_START_PATTERN",
+                           lambda: re.compile("[A-Za-z]"))
+_LID_PATTERN = _Lazy("_LID_PATTERN",
+                     lambda: re.compile("[A-Za-z]{4}[0-9]{4}"))
+
+
+class _WeatherPlan(object):
+
+    """A compiled plan for extracting weather data from a feed.
+
+    A plan holds the part of _STREAM_ITEMS that its fields need and which
+    post-processing steps to run, so that nothing is decided per feed. The
+    item title is always read so that "City not found" feeds are
+    recognized, and ttl and units are always included because caching
+    depends on them.
+
+    """
+
+    __slots__ = ("fields", "items", "keys", "forecast", "geo", "image",
+                 "state", "compass", "cache_key")
+
+    def __init__(self, fields=None):
+        if fields is None:
+            fields = WEATHER_FIELDS
+        unknown = set(fields).difference(WEATHER_FIELDS)
+        if unknown:
+            raise ValueError("unknown weather fields: %s"
+                             % ", ".join(sorted(unknown)))
+        fields = frozenset(fields).union(("ttl", "units"))
+        self.fields = fields
+        self.items = {}
+        for (tag, meta) in _STREAM_ITEMS.items():
+            if meta[0] == "forecast":
+                wanted = "forecast" in fields
+            elif meta[0] == "geo":
+                wanted = "geo" in fields
+            elif meta[0] == "title":
+                wanted = True
+            else:
+                wanted = meta[1] in fields
+            if wanted:
+                self.items[tag] = meta
+        self.keys = tuple(meta[1] for meta in _WEATHER_ITEMS.values()
+                          if meta[1] in fields)
+        self.forecast = "forecast" in fields
+        self.geo = "geo" in fields
+        self.image = "condition" in fields
+        self.state = "atmosphere" in fields
+        self.compass = "wind" in fields
+
+        # cache_key is added to the cache keys of the plan's results, so
+        # that clients with other fields sharing a cache don't get each
+        # other's results. A plan of all the fields adds nothing.
+
+        if fields.issuperset(WEATHER_FIELDS):
+            self.cache_key = None
+        else:
+            self.cache_key = tuple(sorted(fields))
+
+
+_DEFAULT_PLAN = _WeatherPlan()
+
+_MI_TO_KM = 1.609344
+_IN_TO_HPA = 33.8638866667
+
+# _CONVERSIONS details which values differ between the feed's units and how
+# to convert an imperial value to metric and back. Forecast days are
+# converted with the "forecast" entry's fields.
+# {dict key: {field: (to metric, to imperial)}}
+
+_CONVERSIONS = {
+    "wind": {
+        "chill": (lambda f: (f - 32) * 5 / 9, lambda c: c * 9 / 5 + 32),
+        "speed": (lambda mph: mph * _MI_TO_KM, lambda kmh: kmh / _MI_TO_KM),
+    },
+    "atmosphere": {
+        "visibility": (lambda mi: mi * _MI_TO_KM, lambda km: km / _MI_TO_KM),
+        "pressure": (lambda inches: inches * _IN_TO_HPA,
+                     lambda hpa: hpa / _IN_TO_HPA),
+    },
+    "condition": {
+        "temp": (lambda f: (f - 32) * 5 / 9, lambda c: c * 9 / 5 + 32),
+    },
+    "forecast": {
+        "low": (lambda f: (f - 32) * 5 / 9, lambda c: c * 9 / 5 + 32),
+        "high": (lambda f: (f - 32) * 5 / 9, lambda c: c * 9 / 5 + 32),
+    },
+}
+
+
+def _yql_string(value):
+    """Return *value* as a quoted, URL-encoded YQL string literal."""
+    value = value.replace("\\", "\\\\").replace("'", "\\'")
+    return "'%s'" % urllib.parse.quote(value)
+
+
+def _convert_value(value, convert):
+    """Convert a number from the feed with *convert*, rounding the result to
+    as many decimal places as *value* has.
+
+    Returns *value* unchanged if it isn't a number.
+
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    if number != number:
+        return value
+    (whole, point, decimals) = value.strip().partition(".")
+    converted = "%.*f" % (len(decimals), convert(number))
+    if float(converted) == 0:
+        converted = converted.lstrip("-")
+    return converted
+
+
+def _parse_error(error):
+    """Return an xml.etree.ElementTree.ParseError for an expat *error*."""
+    parse_error = xml.etree.ElementTree.ParseError(str(error))
+    parse_error.code = error.code
+    parse_error.position = (error.lineno, error.offset)
+    return parse_error
+
+
+class ElementTreeParser(object):
+
+    """Read feeds with xml.etree.ElementTree (the default parser).
+
+    A parser reads the three kinds of documents that Client fetches and
+    returns what the client extracts from them, so that the client doesn't
+    depend on how the XML is parsed. This is the interface that Client
+    expects of its parser. Weather feeds are read with iterparse, clearing
+    each element as soon as it ends, and LID feeds with an XMLPullParser
+    that stops at the channel's link.
+
+    Methods:
+        weather: read the items of a weather feed.
+        link: read the channel's link of a weather feed.
+        results: read the fields of a placefinder query's results.
+
+    """
+
+    def _etree(self):
+        """Return the ElementTree module the parser uses."""
+        return xml.etree.ElementTree
+
+    def weather(self, source, items):
+        """Read the items of a weather feed.
+
+        Args:
+            source: (file) the feed.
+            items: (dict) maps the path of each element to read, relative
+                to the root, to a [kind, dict key] pair as in
+                _STREAM_ITEMS.
+
+        Returns:
+            a tuple of a dict that maps the dict key of each "text" and
+                "attrib" item to the first such element's text or attribute
+                dict, a list of the forecast elements' attribute dicts, a
+                dict that maps the dict key of each "geo" item to the first
+                such element's text, and the first item title's text.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: the feed isn't well-formed.
+
+        """
+        values = {}
+        forecast = []
+        geo = {}
+        title = None
+
+        # paths holds the path of each open element relative to the root,
+        # in the same form as the keys of _STREAM_ITEMS.
+
+        paths = []
+        push = paths.append
+        pop = paths.pop
+        lookup = items.get
+        for (event, elem) in self._etree().iterparse(source,
+                                                     ("start", "end")):
+            if event == "start":
+                if paths:
+                    parent = paths[-1]
+                    push(parent + "/" + elem.tag if parent else elem.tag)
+                else:
+                    push("")
+                continue
+            meta = lookup(pop())
+            if meta is not None:
+                if meta[0] == "text":
+                    values.setdefault(meta[1], elem.text)
+                elif meta[0] == "attrib":
+                    if meta[1] not in values:
+                        values[meta[1]] = dict(elem.attrib)
+                elif meta[0] == "forecast":
+                    forecast.append(dict(elem.attrib))
+                elif meta[0] == "geo":
+                    geo.setdefault(meta[1], elem.text)
+                elif title is None:
+                    title = elem.text
+            elem.clear()
+        return (values, forecast, geo, title)
+
+    def link(self, source):
+        """Return the text of a weather feed's channel link ("" if it is
+        empty) or None if it has none.
+
+        The feed is read in small chunks, and reading stops as soon as the
+        link has been parsed.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: the feed isn't well-formed.
+
+        """
+        parser = self._etree().XMLPullParser(("start", "end"))
+        path = []
+        while True:
+            data = source.read(_LID_CHUNK_SIZE)
+            if not data:
+
+                # Closing the parser raises ParseError if the feed is empty
+                # or ends before its root element does.
+
+                parser.close()
+                return None
+            parser.feed(data)
+            for (event, elem) in parser.read_events():
+                if event == "start":
+                    path.append(elem.tag)
+                    continue
+                if len(path) == 3 and path[1:] == ["channel", "link"]:
+                    return elem.text or ""
+                path.pop()
+                elem.clear()
+
+    def results(self, source):
+        """Return a list of a dict for each of a placefinder query's
+        results that maps the tag of each of the result's fields (e.g.
+        "woeid") to the first such field's text.
+
+        Raises:
+            xml.etree.ElementTree.ParseError: the document isn't
+                well-formed.
+
+        """
+        results = []
+        for result in self._etree().parse(source).getroot().iterfind(
+                "results/Result"):
+            fields = {}
+            for field in result:
+                fields.setdefault(field.tag, field.text)
+            results.append(fields)
+        return results
+
+
+class LxmlParser(ElementTreeParser):
+
+    """Read feeds with lxml.etree, which is optional.
+
+    It reads feeds the same way as ElementTreeParser, with lxml's
+    implementation of the ElementTree interface, and raises the same
+    errors.
+
+    """
+
+    def __init__(self):
+        """Create a parser.
+
+        Raises:
+            ImportError: lxml isn't installed.
+
+        """
+        import lxml.etree
+        self._lxml = lxml.etree
+
+    def _etree(self):
+        return self._lxml
+
+    def weather(self, source, items):
+        try:
+            return super(LxmlParser, self).weather(source, items)
+        except self._lxml.XMLSyntaxError as e:
+            raise self._lxml_error(e) from e
+
+    def link(self, source):
+        try:
+            return super(LxmlParser, self).link(source)
+        except self._lxml.XMLSyntaxError as e:
+            raise self._lxml_error(e) from e
+
+    def results(self, source):
+        try:
+            return super(LxmlParser, self).results(source)
+        except self._lxml.XMLSyntaxError as e:
+            raise self._lxml_error(e) from e
+
+    def _lxml_error(self, error):
+        """Return an xml.etree.ElementTree.ParseError for an lxml
+        *error*."""
+        parse_error = xml.etree.ElementTree.ParseError(str(error))
+        parse_error.code = error.code
+        parse_error.position = error.position
+        return parse_error
+
+
+class ExpatParser(ElementTreeParser):
+
+    """Read feeds with xml.parsers.expat callbacks, without building
+    elements.
+
+    The handlers track the path of each open element and keep only the
+    text and attributes of the items that are asked for, so no element or
+    tree is ever created. It returns the same results as ElementTreeParser
+    and raises the same errors.
+
+    """
+
+    def _create(self):
+        """Return a new expat parser that reports names the way
+        ElementTree does, once "{" is added to namespaced ones."""
+        parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+        parser.buffer_text = True
+        return parser
+
+    def weather(self, source, items):
+        values = {}
+        forecast = []
+        geo = {}
+        title = None
+        parser = self._create()
+
+        # stack holds a (path, item, data) tuple for each open element,
+        # where data is the element's attribute dict or the list of its
+        # text's chunks if the element is an item. Character data is only
+        # handled, by appending it to that list, while a text item is open
+        # and hasn't had a child yet.
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        lookup = items.get
+
+        def start(tag, attrib):
+            parser.CharacterDataHandler = None
+            if "}" in tag:
+                tag = "{" + tag
+            if stack:
+                parent = stack[-1][0]
+                path = parent + "/" + tag if parent else tag
+            else:
+                path = ""
+            meta = lookup(path)
+            if meta is None:
+                push((path, None, None))
+            elif meta[0] == "attrib" or meta[0] == "forecast":
+                push((path, meta, _fix_attrib(attrib)))
+            else:
+                chunks = []
+                parser.CharacterDataHandler = chunks.append
+                push((path, meta, chunks))
+
+        def end(tag):
+            nonlocal title
+            parser.CharacterDataHandler = None
+            (path, meta, data) = pop()
+            if meta is None:
+                return
+            if meta[0] == "text":
+                values.setdefault(meta[1], "".join(data) or None)
+            elif meta[0] == "attrib":
+                if meta[1] not in values:
+                    values[meta[1]] = data
+            elif meta[0] == "forecast":
+                forecast.append(data)
+            elif meta[0] == "geo":
+                geo.setdefault(meta[1], "".join(data) or None)
+            elif title is None:
+                title = "".join(data) or None
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            parser.ParseFile(source)
+        except xml.parsers.expat.ExpatError as e:
+            raise _parse_error(e) from e
+        return (values, forecast, geo, title)
+
+    def link(self, source):
+        path = []
+        found = []
+        chunks = []
+        parser = self._create()
+
+        def start(tag, attrib):
+            parser.CharacterDataHandler = None
+            path.append(tag)
+            if len(path) == 3 and path[1:] == ["channel", "link"]:
+                parser.CharacterDataHandler = chunks.append
+
+        def end(tag):
+            parser.CharacterDataHandler = None
+            if len(path) == 3 and path[1:] == ["channel", "link"]:
+                found.append("".join(chunks))
+            path.pop()
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            while not found:
+                data = source.read(_LID_CHUNK_SIZE)
+                if not data:
+                    parser.Parse(b"", True)
+                    return None
+                parser.Parse(data, False)
+        except xml.parsers.expat.ExpatError as e:
+            raise _parse_error(e) from e
+        return found[0]
+
+    def results(self, source):
+        results = []
+        path = []
+        field = None
+        chunks = None
+        parser = self._create()
+
+        # field is the tag of the result's field whose text is being read
+        # into chunks, or None.
+
+        def start(tag, attrib):
+            nonlocal field, chunks
+            parser.CharacterDataHandler = None
+            path.append(tag)
+            if len(path) == 3 and path[1:] == ["results", "Result"]:
+                results.append({})
+            elif (len(path) == 4 and path[1:3] == ["results", "Result"] and
+                  tag not in results[-1]):
+                field = tag
+                chunks = []
+                parser.CharacterDataHandler = chunks.append
+
+        def end(tag):
+            nonlocal field
+            parser.CharacterDataHandler = None
+            if field is not None and len(path) == 4:
+                results[-1][field] = "".join(chunks) or None
+                field = None
+            path.pop()
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        try:
+            parser.ParseFile(source)
+        except xml.parsers.expat.ExpatError as e:
+            raise _parse_error(e) from e
+        return results
+
+
+def _fix_attrib(attrib):
+    """Return an expat attribute dict with namespaced names written the way
+    ElementTree writes them."""
+    for name in attrib:
+        if "}" in name:
+            return dict(("{" + name if "}" in name else name, value)
+                        for (name, value) in attrib.items())
+    return attrib
+
+
+_DEFAULT_PARSER = ElementTreeParser()
+
+
+class _ClientBase(object):
+
+    """Build the feed URLs and parse the feeds for Client and AsyncClient."""
+
+    records = False
+    parser = _DEFAULT_PARSER
+    _plan = _DEFAULT_PLAN
+
+    @property
+    def fields(self):
+        """The names of the fields fetch_weather returns."""
+        return self._plan.fields
+
+    def _cache_key(self, id, units):
+        """Return the key of a location's weather in *units* in the
+        client's cache."""
+        if self._plan.cache_key is None:
+            return (id, units)
+        return (id, units, self._plan.cache_key)
+
+    def _weather_url(self, id, units):
+        """Return the URL of a location's weather feed in *units*."""
+
+        # WOEID is a 32-bit integer, while LID is XXXXNNNN, where X is a letter
+        # and N is a number. So, we pick the URL to use based on whether or not
+        # the *id* begins with a letter.
+
+        if _LID_START_PATTERN.match(id):
+            return LID_WEATHER_URL.format(id, units)
+        return WEATHER_URL.format(id, units)
+
+    def _iterparse_lid(self, source):
+        """Return the LID in a weather feed or None if it has none.
+
+        The feed is read from the file-like *source* by the client's
+        parser in small chunks, and reading stops as soon as the channel's
+        link has been parsed. The rest of the document is never read.
+
+        """
+        link = self.parser.link(source)
+
+        # We are pulling the LID from the permalink tag in the XML file
+        # returned by Yahoo.
+
+        if link is None:
+            return None
+
+        # use regex or string.split
+        # regex assumes the format XXXXNNNN for the LID.
+        # string.split works more general of the context.
+
+        lid = _LID_PATTERN.search(link).group()
+        # lid = link.split("/forecast/")[1].split("_")[0]
+
+        return lid
+
+    def _iterparse_weather(self, source, units):
+        """Return the weather data in a weather feed or None if the feed
+        has none.
+
+        The feed is read from the file-like *source* in a single pass by
+        the client's parser. Only the elements listed in
+        _STREAM_ITEMS that the client's fields need are kept.
+
+        """
+        weather = self._iterparse_items(source, units)
+        if weather is None:
+            return None
+        return self._finish_weather(weather, units)
+
+    def _iterparse_items(self, source, units, plan=None):
+        """Return the items read from a weather feed by _iterparse_weather,
+        before _finish_weather, or None if the feed has no weather data.
+
+        The items are those of *plan*, which defaults to the client's.
+
+        """
+        if plan is None:
+            plan = self._plan
+        (values, forecast, geo, title) = self.parser.weather(source,
+                                                             plan.items)
+        weather = {}
+        weather["units"] = UNITS[units]
+        weather.update(values)
+
+        if title == "City not found":
+            return None
+
+        for key in plan.keys:
+            weather.setdefault(key, None)
+        if plan.forecast:
+            weather["forecast"] = forecast
+        if plan.geo:
+            if len(geo) == len(_GEO_ITEMS):
+                weather["geo"] = geo
+            else:
+                weather["geo"] = None
+
+        return weather
+
+    def _finish_weather(self, weather, units):
+        """Add the values derived from the feed's data to *weather*.
+
+        Returns *weather*, or a Weather record made from it if the client
+        returns records.
+
+        Only the steps for the fields in the client's plan are run.
+
+        """
+        plan = self._plan
+        if plan.image:
+            try:
+                image_url = CONDITION_IMAGE_URL.format(
+                    weather["condition"]["code"])
+                weather["condition"]["image"] = image_url
+            except (AttributeError, TypeError):
+                pass
+
+        if plan.state:
+            try:
+                state = weather["atmosphere"]["rising"]
+                if state == "0":
+                    weather["atmosphere"]["state"] = "steady"
+                elif state == "1":
+                    weather["atmosphere"]["state"] = "rising"
+                elif state == "2":
+                    weather["atmosphere"]["state"] = "falling"
+                else:
+                    weather["atmosphere"]["state"] = None
+            except (AttributeError, TypeError):
+                pass
+
+        if plan.compass:
+            try:
+                weather["wind"]["compass"] = degrees_to_compass(
+                    weather["wind"]["direction"])
+            except TypeError:
+                pass
+
+        if self.records:
+            return Weather.from_dict(weather, units)
+        return weather
+
+    def _convert_weather(self, weather, units):
+        """Return a copy of *weather*, in *units*, converted to the other
+        units.
+
+        The converted values are rounded to the precision the feed gave
+        them in. Dicts that don't change are shared with *weather*.
+
+        """
+        other = "f" if units == "c" else "c"
+        direction = 0 if units == "f" else 1
+        records = isinstance(weather, Weather)
+        if records:
+            weather = weather.to_dict()
+        converted = dict(weather)
+        converted["units"] = UNITS[other]
+        for (key, fields) in _CONVERSIONS.items():
+            if key == "forecast":
+                if weather.get("forecast") is not None:
+                    converted["forecast"] = [
+                        self._convert_fields(day, fields, direction)
+                        for day in weather["forecast"]]
+            elif weather.get(key) is not None:
+                converted[key] = self._convert_fields(weather[key], fields,
+                                                      direction)
+        if records:
+            return Weather.from_dict(converted, other)
+        return converted
+
+    def _convert_fields(self, data, fields, direction):
+        """Return a copy of the dict *data* with *fields* converted."""
+        data = dict(data)
+        for (field, conversions) in fields.items():
+            if field in data:
+                data[field] = _convert_value(data[field],
+                                             conversions[direction])
+        return data
+
+    def _first_woeid(self, results):
+        """Return the first WOEID in a placefinder query's results or None
+        if they have none."""
+        for result in results:
+            if result.get("woeid") is not None:
+                return result["woeid"]
+        return None
+
+    def _ttl_seconds(self, weather):
+        """Return how many seconds *weather* may be cached for."""
+        if isinstance(weather, Weather):
+            ttl = weather.ttl
+        else:
+            ttl = weather["ttl"]
+        try:
+            return int(ttl) * 60
+        except (TypeError, ValueError):
+            return DEFAULT_TTL
+
+    def _degrees_to_direction(self, degrees):
+        """Convert wind direction from degrees to compass direction."""
+        return degrees_to_compass(degrees)
+
+
+class Client(_ClientBase):
+
+    """Interface with the Yahoo! Weather RSS feed.
+
+    Provides methods to search for location data and fetch weather data.
+
+    Attributes:
+        cache: the cache used by fetch_weather or None if caching is
+            disabled.
+        transport: the transport used to open URLs.
+        resolution_store: the store used by fetch_woeid and fetch_lid or
+            None if lookups aren't stored.
+        records: whether fetch_weather returns Weather records instead of
+            dicts.
+        conditional_get: whether fetch_weather revalidates feeds with
+            conditional requests.
+        max_validators: the number of feeds whose validators are kept.
+        throttle: the throttle that limits the client's requests or None.
+        metrics: the object that observes fetch_weather's timings or None.
+        fields: the fields fetch_weather returns.
+        parser: the parser that reads the feeds.
+        stats: a dict that counts the conditional requests answered with
+            304 Not Modified ("not_modified") and the calls that shared
+            another call's fetch ("coalesced").
+
+    Methods:
+        fetch_lid: fetch a location's LID.
+        fetch_woeid: fetch a location's WOEID.
+        fetch_woeids: fetch many locations' WOEIDs in batches.
+        fetch_weather: fetch a location's weather.
+        fetch_weather_both: fetch a location's weather in both units.
+        fetch_weather_many: fetch many locations' weather concurrently.
+        fetch_weather_columns: fetch many locations' weather as columns.
+
+    """
+
+    def __init__(self, cache=None, transport=None, resolution_store=None,
+                 records=False, conditional_get=False, throttle=None,
+                 metrics=None, fields=None, parser=None,
+                 max_validators=1024):
+        """Create a client.
+
+        Args:
+            cache: (TTLCache) a cache for fetch_weather's results; defaults
+                to None (no caching). Entries expire according to the
+                feed's ttl.
+            transport: (PooledTransport) the transport used to open URLs;
+                defaults to a new UrllibTransport.
+            resolution_store: (ResolutionStore) a store for fetch_woeid's
+                and fetch_lid's results; defaults to None (no store).
+            records: (bool) make fetch_weather return Weather records
+                instead of dicts; defaults to False.
+            conditional_get: (bool) remember each weather feed's ETag and
+                Last-Modified validators and send them when the feed is
+                fetched again. If the server answers 304 Not Modified, the
+                previous result is returned without parsing. Defaults to
+                False.
+            throttle: (Throttle) limits the rate and concurrency of the
+                client's requests to each host; defaults to None (no
+                limits).
+            metrics: (TimingHistogram) an object whose observe method is
+                called with a Timing for each fetch_weather call that
+                returns; defaults to None (no timings are taken).
+            fields: (iterable) the names from WEATHER_FIELDS that
+                fetch_weather returns, e.g. ("condition", "wind"). ttl and
+                units are always returned. The results are cached under
+                keys of their own, so clients with other fields can share
+                a cache. Defaults to None (all fields).
+            parser: (ElementTreeParser) the parser that reads the feeds,
+                such as an ExpatParser or LxmlParser; defaults to None (an
+                ElementTreeParser).
+            max_validators: (int) the number of feeds whose validators and
+                last result are kept for conditional_get; the least
+                recently used are forgotten. Defaults to 1024.
+
+        Raises:
+            ValueError: *fields* has a name that isn't in WEATHER_FIELDS.
+
+        """
+        self.cache = cache
+        if transport is None:
+            transport = UrllibTransport()
+        self.transport = transport
+        self.resolution_store = resolution_store
+        self.records = records
+        self.conditional_get = conditional_get
+        self.throttle = throttle
+        self.metrics = metrics
+        if fields is not None:
+            self._plan = _WeatherPlan(fields)
+        if parser is not None:
+            self.parser = parser
+        self.stats = {"not_modified": 0, "coalesced": 0}
+        self.max_validators = max_validators
+
+        # _validators maps each URL to the ETag and Last-Modified headers
+        # of its last response and the result parsed from it, least
+        # recently used first.
+        # {url: (etag, last_modified, weather)}
+
+        self._validators = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight(self.stats)
+
+    def fetch_lid(self, woeid):
+        """Fetch a location's corresponding LID.
+
+        Only the beginning of the location's weather feed is read. The
+        connection is closed as soon as the LID has been found. If the client
+        has a resolution store, a stored LID is returned instead.
+
+        Args:
+            woeid: (string) the location's WOEID.
+
+        Returns:
+            a string containing the requested LID or None if the LID could
+            not be found.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document.
+
+        """
+        return self._resolve("lid", woeid, self._fetch_lid)
+
+    def _fetch_lid(self, woeid):
+        """Fetch and parse a location's LID."""
+        url = LID_LOOKUP_URL.format(woeid, "f")
+        with contextlib.closing(self._open(url)) as f:
+            return self._iterparse_lid(f)
+
+    def fetch_weather(self, id, metric=False, use_cache=True):
+        """Fetch a location's weather.
+
+        *id* can be either a WOEID or LID. The weather data returned for each
+        is identical except that the WOEID returns a 2-day forecast and the LID
+        returns a 5-day forecast. The LID uses an undocumented API, so use it
+        at your own risk.
+
+        If the client has a cache, a cached result is returned until the
+        feed's ttl has passed. Cached results are shared between calls and
+        should not be modified. Likewise, concurrent calls for the same feed
+        share one fetch and return the same result.
+
+        Args:
+            id: (string) the location's WOEID or LID.
+            metric: (bool) return metric data; defaults to False.
+            use_cache: (bool) use the client's cache; defaults to True.
+
+        Returns:
+            a dict containing the location's weather data (or a Weather
+                record if the client returns records) or None if the
+                weather data couldn't be fetched.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document.
+
+        """
+
+        units = "c" if metric else "f"
+
+        if self.cache is None or not use_cache:
+            return self._fetch_weather(id, units)
+
+        key = self._cache_key(id, units)
+        weather = self.cache.get(key)
+        if weather is None:
+            weather = self._fetch_weather(id, units)
+            if weather is not None:
+                self.cache.set(key, weather, self._ttl_seconds(weather))
+        elif self.metrics is not None:
+            self.metrics.observe(Timing(self._weather_url(id, units), True,
+                                        False, None, None, None, None, None,
+                                        None))
+        return weather
+
+    def fetch_weather_both(self, id, metric=False, use_cache=True):
+        """Fetch a location's weather once and return it in both units.
+
+        The weather is fetched by fetch_weather in the units chosen by
+        *metric*, and the other units are derived from it: temperatures,
+        wind chill, wind speed, visibility, pressure and the forecast's
+        highs and lows are converted and rounded to the precision the feed
+        gave them in. Text, such as the title, isn't changed. Only the
+        fetched units are cached.
+
+        Args:
+            id: (string) the location's WOEID or LID.
+            metric: (bool) fetch metric data and derive the imperial data;
+                defaults to False.
+            use_cache: (bool) use the client's cache; defaults to True.
+
+        Returns:
+            a dict that maps "f" to the location's weather data in imperial
+                units and "c" to the data in metric units, each with its
+                own UNITS table (or Weather record if the client returns
+                records), or None if the weather data couldn't be fetched.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document.
+
+        """
+        units = "c" if metric else "f"
+        weather = self.fetch_weather(id, metric, use_cache)
+        if weather is None:
+            return None
+        other = self._convert_weather(weather, units)
+        if metric:
+            return {"f": other, "c": weather}
+        return {"f": weather, "c": other}
+
+    def fetch_weather_many(self, ids, metric=False, use_cache=True,
+                           max_workers=8, max_in_flight=None, deadline=None):
+        """Fetch many locations' weather concurrently.
+
+        The weather for each id is fetched by fetch_weather on a pool of
+        *max_workers* threads. Results are yielded in the order they
+        complete. An error fetching one location doesn't stop the others;
+        it is reported in that location's result instead.
+
+        *ids* is consumed lazily, so it can be a generator. If *deadline*
+        passes, each id still being fetched is yielded with a
+        concurrent.futures.TimeoutError and the remaining ids are skipped.
+
+        Args:
+            ids: (iterable) the locations' WOEIDs or LIDs.
+            metric: (bool) return metric data; defaults to False.
+            use_cache: (bool) use the client's cache; defaults to True.
+            max_workers: (int) the number of threads; defaults to 8.
+            max_in_flight: (int) the maximum number of ids being fetched at
+                once; defaults to twice *max_workers*.
+            deadline: (float) seconds to wait for all of the results;
+                defaults to None (no deadline).
+
+        Yields:
+            a BulkResult for each id.
+
+        """
+        return self._fetch_many(self.fetch_weather, ids, (metric, use_cache),
+                                max_workers, max_in_flight, deadline)
+
+    def fetch_weather_columns(self, ids, metric=False, use_cache=True,
+                              max_workers=8, max_in_flight=None,
+                              deadline=None):
+        """Fetch many locations' weather into a WeatherColumns table.
+
+        The weather is fetched concurrently like fetch_weather_many's, and
+        each result is added to the table as soon as it arrives. Only the
+        feed items the table's columns need are parsed, and they aren't
+        made into fetch_weather's weather data or cached. Locations whose
+        weather couldn't be fetched are left out of the table and listed in
+        its errors instead; locations that weren't found are left out.
+
+        Args:
+            ids: (iterable) the locations' WOEIDs or LIDs.
+            metric: (bool) return metric data; defaults to False.
+            use_cache: (bool) use the client's cached weather data; defaults
+                to True.
+            max_workers: (int) the number of threads; defaults to 8.
+            max_in_flight: (int) the maximum number of ids being fetched at
+                once; defaults to twice *max_workers*.
+            deadline: (float) seconds to wait for all of the results;
+                defaults to None (no deadline).
+
+        Returns:
+            a WeatherColumns table with a row for each location.
+
+        """
+        units = "c" if metric else "f"
+        plan = _WeatherPlan(self._plan.fields.intersection(
+            WeatherColumns.fields))
+        table = WeatherColumns()
+        for result in self._fetch_many(
+                self._fetch_columns_row, ids, (units, plan, use_cache),
+                max_workers, max_in_flight, deadline):
+            if result.error is not None:
+                table.errors[result.id] = result.error
+            elif result.weather is not None:
+                table.append(result.id, result.weather)
+        return table
+
+    def _fetch_columns_row(self, id, units, plan, use_cache):
+        """Return the items of a location's weather feed that *plan*
+        keeps, or its cached weather data, for a WeatherColumns row.
+
+        The items aren't finished, cached or shared with other calls, since
+        they aren't fetch_weather's weather data.
+
+        """
+        if self.cache is not None and use_cache:
+            weather = self.cache.get(self._cache_key(id, units))
+            if weather is not None:
+                return weather
+        url = self._weather_url(id, units)
+        with contextlib.closing(self._open(url)) as f:
+            self._check_not_modified(url, f, None)
+            return self._iterparse_items(f, units, plan)
+
+    def _fetch_many(self, fetch, ids, args, max_workers, max_in_flight,
+                    deadline):
+        """Call fetch(id, *args) for each of *ids* on a pool of threads and
+        yield a BulkResult for each, as fetch_weather_many describes."""
+        if max_in_flight is None:
+            max_in_flight = max_workers * 2
+        if deadline is not None:
+            deadline += time.monotonic()
+        ids = iter(ids)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        pending = {}
+        try:
+            while True:
+                for id in ids:
+                    future = executor.submit(fetch, id, *args)
+                    pending[future] = id
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    return
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.monotonic())
+                done, not_done = concurrent.futures.wait(
+                    pending, timeout,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    futures, pending = pending, {}
+                    for future, id in futures.items():
+                        future.cancel()
+                        yield BulkResult(id, None,
+                                         concurrent.futures.TimeoutError(
+                                             "deadline exceeded"))
+                    return
+                for future in done:
+                    id = pending.pop(future)
+                    try:
+                        weather = future.result()
+                    except Exception as e:
+                        yield BulkResult(id, None, e)
+                    else:
+                        yield BulkResult(id, weather, None)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _fetch_weather(self, id, units):
+        """Fetch and parse a location's weather in *units*.
+
+        Concurrent calls for the same feed share one fetch.
+
+        """
+        url = self._weather_url(id, units)
+        return self._flight.do(("weather", url), self._load_weather, url,
+                               units)
+
+    def _load_weather(self, url, units):
+        """Fetch and parse the weather feed at *url*."""
+        if self.metrics is not None:
+            return self._load_weather_timed(url, units)
+        if not self.conditional_get:
+            with contextlib.closing(self._open(url)) as f:
+                self._check_not_modified(url, f, None)
+                return self._iterparse_weather(f, units)
+
+        validators, headers = self._conditional_headers(url)
+        with contextlib.closing(self._open(url, headers)) as f:
+            if self._check_not_modified(url, f, validators):
+                return validators[2]
+            weather = self._iterparse_weather(f, units)
+            self._store_validators(url, f, weather)
+        return weather
+
+    def _conditional_headers(self, url):
+        """Return the validators stored for *url* and the headers of a
+        conditional request for it."""
+        with self._lock:
+            validators = self._validators.get(url)
+            if validators is not None:
+                self._validators.move_to_end(url)
+        headers = {}
+        if validators is not None:
+            if validators[0] is not None:
+                headers["If-None-Match"] = validators[0]
+            if validators[1] is not None:
+                headers["If-Modified-Since"] = validators[1]
+        return validators, headers
+
+    def _check_not_modified(self, url, response, validators):
+        """Return whether *response* is a 304 Not Modified answer to a
+        conditional request sent with *validators*.
+
+        Raises:
+            urllib.error.HTTPError: the response is 304 Not Modified, but
+                no conditional request was sent, so there is no result to
+                reuse.
+
+        """
+        if getattr(response, "status", None) != 304:
+            return False
+        if validators is None:
+            raise urllib.error.HTTPError(
+                url, 304, "Not Modified without a conditional request",
+                getattr(response, "headers", {}), None)
+        with self._lock:
+            self.stats["not_modified"] += 1
+        return True
+
+    def _store_validators(self, url, response, weather):
+        """Keep *response*'s validators and *weather* for the next
+        conditional request for *url*, forgetting the least recently used
+        feed's if there are more than max_validators."""
+        etag = response.getheader("ETag")
+        last_modified = response.getheader("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+        with self._lock:
+            self._validators[url] = (etag, last_modified, weather)
+            self._validators.move_to_end(url)
+            while len(self._validators) > self.max_validators:
+                self._validators.popitem(last=False)
+
+    def _load_weather_timed(self, url, units):
+        """Like _load_weather, but time each phase of the fetch and pass
+        the Timing to the client's metrics."""
+        started = time.perf_counter()
+        validators = None
+        headers = None
+        if self.conditional_get:
+            validators, headers = self._conditional_headers(url)
+        response = self._open(url, headers)
+        first_byte = time.perf_counter() - started
+        connect = getattr(response, "connect_time", None)
+        with contextlib.closing(_TimedResponse(response)) as f:
+            if self._check_not_modified(url, f, validators):
+                self.metrics.observe(Timing(url, False, True, connect,
+                                            first_byte, None, None, None, 0))
+                return validators[2]
+            parse_started = time.perf_counter()
+            weather = self._iterparse_items(f, units)
+            extract_started = time.perf_counter()
+            if weather is not None:
+                weather = self._finish_weather(weather, units)
+            finished = time.perf_counter()
+            if self.conditional_get:
+                self._store_validators(url, f, weather)
+        self.metrics.observe(Timing(
+            url, False, False, connect, first_byte, f.read_time,
+            extract_started - parse_started - f.read_time,
+            finished - extract_started, f.bytes))
+        return weather
+
+    def fetch_woeid(self, location):
+        """Fetch a location's corresponding WOEID.
+
+        If the client has a resolution store, a stored WOEID is returned
+        instead.
+
+        Args:
+            location: (string) a location (e.g. 23454 or Berlin, Germany).
+
+        Returns:
+            a string containing the location's corresponding WOEID or None if
+                the WOEID could not be found.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document.
+
+        """
+        return self._resolve("woeid", location, self._fetch_woeid)
+
+    def _fetch_woeid(self, location):
+        """Fetch and parse a location's WOEID."""
+        results = self._fetch_results(
+            WOEID_LOOKUP_URL.format(urllib.parse.quote(location)))
+        return self._first_woeid(results)
+
+    def fetch_woeids(self, locations, batch_size=50, max_workers=4):
+        """Fetch many locations' corresponding WOEIDs.
+
+        The locations are looked up *batch_size* at a time, each batch with
+        one placefinder query, on a pool of *max_workers* threads. A batch's
+        results are matched to its locations by the text each result was
+        found for. A location that doesn't match exactly one result
+        (because it is ambiguous or wasn't found, or the results don't
+        carry their text) is looked up with fetch_woeid instead, as are all
+        of a batch's locations if its query fails. If the client has a
+        resolution store, stored WOEIDs are used and the fetched ones are
+        stored.
+
+        Args:
+            locations: (iterable) the locations (e.g. 23454 or Berlin,
+                Germany).
+            batch_size: (int) the number of locations per query; defaults
+                to 50.
+            max_workers: (int) the number of threads; defaults to 4.
+
+        Returns:
+            a dict that maps each location to a string containing its
+                corresponding WOEID or None if the WOEID could not be
+                found.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL
+                of a location's own query.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document of a location's own query.
+
+        """
+        woeids = {}
+        missing = []
+        for location in locations:
+            if location in woeids:
+                continue
+            woeid = _MISSING
+            if self.resolution_store is not None:
+                woeid = self.resolution_store.get("woeid", location, _MISSING)
+            woeids[location] = woeid
+            if woeid is _MISSING:
+                missing.append(location)
+        batches = [missing[i:i + batch_size]
+                   for i in range(0, len(missing), batch_size)]
+        if batches:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+                for result in pool.map(self._fetch_woeid_batch, batches):
+                    woeids.update(result)
+        return woeids
+
+    def _fetch_woeid_batch(self, locations):
+        """Fetch the WOEIDs of *locations* with one query, falling back to
+        fetch_woeid for each location that can't be matched to exactly
+        one result."""
+        url = WOEID_BATCH_LOOKUP_URL.format(
+            ",".join(_yql_string(location) for location in locations))
+        try:
+            results = self._fetch_results(url)
+        except (OSError, httplib.HTTPException,
+                xml.etree.ElementTree.ParseError):
+            results = []
+
+        # matches maps each location to the WOEIDs of the results found for
+        # it. Results are never matched by position, since an ambiguous
+        # location and one that isn't found would shift the others.
+
+        matches = dict((location, []) for location in locations)
+        for result in results:
+            if result.get("text") in matches:
+                matches[result["text"]].append(result.get("woeid"))
+        woeids = {}
+        for location in locations:
+            if len(matches[location]) != 1:
+                woeids[location] = self.fetch_woeid(location)
+                continue
+            woeids[location] = matches[location][0]
+            if self.resolution_store is not None:
+                self.resolution_store.set("woeid", location,
+                                          woeids[location])
+        return woeids
+
+    def _resolve(self, kind, key, fetch):
+        """Look up *key* in the resolution store or fetch it.
+
+        Concurrent calls for the same *kind* and *key* share one fetch.
+
+        """
+        if self.resolution_store is None:
+            return self._flight.do((kind, key), fetch, key)
+        value = self.resolution_store.get(kind, key, _MISSING)
+        if value is _MISSING:
+            value = self._flight.do((kind, key), fetch, key)
+            self.resolution_store.set(kind, key, value)
+        return value
+
+    def _fetch_results(self, url):
+        """Fetch a placefinder query and return the fields of each of its
+        results."""
+        with contextlib.closing(self._open(url)) as f:
+            return self.parser.results(f)
+
+    def _open(self, url, headers=None):
+        """Open a url with the client's transport, waiting for the
+        throttle's limit if it has one."""
+        limit = None
+        if self.throttle is not None:
+            limit = self.throttle.limit_for(url)
+        if limit is None:
+            return self.transport.open(url, headers)
+        started = limit.acquire()
+        try:
+            response = self.transport.open(url, headers)
+        except urllib.error.HTTPError as e:
+
+            # Only errors that suggest the server is overloaded count as
+            # congestion.
+
+            limit.release(started, error=e.code >= 500 or e.code == 429)
+            raise
+        except Exception:
+            limit.release(started, error=True)
+            raise
+        return _ThrottledResponse(response, limit, started)
+
+
+class AsyncTransport(object):
+
+    """Open URLs with asyncio streams over pooled keep-alive connections.
+
+    This is the asyncio counterpart of PooledTransport. Its request()
+    coroutine reads the whole response and returns an object with status,
+    reason, headers and body attributes and a getheader() method. This is
+    the interface that AsyncClient expects of its transport.
+
+    Attributes:
+        stats: a dict that counts requests, connections created, connections
+            reused, and connections discarded.
+
+    Methods:
+        request: fetch a URL (coroutine).
+        aclose: close all idle connections and wait until they are closed
+            (coroutine).
+        close: close all idle connections.
+
+    """
+
+    max_redirects = 5
+
+    def __init__(self, pool_size=4, idle_timeout=30, timeout=None,
+                 clock=time.time):
+        """Create a transport.
+
+        Args:
+            pool_size: (int) the maximum number of idle connections kept per
+                host; defaults to 4.
+            idle_timeout: (float) seconds an idle connection is kept before
+                it is closed; defaults to 30.
+            timeout: (float) seconds to wait for each request; defaults to
+                None (no timeout).
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time.
+
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = {"requests": 0, "connections": 0, "reused": 0,
+                      "discarded": 0}
+        self._clock = clock
+        self._pools = {}
+
+    async def request(self, url, headers=None):
+        """Fetch *url*, sending the extra request *headers*.
+
+        Raises:
+            urllib.error.HTTPError: the server returned an error status.
+            http.client.HTTPException: the server's response was invalid.
+            asyncio.TimeoutError: the request took longer than the
+                transport's timeout.
+            OSError: the connection failed.
+
+        """
+        for i in range(self.max_redirects + 1):
+            if self.timeout is None:
+                response = await self._request(url, headers)
+            else:
+                response = await asyncio.wait_for(
+                    self._request(url, headers), self.timeout)
+            if (response.status in (301, 302, 303, 307, 308) and
+                    response.getheader("Location")):
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status,
+                                             response.reason,
+                                             response.headers, None)
+            return response
+        raise urllib.error.HTTPError(url, response.status,
+                                     "too many redirects", response.headers,
+                                     None)
+
+    async def aclose(self):
+        """Close all idle connections and wait until the running event
+        loop's are closed."""
+        pools, self._pools = self._pools, {}
+        running = asyncio.get_running_loop()
+        writers = []
+        for pool in pools.values():
+            for connection, idle_since, loop in pool:
+                self._close(connection)
+                if loop is running:
+                    writers.append(connection[1])
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def close(self):
+        """Close all idle connections.
+
+        Unlike aclose(), this doesn't wait for the connections of a running
+        event loop to finish closing.
+
+        """
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for connection, idle_since, loop in pool:
+                self._close(connection)
+
+    async def _request(self, url, headers):
+        """Send a GET request for *url* and return the response."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        self.stats["requests"] += 1
+        connection = self._acquire(key)
+        reused = connection is not None
+        if not reused:
+            connection = await self._connect(key)
+        try:
+            response, will_close = await self._exchange(
+                connection, parts.netloc, path, headers)
+        except (EOFError, OSError, httplib.HTTPException):
+            connection[1].close()
+            if not reused:
+                raise
+
+            # The server may close an idle keep-alive connection at any
+            # time, so a request on a reused connection is retried once on
+            # a new one.
+
+            self.stats["discarded"] += 1
+            connection = await self._connect(key)
+            response, will_close = await self._exchange(
+                connection, parts.netloc, path, headers)
+        if will_close:
+            self.stats["discarded"] += 1
+            connection[1].close()
+        else:
+            self._release(key, connection)
+        return response
+
+    async def _exchange(self, connection, host, path, headers):
+        """Send a request on *connection* and read its response.
+
+        Returns:
+            a tuple of the response and whether the connection must be
+            closed afterwards.
+
+        """
+        reader, writer = connection[:2]
+        try:
+            lines = ["GET %s HTTP/1.1" % path, "Host: %s" % host,
+                     "Accept-Encoding: identity"]
+            for name, value in (headers or {}).items():
+                lines.append("%s: %s" % (name, value))
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise httplib.RemoteDisconnected(
+                    "Remote end closed connection without response")
+            try:
+                version, status, reason = status_line.decode(
+                    "latin-1").rstrip("\r\n").split(" ", 2)
+                status = int(status)
+            except ValueError:
+                raise httplib.BadStatusLine(status_line)
+            message = httplib.HTTPMessage()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                message[name.strip()] = value.strip()
+
+            will_close = (version == "HTTP/1.0" or
+                          message.get("Connection", "").lower() == "close")
+            if status in (204, 304) or 100 <= status < 200:
+                body = b""
+            elif message.get("Transfer-Encoding", "").lower() == "chunked":
+                body = await self._read_chunked(reader)
+            elif message.get("Content-Length") is not None:
+                body = await reader.readexactly(
+                    int(message["Content-Length"]))
+            else:
+                body = await reader.read()
+                will_close = True
+        except BaseException:
+            writer.close()
+            raise
+        return _BufferedResponse(status, reason, message, body), will_close
+
+    async def _read_chunked(self, reader):
+        """Read a body sent with chunked transfer encoding."""
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise httplib.IncompleteRead(b"".join(chunks))
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
+
+    async def _connect(self, key):
+        """Open a new connection to the host identified by *key*.
+
+        Returns:
+            a (reader, writer, socket) tuple. The transport keeps the socket
+            so that it can close it even after the connection's event loop
+            has been closed.
+
+        """
+        scheme, netloc = key
+        parts = urllib.parse.urlsplit("//" + netloc)
+        port = parts.port or (443 if scheme == "https" else 80)
+        self.stats["connections"] += 1
+        loop = asyncio.get_running_loop()
+        error = OSError("getaddrinfo returned no addresses")
+        for (family, type, proto, canonname, address) in (
+                await loop.getaddrinfo(parts.hostname, port,
+                                       type=socket.SOCK_STREAM)):
+            sock = socket.socket(family, type, proto)
+            try:
+                sock.setblocking(False)
+                await loop.sock_connect(sock, address)
+                break
+            except BaseException as e:
+                sock.close()
+                if not isinstance(e, OSError):
+                    raise
+                error = e
+        else:
+            raise error
+        try:
+            if scheme == "https":
+                reader, writer = await asyncio.open_connection(
+                    sock=sock, ssl=True, server_hostname=parts.hostname)
+            else:
+                reader, writer = await asyncio.open_connection(sock=sock)
+        except BaseException:
+            sock.close()
+            raise
+        return (reader, writer, sock)
+
+    def _acquire(self, key):
+        """Return an idle connection for *key* or None if there isn't one.
+
+        Connections opened by another event loop, such as the loop of an
+        earlier asyncio.run call, can't be used and are discarded.
+
+        """
+        now = self._clock()
+        running = asyncio.get_running_loop()
+        pool = self._pools.get(key)
+        while pool:
+            connection, idle_since, loop = pool.pop()
+            if loop is not running or now - idle_since > self.idle_timeout:
+                self._close(connection)
+                self.stats["discarded"] += 1
+            else:
+                self.stats["reused"] += 1
+                return connection
+        return None
+
+    def _release(self, key, connection):
+        """Return *connection* to its pool."""
+        pool = self._pools.setdefault(key, collections.deque())
+        if len(pool) < self.pool_size:
+            pool.append((connection, self._clock(),
+                         asyncio.get_running_loop()))
+        else:
+            self.stats["discarded"] += 1
+            connection[1].close()
+
+    def _close(self, connection):
+        """Close a pooled connection, which may belong to a closed event
+        loop."""
+        try:
+            connection[1].close()
+        except RuntimeError:
+
+            # The connection's loop is closed, so its transport can't close
+            # the socket; the socket is closed directly instead.
+
+            connection[2].close()
+
+
+class AsyncClient(_ClientBase):
+
+    """Interface with the Yahoo! Weather RSS feed from asyncio.
+
+    Provides coroutine versions of Client's methods. They return the same
+    data as Client's. At most *max_concurrency* requests are in flight at
+    once; further calls wait for a free slot. Like Client, concurrent calls
+    for the same feed or location share one fetch.
+
+    Attributes:
+        cache: the cache used by fetch_weather or None if caching is
+            disabled.
+        transport: the transport used to fetch URLs.
+        max_concurrency: the maximum number of requests in flight.
+        records: whether fetch_weather returns Weather records instead of
+            dicts.
+        fields: the fields fetch_weather returns.
+        parser: the parser that reads the feeds.
+        stats: a dict that counts the calls that shared another call's
+            fetch ("coalesced").
+
+    Methods:
+        fetch_lid: fetch a location's LID (coroutine).
+        fetch_woeid: fetch a location's WOEID (coroutine).
+        fetch_weather: fetch a location's weather (coroutine).
+
+    """
+
+    def __init__(self, cache=None, transport=None, max_concurrency=100,
+                 records=False, fields=None, parser=None):
+        """Create a client.
+
+        Args:
+            cache: (TTLCache) a cache for fetch_weather's results; defaults
+                to None (no caching). Entries expire according to the
+                feed's ttl.
+            transport: (AsyncTransport) the transport used to fetch URLs;
+                defaults to a new AsyncTransport.
+            max_concurrency: (int) the maximum number of requests in
+                flight; defaults to 100.
+            records: (bool) make fetch_weather return Weather records
+                instead of dicts; defaults to False.
+            fields: (iterable) the names from WEATHER_FIELDS that
+                fetch_weather returns; defaults to None (all fields). See
+                Client.
+            parser: (ElementTreeParser) the parser that reads the feeds;
+                defaults to None (an ElementTreeParser).
+
+        Raises:
+            ValueError: *fields* has a name that isn't in WEATHER_FIELDS.
+
+        """
+        self.cache = cache
+        if transport is None:
+            transport = AsyncTransport()
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.records = records
+        if fields is not None:
+            self._plan = _WeatherPlan(fields)
+        if parser is not None:
+            self.parser = parser
+        self.stats = {"coalesced": 0}
+        self._flight = _AsyncSingleFlight(self.stats)
+        self._semaphore = None
+
+    async def fetch_lid(self, woeid):
+        """Fetch a location's corresponding LID.
+
+        See Client.fetch_lid. Unlike Client.fetch_lid, the whole feed is
+        downloaded, since the transport's request() returns complete
+        responses; only the parsing stops once the LID has been found.
+
+        """
+        return await self._flight.do(("lid", woeid), self._fetch_lid, woeid)
+
+    async def _fetch_lid(self, woeid):
+        """Fetch and parse a location's LID."""
+        body = await self._fetch(LID_LOOKUP_URL.format(woeid, "f"))
+        return self._iterparse_lid(io.BytesIO(body))
+
+    async def fetch_weather(self, id, metric=False, use_cache=True):
+        """Fetch a location's weather.
+
+        See Client.fetch_weather.
+
+        """
+        units = "c" if metric else "f"
+
+        if self.cache is None or not use_cache:
+            return await self._fetch_weather(id, units)
+
+        key = self._cache_key(id, units)
+        weather = self.cache.get(key)
+        if weather is None:
+            weather = await self._fetch_weather(id, units)
+            if weather is not None:
+                self.cache.set(key, weather, self._ttl_seconds(weather))
+        return weather
+
+    async def _fetch_weather(self, id, units):
+        """Fetch and parse a location's weather in *units*.
+
+        Concurrent calls for the same feed share one fetch.
+
+        """
+        url = self._weather_url(id, units)
+        return await self._flight.do(("weather", url), self._load_weather,
+                                     url, units)
+
+    async def _load_weather(self, url, units):
+        """Fetch and parse the weather feed at *url*."""
+        body = await self._fetch(url)
+        return self._iterparse_weather(io.BytesIO(body), units)
+
+    async def fetch_woeid(self, location):
+        """Fetch a location's corresponding WOEID.
+
+        See Client.fetch_woeid.
+
+        """
+        return await self._flight.do(("woeid", location), self._fetch_woeid,
+                                     location)
+
+    async def _fetch_woeid(self, location):
+        """Fetch and parse a location's WOEID."""
+        body = await self._fetch(
+            WOEID_LOOKUP_URL.format(urllib.parse.quote(location)))
+        return self._first_woeid(self.parser.results(io.BytesIO(body)))
+
+    async def _fetch(self, url):
+        """Fetch a url and return the document."""
+
+        # A semaphore belongs to the event loop it is first used in, so one
+        # is created for each loop the client is used from.
+
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        async with self._semaphore[1]:
+            response = await self.transport.request(url)
+        return response.body
+
+
+class Refresher(object):
+
+    """Keep the weather of a watched set of locations fresh in memory.
+
+    The refresher fetches each watched location's weather with its client's
+    fetch_weather and refreshes it again once the feed's ttl has passed.
+    get() always returns the last weather data fetched successfully, even
+    while a refresh is in progress or after a refresh failed, so reads never
+    wait for the network.
+
+    Each refresh is scheduled with random jitter so that locations fetched
+    together don't stay synchronized. A location whose refresh fails, or
+    whose feed has no weather data, is retried with exponential backoff.
+
+    Refreshes run on a pool of threads once start() has been called.
+    Alternatively, refresh_due() refreshes the due locations in the calling
+    thread.
+
+    Attributes:
+        client: the Client used to fetch weather data.
+        metric: whether metric weather data is fetched.
+
+    Methods:
+        watch: start refreshing locations.
+        unwatch: stop refreshing locations.
+        get: return a location's last weather data.
+        age: return how old a location's weather data is.
+        lag: return how far behind schedule the refreshes are.
+        error: return the exception raised by a location's last refresh.
+        refresh_due: refresh the due locations in the calling thread.
+        start: start refreshing in the background.
+        stop: stop refreshing in the background.
+
+    """
+
+    def __init__(self, client, ids=(), metric=False, jitter=0.1,
+                 min_interval=60, max_backoff=60 * 60, max_workers=8,
+                 clock=time.time, random=random.random):
+        """Create a refresher.
+
+        Args:
+            client: (Client) the client used to fetch weather data.
+            ids: (iterable) the WOEIDs or LIDs to watch; defaults to none.
+            metric: (bool) fetch metric data; defaults to False.
+            jitter: (float) the largest fraction by which a refresh is
+                moved earlier or later at random; defaults to 0.1.
+            min_interval: (float) the least number of seconds between
+                refreshes, and the delay before the first retry of a failed
+                refresh; defaults to 60.
+            max_backoff: (float) the most seconds between retries of a
+                failing refresh; defaults to one hour.
+            max_workers: (int) the number of threads used by start();
+                defaults to 8.
+            clock: (callable) returns the current time in seconds; defaults
+                to time.time.
+            random: (callable) returns a random float in [0, 1); defaults to
+                random.random.
+
+        """
+        self.client = client
+        self.metric = metric
+        self.jitter = jitter
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self._clock = clock
+        self._random = random
+
+        # _entries maps each watched id to [weather, fetched at, due at,
+        # failures, refreshing, last error]. _schedule is a heap of
+        # (due at, id); entries whose due time changed are skipped.
+
+        self._entries = {}
+        self._schedule = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._stopping = False
+        self.watch(ids)
+
+    def watch(self, ids):
+        """Start refreshing the locations *ids*. They are due at once."""
+        now = self._clock()
+        with self._condition:
+            for id in ids:
+                if id not in self._entries:
+                    self._entries[id] = [None, None, now, 0, False, None]
+                    heapq.heappush(self._schedule, (now, id))
+            self._condition.notify()
+
+    def unwatch(self, ids):
+        """Stop refreshing the locations *ids* and forget their data."""
+        with self._condition:
+            for id in ids:
+                self._entries.pop(id, None)
+
+    def get(self, id):
+        """Return a location's last weather data.
+
+        Returns:
+            the weather data, as returned by fetch_weather, or None if it
+            hasn't been fetched yet.
+
+        Raises:
+            KeyError: *id* isn't watched.
+
+        """
+        return self._entries[id][0]
+
+    def age(self, id):
+        """Return the number of seconds since a location's weather data was
+        fetched, or None if it hasn't been fetched yet.
+
+        Raises:
+            KeyError: *id* isn't watched.
+
+        """
+        fetched_at = self._entries[id][1]
+        if fetched_at is None:
+            return None
+        return self._clock() - fetched_at
+
+    def error(self, id):
+        """Return the exception raised by a location's last refresh, or None
+        if it succeeded. A refresh that found no weather data in the feed
+        fails with a LookupError.
+
+        Raises:
+            KeyError: *id* isn't watched.
+
+        """
+        return self._entries[id][5]
+
+    def lag(self):
+        """Return how many seconds the most overdue refresh is behind
+        schedule, or 0 if no refresh is overdue."""
+        now = self._clock()
+        with self._condition:
+            due = [entry[2] for entry in self._entries.values()]
+        if not due:
+            return 0
+        return max(0, now - min(due))
+
+    def refresh_due(self):
+        """Refresh the locations that are due in the calling thread.
+
+        Returns:
+            the number of locations refreshed.
+
+        """
+        ids = self._take_due()
+        for id in ids:
+            self._refresh(id)
+        return len(ids)
+
+    def start(self):
+        """Start refreshing in the background."""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.max_workers)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop refreshing in the background and wait for the refreshes in
+        progress."""
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self):
+        """Submit due refreshes until the refresher is stopped."""
+        while True:
+            for id in self._take_due():
+                self._executor.submit(self._refresh, id)
+            with self._condition:
+                if self._stopping:
+                    return
+                self._condition.wait(self._until_due())
+
+    def _until_due(self):
+        """Return the seconds until the next refresh is due, or None."""
+        while self._schedule:
+            due, id = self._schedule[0]
+            entry = self._entries.get(id)
+            if entry is not None and entry[2] == due and not entry[4]:
+                return max(0, due - self._clock())
+            heapq.heappop(self._schedule)
+        return None
+
+    def _take_due(self):
+        """Mark the due locations as refreshing and return their ids."""
+        ids = []
+        now = self._clock()
+        with self._condition:
+            while self._schedule and self._schedule[0][0] <= now:
+                due, id = heapq.heappop(self._schedule)
+                entry = self._entries.get(id)
+                if entry is not None and entry[2] == due and not entry[4]:
+                    entry[4] = True
+                    ids.append(id)
+        return ids
+
+    def _refresh(self, id):
+        """Fetch a location's weather and schedule its next refresh."""
+        try:
+            weather = self.client.fetch_weather(id, self.metric,
+                                                use_cache=False)
+        except Exception as e:
+            weather = None
+            error = e
+        else:
+            error = None
+            if weather is None:
+                error = LookupError("no weather data for {0!r}".format(id))
+        now = self._clock()
+        with self._condition:
+            entry = self._entries.get(id)
+            if entry is None:
+                return
+            entry[5] = error
+            if error is None:
+                entry[0] = weather
+                entry[1] = now
+                entry[3] = 0
+                delay = max(self.min_interval,
+                            self.client._ttl_seconds(weather))
+            else:
+                entry[3] += 1
+                delay = min(self.max_backoff,
+                            self.min_interval * 2 ** (entry[3] - 1))
+            delay *= 1 + self.jitter * (2 * self._random() - 1)
+            entry[2] = now + delay
+            entry[4] = False
+            heapq.heappush(self._schedule, (entry[2], id))
+            self._condition.notify()
+
+
+class ChangeTracker(object):
+
+    """Track the weather of many locations and report only what changed.
+
+    The tracker keeps the last weather data seen for each id. Each new
+    result is compared with it and reduced to a delta: a dict that holds
+    the id, the feed's lastBuildDate, the condition, wind and atmosphere
+    fields whose values changed, and the forecast days that are new or
+    changed. Sections without changes are left out. The first result for an
+    id is reported in full.
+
+    A result with the same lastBuildDate and guid as the last one is taken
+    to be unchanged without comparing any fields, as is the very same
+    result object (for example, one returned from the client's cache or
+    after a 304 Not Modified response).
+
+    Attributes:
+        client: the Client used to fetch weather data.
+        metric: whether metric weather data is fetched.
+        stats: a dict that counts the results found unchanged by the
+            lastBuildDate and guid ("unchanged_fast") or by comparing them
+            ("unchanged"), and the results that changed ("changed").
+
+    Methods:
+        update: fetch a location's weather and return its delta.
+        update_many: fetch many locations' weather and yield their deltas.
+        track: return the delta of weather data fetched elsewhere.
+        last: return a location's last weather data.
+        forget: stop tracking a location.
+
+    """
+
+    sections = ("condition", "wind", "atmosphere")
+
+    def __init__(self, client, metric=False):
+        """Create a tracker.
+
+        Args:
+            client: (Client) the client used to fetch weather data.
+            metric: (bool) fetch metric data; defaults to False.
+
+        """
+        self.client = client
+        self.metric = metric
+        self.stats = {"unchanged_fast": 0, "unchanged": 0, "changed": 0}
+        self._lock = threading.Lock()
+
+        # _last maps each id to its last result and that result as a dict.
+        # {id: (weather, data)}
+
+        self._last = {}
+
+    def update(self, id):
+        """Fetch a location's weather and return its delta.
+
+        Returns:
+            a dict describing what changed since the last result, or None
+                if nothing changed or the weather data couldn't be fetched.
+
+        Raises:
+            urllib.error.URLError: urllib.request could not open the URL.
+            xml.etree.ElementTree.ParseError: xml.etree.ElementTree failed to
+                parse the XML document.
+
+        """
+        return self.track(id, self.client.fetch_weather(id, self.metric))
+
+    def update_many(self, ids, **kwargs):
+        """Fetch many locations' weather with the client's
+        fetch_weather_many and yield the deltas of those that changed.
+
+        Errors are yielded instead of a delta, so one failing location
+        doesn't stop the others. Extra keyword arguments are passed on to
+        fetch_weather_many.
+
+        Yields:
+            a BulkResult whose weather attribute holds the delta for each id
+                that changed or failed.
+
+        """
+        for result in self.client.fetch_weather_many(ids, self.metric,
+                                                     **kwargs):
+            if result.error is not None:
+                yield result
+                continue
+            delta = self.track(result.id, result.weather)
+            if delta is not None:
+                yield BulkResult(result.id, delta, None)
+
+    def track(self, id, weather):
+        """Return the delta of weather data fetched elsewhere and remember
+        it as the location's last result.
+
+        Args:
+            id: (string) the location's WOEID or LID.
+            weather: the location's weather data as returned by
+                fetch_weather: a dict, a Weather record or None.
+
+        Returns:
+            a dict describing what changed since the last result, or None
+                if nothing changed or *weather* is None.
+
+        """
+        if weather is None:
+            return None
+        with self._lock:
+            last = self._last.get(id)
+        if last is not None and last[0] is weather:
+            with self._lock:
+                self.stats["unchanged_fast"] += 1
+            return None
+        data = weather.to_dict() if isinstance(weather, Weather) else weather
+        if last is not None:
+            previous = last[1]
+            if (data.get("lastBuildDate") is not None and
+                    data.get("lastBuildDate") == previous.get(
+                        "lastBuildDate") and
+                    data.get("guid") == previous.get("guid")):
+                with self._lock:
+                    self._last[id] = (weather, data)
+                    self.stats["unchanged_fast"] += 1
+                return None
+        else:
+            previous = {}
+        delta = self._diff(previous, data)
+        with self._lock:
+            self._last[id] = (weather, data)
+            if delta:
+                self.stats["changed"] += 1
+            else:
+                self.stats["unchanged"] += 1
+        if not delta:
+            return None
+        delta["id"] = id
+        delta["lastBuildDate"] = data.get("lastBuildDate")
+        return delta
+
+    def last(self, id, default=None):
+        """Return the last weather data seen for *id* or *default*."""
+        with self._lock:
+            last = self._last.get(id)
+        if last is None:
+            return default
+        return last[0]
+
+    def forget(self, id):
+        """Stop tracking *id*, so that its next result is reported in
+        full."""
+        with self._lock:
+            self._last.pop(id, None)
+
+    def _diff(self, previous, data):
+        """Return the changed sections of *data* compared with *previous*
+        as a dict."""
+        delta = {}
+        for section in self.sections:
+            new = data.get(section) or {}
+            old = previous.get(section) or {}
+            changed = dict((field, value) for (field, value) in new.items()
+                           if old.get(field, _MISSING) != value)
+            if changed:
+                delta[section] = changed
+        old_days = dict((day.get("date"), day)
+                        for day in previous.get("forecast") or ())
+        days = [day for day in data.get("forecast") or ()
+                if old_days.get(day.get("date")) != day]
+        if days:
+            delta["forecast"] = days
+        return delta
+
+
+ShardResult = collections.namedtuple(
+    "ShardResult", "shard path count errors seconds throughput")
+ShardResult.__doc__ = """A shard of locations whose weather sweep has fetched.
+
+Attributes:
+    shard: the shard's index.
+    path: the file the shard's weather data was written to.
+    count: the number of locations in the shard.
+    errors: the number of locations whose weather couldn't be fetched.
+    seconds: the time the shard took.
+    throughput: the shard's locations per second.
+
+"""
+
+# Each sweep worker process keeps its own client for all of its shards.
+
+_sweep_client = None
+
+
+def _sweep_init(client_factory, threads):
+    """Create the client of a sweep worker process."""
+    global _sweep_client
+    if client_factory is None:
+        _sweep_client = Client(transport=PooledTransport(pool_size=threads))
+    else:
+        _sweep_client = client_factory()
+
+
+def _sweep_shard(shard, ids, path, format, metric, threads):
+    """Fetch one shard's weather in a worker process and write it to
+    *path*."""
+    started = time.perf_counter()
+    if format == "csv":
+        table = _sweep_client.fetch_weather_columns(ids, metric,
+                                                    max_workers=threads)
+        errors = len(table.errors)
+        with open(path, "w", newline="") as f:
+            table.to_csv(f)
+    else:
+        errors = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for result in _sweep_client.fetch_weather_many(
+                    ids, metric, max_workers=threads):
+                if result.error is not None:
+                    errors += 1
+                    line = {"id": result.id, "error": "%s: %s" % (
+                        type(result.error).__name__, result.error)}
+                else:
+                    weather = result.weather
+                    if isinstance(weather, Weather):
+                        weather = weather.to_dict()
+                    line = {"id": result.id, "weather": weather}
+                f.write(json.dumps(line, ensure_ascii=False,
+                                   separators=(",", ":")))
+                f.write("\n")
+    seconds = time.perf_counter() - started
+    return ShardResult(shard, path, len(ids), errors, seconds,
+                       len(ids) / seconds if seconds else None)
+
+
+def sweep(ids, directory, format="ndjson", metric=False, processes=None,
+          shards=None, threads=8, client_factory=None):
+    """Fetch many locations' weather on a pool of processes.
+
+    *ids* is split into *shards* contiguous shards, which are fetched by a
+    pool of *processes* worker processes. Each worker keeps one client,
+    with a PooledTransport, for all of its shards and fetches a shard's
+    locations with fetch_weather_many on *threads* threads. A worker writes
+    each shard's weather data straight to its own file in *directory*, so
+    the data never passes through this process; only a ShardResult is sent
+    back.
+
+    With format="ndjson", a shard's file (shard-NNNNN.ndjson) has a JSON
+    object per location, with its "id" and either its "weather" data or an
+    "error" message. With format="csv", the file (shard-NNNNN.csv) holds the
+    shard's WeatherColumns rows, as written by WeatherColumns.to_csv.
+
+    Args:
+        ids: (iterable) the locations' WOEIDs or LIDs.
+        directory: (string) the directory the shard files are written to;
+            it is created if it doesn't exist.
+        format: (string) "ndjson" or "csv"; defaults to "ndjson".
+        metric: (bool) fetch metric data; defaults to False.
+        processes: (int) the number of worker processes; defaults to the
+            number of CPUs.
+        shards: (int) the number of shards; defaults to four per process.
+        threads: (int) the number of threads in each worker; defaults to 8.
+        client_factory: (function) a picklable function that returns the
+            client of each worker; defaults to None (a Client with a
+            PooledTransport).
+
+    Returns:
+        an iterator that starts the worker processes and yields a
+        ShardResult for each shard, in the order they complete.
+
+    Raises:
+        ValueError: *format* isn't "ndjson" or "csv".
+
+    """
+    if format not in ("ndjson", "csv"):
+        raise ValueError("unknown sweep format: %s" % format)
+    ids = list(ids)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if shards is None:
+        shards = processes * 4
+    shards = max(1, min(shards, len(ids)))
+    os.makedirs(directory, exist_ok=True)
+    return _sweep(ids, directory, format, metric, processes, shards, threads,
+                  client_factory)
+
+
+def _sweep(ids, directory, format, metric, processes, shards, threads,
+           client_factory):
+    """Fetch the shards of a sweep and yield their ShardResults."""
+    (size, extra) = divmod(len(ids), shards)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        processes, initializer=_sweep_init,
+        initargs=(client_factory, threads))
+    futures = []
+    try:
+        start = 0
+        for shard in range(shards):
+            end = start + size + (shard < extra)
+            path = os.path.join(directory,
+                                "shard-%05d.%s" % (shard, format))
+            futures.append(executor.submit(_sweep_shard, shard,
+                                           ids[start:end], path, format,
+                                           metric, threads))
+            start = end
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def sweep_main(argv=None):
+    """Run the yweather-sweep command with the arguments *argv*.
+
+    Reads WOEIDs or LIDs, one per line, from a file (or standard input),
+    sweeps their weather into a directory, and prints each shard's
+    throughput as it completes.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="yweather-sweep",
+        description="Fetch many locations' weather on a pool of processes.")
+    parser.add_argument("ids", help="a file of WOEIDs or LIDs, one per line "
+                                    "(- for standard input)")
+    parser.add_argument("directory", help="the directory to write the "
+                                          "shard files to")
+    parser.add_argument("--format", choices=("ndjson", "csv"),
+                        default="ndjson",
+                        help="the shard files' format (default: ndjson)")
+    parser.add_argument("--metric", action="store_true",
+                        help="fetch metric data")
+    parser.add_argument("--processes", type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--shards", type=int,
+                        help="shards (default: four per process)")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="threads per worker (default: 8)")
+    args = parser.parse_args(argv)
+
+    if args.ids == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.ids) as f:
+            lines = f.readlines()
+    ids = [line.strip() for line in lines if line.strip()]
 
-    def _fetch_xml(self, url):
-        """Fetch a url and parse the document's XML."""
-        with contextlib.closing(urlopen(url)) as f:
-            return xml.etree.ElementTree.parse(f).getroot()
+    started = time.perf_counter()
+    count = errors = 0
+    for result in sweep(ids, args.directory, args.format, args.metric,
+                        args.processes, args.shards, args.threads):
+        count += result.count
+        errors += result.errors
+        print("shard %d: %d locations, %d errors, %.2f s, %.1f/s" % (
+            result.shard, result.count, result.errors, result.seconds,
+            result.throughput or 0))
+    seconds = time.perf_counter() - started
+    print("total: %d locations, %d errors, %.2f s, %.1f/s" % (
+        count, errors, seconds, count / seconds if seconds else 0))
+    return 1 if errors else 0